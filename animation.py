@@ -0,0 +1,150 @@
+'''Animating GameObjects by cycling through loaded images.
+
+An Animation is a cycle of names of images in the ImageLibrary, each
+shown for the same number of seconds. An Animator plays Animations on
+GameObjects by simulated time, so animations run at the same pace
+whatever the frame rate and are repeated exactly by a replay.
+
+The scaled copies of every frame are acquired from the ImageLibrary once
+per size when the first GameObject of that size starts an Animation, and
+kept until the last one stops, so changing frames never scales an image
+or creates an ImageTk.PhotoImage. GameObjects are split into a few
+groups with different phases, so that not every wombat steps at once.
+Each group waits on a single timer of the Game and, when it fires,
+changes the image of its GameObjects only if their frame changed.
+'''
+import math
+from game import ImageLibrary
+
+
+
+class Animation:
+    '''Animation is a cycle of image names, each shown for frame_time seconds.'''
+
+    def __init__(self, names, frame_time):
+        '''Creates an Animation of the images loaded under the given names.'''
+        if not names:
+            raise ValueError("an Animation needs at least one frame")
+        self.names = tuple(names)
+        self.frame_time = frame_time
+        self.duration = frame_time * len(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def frame_at(self, time):
+        '''Returns the number of frames shown since time 0, rounded down.'''
+        return math.floor(time / self.frame_time + 1e-9)
+
+    def name_at(self, time):
+        '''Returns the name of the image shown at the given time.'''
+        return self.names[self.frame_at(time) % len(self.names)]
+
+
+
+class Animator:
+    '''Animator changes the images of GameObjects playing an Animation.
+
+    GameObjects are given to play, and are dropped when they are
+    destroyed or given to stop. Each is put into one of phases groups
+    per Animation, offset from each other by a fraction of a frame. If
+    the Game has nothing to draw into, play only sets the first image
+    and no timers are scheduled.
+    '''
+
+    def __init__(self, game, phases=4):
+        '''Creates an Animator for the GameObjects of game.'''
+        self.__game = game
+        self.phases = phases
+        self.swaps = 0
+        self.__groups = {}
+        self.__playing = {}
+        self.__frames = {}
+        self.__started = 0
+        self.__enabled = game.get_window().get_renderer() != None
+
+    def __len__(self):
+        return len(self.__playing)
+
+    def play(self, obj, animation):
+        '''Starts playing the Animation on the GameObject.'''
+        self.stop(obj)
+        phase = self.__started % self.phases
+        self.__started += 1
+        offset = phase * animation.frame_time / self.phases
+        obj.set_image(ImageLibrary.get(animation.name_at(self.__game.get_time() + offset)))
+        if not self.__enabled or len(animation) == 1:
+            return
+        key = (animation, phase)
+        group = self.__groups.get(key)
+        if group == None:
+            group = self.__groups[key] = [{}, None, None]
+        size = self.__pin(obj, animation)
+        group[0][id(obj)] = obj
+        self.__playing[id(obj)] = (key, size)
+        if group[1] == None:
+            self.__wait(key, group)
+
+    def stop(self, obj):
+        '''Stops playing an Animation on the GameObject; it keeps its current image.'''
+        entry = self.__playing.pop(id(obj), None)
+        if entry == None:
+            return
+        key, size = entry
+        group = self.__groups[key]
+        del group[0][id(obj)]
+        self.__unpin(key[0], size)
+        if not group[0]:
+            if group[1] != None:
+                self.__game.cancel_timer(group[1])
+            del self.__groups[key]
+
+    def is_playing(self, obj):
+        '''Returns True if an Animation is playing on the GameObject.'''
+        return id(obj) in self.__playing
+
+    def frame_sizes(self):
+        '''Returns the number of (Animation, width, height) whose frames are cached.'''
+        return len(self.__frames)
+
+    def __pin(self, obj, animation):
+        photo = not self.__game.is_headless()
+        size = (animation, int(obj.get_width()), int(obj.get_height()), photo)
+        entry = self.__frames.get(size)
+        if entry == None:
+            for name in animation.names:
+                ImageLibrary.acquire(name, size[1], size[2], photo)
+            entry = self.__frames[size] = [0]
+        entry[0] += 1
+        return size
+
+    def __unpin(self, animation, size):
+        entry = self.__frames[size]
+        entry[0] -= 1
+        if entry[0] == 0:
+            del self.__frames[size]
+            for name in animation.names:
+                ImageLibrary.release(name, size[1], size[2], size[3])
+
+    def __wait(self, key, group):
+        animation, phase = key
+        offset = phase * animation.frame_time / self.phases
+        frame = animation.frame_at(self.__game.get_time() + offset)
+        group[2] = frame % len(animation)
+        delay = (frame + 1) * animation.frame_time - offset - self.__game.get_time()
+        group[1] = self.__game.schedule(max(delay, 0.0), lambda: self.__advance(key))
+
+    def __advance(self, key):
+        group = self.__groups[key]
+        group[1] = None
+        previous = group[2]
+        self.__wait(key, group)
+        if group[2] == previous:
+            return
+        image = ImageLibrary.get(key[0].names[group[2]])
+        for obj in list(group[0].values()):
+            if obj.is_destroyed():
+                self.stop(obj)
+            elif obj.get_image() is not image:
+                obj.set_image(image)
+                self.swaps += 1
@@ -0,0 +1,297 @@
+'''Benchmarks for the game and ecosim modules.
+
+Run with python benchmark.py. Each benchmark prints one line of results.
+
+The scenario suite runs EcoSim for a number of ticks at several
+population and grid sizes, headless and while drawing, and reports
+ticks per second, the 50th and 99th percentile tick latency, the peak
+resident memory and the memory allocated per tick. Each scenario runs in
+a fresh process, so that peak memory is not carried over between them.
+Results may be written to a JSON file and compared with a stored
+baseline.
+'''
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from game import Game, ImageLibrary, RecordingRenderer, Vector2D
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+
+IMAGE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'images')
+POPULATIONS = (10, 1000, 10000, 100000)
+GRIDS = ((12, 10), (100, 100))
+MODES = ("headless", "recorded")
+
+
+
+def _count_vectors(function):
+    '''Runs function and returns how many Vector2D objects it created.'''
+    original = Vector2D.__init__
+    created = [0]
+
+    def counting_init(self, x, y):
+        created[0] += 1
+        original(self, x, y)
+
+    Vector2D.__init__ = counting_init
+    try:
+        function()
+    finally:
+        Vector2D.__init__ = original
+    return created[0]
+
+
+def bench_vector(animals=1000, ticks=100, seed=0):
+    '''Compares the old chained movement code of Wombat.update with the
+    in-place Vector2D methods used now.
+
+    Returns a dictionary with, for both versions, the seconds per tick, the
+    Vector2D objects created per tick and the peak traced memory.
+    '''
+    rng = random.Random(seed)
+    starts = [(rng.uniform(0, 1152), rng.uniform(0, 984)) for i in range(animals)]
+    targets = [Vector2D(rng.randint(0, 11) * 96, rng.randint(0, 9) * 96) for i in range(animals)]
+    step = 10 / 60
+
+    def chained():
+        positions = [Vector2D(x, y) for x, y in starts]
+        for tick in range(ticks):
+            for position, target in zip(positions, targets):
+                trajectory = target.subtract(position).normalize().scale(step)
+                position.x += trajectory.x
+                position.y += trajectory.y
+                position.distance(target) < 48
+
+    def in_place():
+        positions = [Vector2D(x, y) for x, y in starts]
+        trajectory = Vector2D(0, 0)
+        for tick in range(ticks):
+            for position, target in zip(positions, targets):
+                position.step_toward(target, step, trajectory)
+                position.x += trajectory.x
+                position.y += trajectory.y
+                position.distance_squared(target) < 48 * 48
+
+    results = {}
+    for name, function in (("chained", chained), ("in_place", in_place)):
+        created = _count_vectors(function) - animals
+        start = time.perf_counter()
+        function()
+        seconds = time.perf_counter() - start
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[name] = {
+            "seconds_per_tick": seconds / ticks,
+            "vectors_per_tick": created / ticks,
+            "peak_bytes": peak,
+        }
+    return results
+
+
+def scenario_name(population, grid, mode, engine):
+    '''Returns the name a scenario is stored under in results and baselines.'''
+    return f"{engine}-{mode}-{population}-{grid[0]}x{grid[1]}"
+
+
+def bench_scenario(population, grid, mode="headless", engine="objects", ticks=100,
+                   warmup=10, alloc_ticks=10, seed=0):
+    '''Runs EcoSim with population animals on a grid of (cols, rows) tiles.
+
+    mode is "headless" for no drawing, "recorded" to draw into a
+    RecordingRenderer, or "window" to draw into a Tk window. engine is
+    "objects" to update every animal itself, or "herd" to use the
+    HerdEngine. After warmup ticks, ticks ticks are timed one by one;
+    then alloc_ticks ticks are run under tracemalloc to measure how many
+    bytes each tick allocates at its peak.
+
+    Returns a dictionary of results.
+    '''
+    from ecosim import EcoSim
+    try:
+        ImageLibrary.get('wombat1')
+    except KeyError:
+        ImageLibrary.load(IMAGE_PATH, verbose=False)
+    renderer = RecordingRenderer() if mode == "recorded" else None
+    snakes = population // 3
+    start = time.perf_counter()
+    sim = EcoSim(headless=mode != "window", renderer=renderer, herd=engine == "herd",
+                 cols=grid[0], rows=grid[1], wombats=population - snakes, snakes=snakes,
+                 birds=0, seed=seed)
+    setup = time.perf_counter() - start
+    window = sim.get_window()
+    time_step = Game.TIME_STEP
+
+    def tick():
+        sim.step(time_step)
+        window.update()
+        if renderer != None:
+            renderer.clear()
+
+    for i in range(warmup):
+        tick()
+    latencies = []
+    for i in range(ticks):
+        start = time.perf_counter()
+        tick()
+        latencies.append(time.perf_counter() - start)
+    allocated = []
+    tracemalloc.start()
+    for i in range(alloc_ticks):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        tick()
+        allocated.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    if mode == "window":
+        window.destroy()
+
+    latencies.sort()
+    return {
+        "name": scenario_name(population, grid, mode, engine),
+        "population": population,
+        "grid": list(grid),
+        "mode": mode,
+        "engine": engine,
+        "ticks": ticks,
+        "setup_seconds": setup,
+        "ticks_per_second": ticks / sum(latencies),
+        "p50_ms": _percentile(latencies, 0.5) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "peak_rss_kib": _peak_rss_kib(),
+        "alloc_bytes_per_tick": sum(allocated) / max(len(allocated), 1),
+    }
+
+
+def _percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _peak_rss_kib():
+    if resource == None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak //= 1024
+    return peak
+
+
+def run_suite(populations=POPULATIONS, grids=GRIDS, modes=MODES, engines=("objects",),
+              ticks=100, warmup=10, seed=0, report=None):
+    '''Runs bench_scenario for every combination of the arguments, each
+    in a new process. Calls report with each result as it finishes, and
+    returns a list of all results.'''
+    results = []
+    for engine in engines:
+        for mode in modes:
+            for grid in grids:
+                for population in populations:
+                    with ProcessPoolExecutor(1) as pool:
+                        result = pool.submit(bench_scenario, population, grid, mode, engine,
+                                             ticks, warmup, seed=seed).result()
+                    results.append(result)
+                    if report != None:
+                        report(result)
+    return results
+
+
+def compare(results, baseline):
+    '''Compares results with the results of a baseline run.
+
+    Returns a list of (name, metric, baseline value, new value, change)
+    for every scenario in both, where change is the relative change of
+    the metric.
+    '''
+    previous = {result["name"]: result for result in baseline}
+    changes = []
+    for result in results:
+        old = previous.get(result["name"])
+        if old == None:
+            continue
+        for metric in ("ticks_per_second", "p50_ms", "p99_ms", "alloc_bytes_per_tick"):
+            if old[metric]:
+                change = result[metric] / old[metric] - 1
+                changes.append((result["name"], metric, old[metric], result[metric], change))
+    return changes
+
+
+def regressions(changes, tolerance=0.1):
+    '''Returns the changes from compare that are regressions: ticks per
+    second that fell, or p99 latencies that rose, by more than tolerance.'''
+    return [change for change in changes
+            if (change[1] == "ticks_per_second" and change[4] < -tolerance)
+            or (change[1] == "p99_ms" and change[4] > tolerance)]
+
+
+def _print_result(result):
+    rss = result["peak_rss_kib"]
+    print(f"{result['name']}: {result['ticks_per_second']:.1f} ticks/s, "
+          f"p50 {result['p50_ms']:.3f} ms, p99 {result['p99_ms']:.3f} ms, "
+          f"peak RSS {'-' if rss == None else f'{rss / 1024:.1f} MiB'}, "
+          f"{result['alloc_bytes_per_tick'] / 1024:.1f} KiB/tick", flush=True)
+
+
+def _grid(text):
+    cols, rows = text.lower().split("x")
+    return (int(cols), int(rows))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the simulation.")
+    parser.add_argument("--suite", choices=("scenarios", "vector"), default="scenarios")
+    parser.add_argument("--animals", type=int, default=1000,
+                        help="animals in the vector benchmark")
+    parser.add_argument("--ticks", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--populations", type=int, nargs="+", default=list(POPULATIONS))
+    parser.add_argument("--grids", type=_grid, nargs="+", default=list(GRIDS),
+                        help="grid sizes as COLSxROWS")
+    parser.add_argument("--modes", nargs="+", choices=("headless", "recorded", "window"),
+                        default=list(MODES))
+    parser.add_argument("--engines", nargs="+", choices=("objects", "herd"),
+                        default=["objects"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="write the results to a JSON file")
+    parser.add_argument("--baseline", default=None,
+                        help="compare with the results in a JSON file written by --output")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    if args.suite == "vector":
+        for name, result in bench_vector(args.animals, args.ticks).items():
+            print(f"vector {name}: {result['seconds_per_tick'] * 1000:.3f} ms/tick, "
+                  f"{result['vectors_per_tick']:.0f} Vector2D/tick, "
+                  f"peak {result['peak_bytes'] / 1024:.1f} KiB")
+        return
+
+    results = run_suite(args.populations, args.grids, args.modes, args.engines,
+                        args.ticks, args.warmup, args.seed, _print_result)
+    if args.output != None:
+        with open(args.output, "w") as file:
+            json.dump({"python": platform.python_version(), "platform": platform.platform(),
+                       "results": results}, file, indent=2)
+    if args.baseline != None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+        changes = compare(results, baseline)
+        for name, metric, old, new, change in changes:
+            print(f"{name} {metric}: {old:.3f} -> {new:.3f} ({change:+.1%})")
+        failed = regressions(changes, args.tolerance)
+        if failed:
+            print(f"{len(failed)} regressions beyond {args.tolerance:.0%}")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
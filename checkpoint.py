@@ -0,0 +1,260 @@
+'''Saving the state of an EcoSim to a file and resuming it later.
+
+An EcoSim cannot be pickled, as its GameObjects hold Tk images and
+canvas items. A checkpoint instead stores only the simulation state, in
+a compact binary file:
+
+    magic     8 bytes, b"ECOCKPT\\0"
+    version   uint32, little-endian
+    length    uint32, the length of the metadata
+    metadata  UTF-8 JSON: the EcoSim's arguments, the simulated time,
+              random number generator states and a table of sections
+    sections  raw little-endian NumPy arrays, each starting at an
+              offset that is a multiple of 16 bytes
+
+The sections hold the tile of every grid cell, the vegetation grid,
+every animal, the waypoint of every animal if it navigates around
+water, the seconds every animal is owed by update tiers, and every
+grass tuft or flower with the time left on its growth timer. A
+checkpoint is read through a memory map. Loading creates the
+GameObjects again, but their sprites are only drawn if they are in
+view, and the terrain is only baked as it is shown. NumPy is optional;
+it is only needed to save or load a checkpoint.
+'''
+import json
+import mmap
+import struct
+try:
+    import numpy as np
+    from numpy.lib.format import dtype_to_descr, descr_to_dtype
+except ImportError:
+    np = None
+from game import Vector2D
+from ecosim import (EcoSim, Animal, Wombat, Snake, Bird, Grass, Flower, DirtTile, SandTile,
+                    WaterTile)
+
+
+
+MAGIC = b"ECOCKPT\0"
+VERSION = 1
+HEADER = struct.Struct("<8sII")
+ALIGNMENT = 16
+ANIMAL_KINDS = (Wombat, Snake, Bird)
+PLANT_KINDS = (Grass, Flower)
+TILE_KINDS = {'dirt_tile': DirtTile, 'sand_tile': SandTile, 'water_tile': WaterTile}
+
+
+def _animal_dtype():
+    return np.dtype([("kind", "u1"), ("x", "<f8"), ("y", "<f8"), ("target_x", "<f8"),
+                     ("target_y", "<f8"), ("has_target", "u1"), ("energy", "<f8"),
+                     ("speed", "<f8")])
+
+
+def _route_dtype():
+    return np.dtype([("x", "<f8"), ("y", "<f8"), ("goal_col", "<i4"), ("goal_row", "<i4")])
+
+
+def _plant_dtype():
+    return np.dtype([("kind", "u1"), ("x", "<f8"), ("y", "<f8"), ("timer", "<f8")])
+
+
+def save(sim, path):
+    '''Writes the state of the EcoSim to a checkpoint file.
+
+    Should be called between steps. Raises an ImportError if NumPy is
+    not installed.
+    '''
+    if np is None:
+        raise ImportError("checkpoints require numpy")
+    sections = {}
+
+    names = [None]
+    indices = {None: 0}
+    tiles = []
+    for row in range(sim.rows):
+        for col in range(sim.cols):
+            name = sim.terrain_at(col, row)
+            if name not in indices:
+                indices[name] = len(names)
+                names.append(name)
+            tiles.append(indices[name])
+    sections["tiles"] = np.array(tiles, dtype="u1" if len(names) < 256 else "<u2")
+
+    vegetation = sim.vegetation
+    if vegetation != None:
+        sections["fertile"] = vegetation.fertile.astype("u1").ravel()
+        sections["state"] = vegetation.state.astype("i1").ravel()
+        sections["biomass"] = vegetation.biomass.astype("<f4").ravel()
+
+    if sim.herd != None:
+        sim.herd.sync()
+        animals = sim.herd.get_animals(pending=True)
+    else:
+        animals = [obj for obj in sim._get_game_objs() if isinstance(obj, Animal)]
+    records = []
+    for animal in animals:
+        target = getattr(animal, "target", None)
+        records.append((ANIMAL_KINDS.index(type(animal)), animal.get_x(), animal.get_y(),
+                        target.x if target != None else 0.0,
+                        target.y if target != None else 0.0,
+                        target != None, animal.energy, animal.speed))
+    sections["animals"] = np.array(records, dtype=_animal_dtype())
+    if sim.get_update_tiers() != None:
+        sections["owed"] = np.array([sim._gameObjects.owed(animal) for animal in animals],
+                                    dtype="<f8")
+    if sim.navigation != None:
+        routes = [animal._route for animal in animals]
+        sections["routes"] = np.array(
+            [(route.point.x, route.point.y) + (route.goal if route.goal != None else (-1, -1))
+             for route in routes], dtype=_route_dtype())
+
+    plants = []
+    if vegetation == None:
+        for kind in PLANT_KINDS:
+            plants.extend(sim.get_game_objs_of_type(kind))
+    timers = {id(plant): plant._growth for plant in plants
+              if plant._growth != None and plant._growth.active()}
+    plants.sort(key=lambda plant: (timers[id(plant)].time, timers[id(plant)].order)
+                if id(plant) in timers else (float("inf"), 0))
+    now = sim.get_time()
+    records = [(PLANT_KINDS.index(type(plant)), plant.get_x(), plant.get_y(),
+                timers[id(plant)].time - now if id(plant) in timers else float("nan"))
+               for plant in plants]
+    sections["plants"] = np.array(records, dtype=_plant_dtype())
+
+    version, state, gauss = sim.get_random().getstate()
+    sections["random"] = np.array(state, dtype="<u4")
+
+    metadata = {
+        "params": {"cols": sim.cols, "rows": sim.rows, "herd": sim.herd != None,
+                   "vegetation_grid": vegetation != None,
+                   "terrain_layer": sim.terrain != None,
+                   "spatial_index": sim.get_spatial_index() != None,
+                   "tile_objects": sim.tile_objects,
+                   "chunk_size": sim.terrain.chunk_size if sim.terrain != None else 8,
+                   "seed": sim.seed, "foraging": sim.forager != None,
+                   "water_chance": sim.water_chance, "update_tiers": sim.update_tiers},
+        "time": now,
+        "tile_names": names,
+        "random": [version, gauss],
+        "herd_random": sim.herd.get_random().bit_generator.state if sim.herd != None else None,
+        "vegetation": vegetation.get_state() if vegetation != None else None,
+        "sections": {},
+    }
+    offset = 0
+    for name, array in sections.items():
+        metadata["sections"][name] = [offset, dtype_to_descr(array.dtype), len(array)]
+        offset += _aligned(array.nbytes)
+    encoded = json.dumps(metadata).encode("utf-8")
+    start = _aligned(HEADER.size + len(encoded))
+
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(encoded)))
+        file.write(encoded)
+        file.write(bytes(start - HEADER.size - len(encoded)))
+        for array in sections.values():
+            data = array.tobytes()
+            file.write(data)
+            file.write(bytes(_aligned(len(data)) - len(data)))
+
+
+def _aligned(size):
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def load(path, headless=False, renderer=None, width=1152, height=984):
+    '''Creates an EcoSim from a checkpoint file written by save.
+
+    The EcoSim continues exactly where the saved one stopped. Raises a
+    ValueError if the file is not a checkpoint or has an unknown version.
+    '''
+    if np is None:
+        raise ImportError("checkpoints require numpy")
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        magic, version, length = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an EcoSim checkpoint")
+        if version != VERSION:
+            raise ValueError(f"{path} has checkpoint version {version}, expected {VERSION}")
+        metadata = json.loads(bytes(data[HEADER.size:HEADER.size + length]))
+        start = _aligned(HEADER.size + length)
+        sections = {}
+        for name, (offset, descr, count) in metadata["sections"].items():
+            array = np.frombuffer(data, descr_to_dtype(descr), count, start + offset)
+            sections[name] = array.copy()
+            del array
+    return _restore(metadata, sections, headless, renderer, width, height)
+
+
+def _restore(metadata, sections, headless, renderer, width, height):
+    params = metadata["params"]
+    sim = EcoSim(headless=headless, renderer=renderer, width=width, height=height,
+                 setup=False, **params)
+    sim._time = metadata["time"]
+    cols = sim.cols
+    tile_size = EcoSim.TILE_SIZE
+
+    names = metadata["tile_names"]
+    tiles = [names[index] for index in sections["tiles"].tolist()]
+    if sim.tile_objects:
+        for index, name in enumerate(tiles):
+            if name == None:
+                continue
+            row, col = divmod(index, cols)
+            position = Vector2D(col * tile_size, row * tile_size)
+            kind = TILE_KINDS[name]
+            if kind is DirtTile:
+                sim.tiles.append(DirtTile(position, sim, grass=False))
+            else:
+                sim.tiles.append(kind(position, sim))
+    elif sim.terrain != None:
+        sim.terrain.set_tiles(tiles)
+        for index, name in enumerate(tiles):
+            if name == 'water_tile':
+                row, col = divmod(index, cols)
+                sim.tiles.append(WaterTile(Vector2D(col * tile_size, row * tile_size), sim))
+
+    vegetation = sim.vegetation
+    if vegetation != None:
+        shape = (sim.rows, cols)
+        vegetation.fertile[:] = sections["fertile"].reshape(shape) != 0
+        vegetation.state[:] = sections["state"].reshape(shape)
+        vegetation.biomass[:] = sections["biomass"].reshape(shape)
+        vegetation.set_state(metadata["vegetation"])
+        vegetation.sync()
+
+    for kind, x, y, timer in sections["plants"].tolist():
+        plant = PLANT_KINDS[kind](Vector2D(x, y), sim)
+        if plant._growth != None:
+            sim.cancel_timer(plant._growth)
+            plant._growth = None
+        if timer == timer:
+            plant._growth = sim.schedule(timer, plant.grow)
+        if PLANT_KINDS[kind] is Grass and sim.get_spatial_index() != None:
+            tile = sim.tile_at(int(x // tile_size), int(y // tile_size))
+            if isinstance(tile, DirtTile):
+                tile.has_grass = True
+
+    for kind, x, y, target_x, target_y, has_target, energy, speed in \
+            sections["animals"].tolist():
+        animal = ANIMAL_KINDS[kind](Vector2D(x, y), sim)
+        animal.energy = energy
+        animal.speed = speed
+        if has_target:
+            animal.target = Vector2D(target_x, target_y)
+        sim.animals.append(animal)
+    if "owed" in sections:
+        for animal, owed in zip(sim.animals, sections["owed"].tolist()):
+            sim._gameObjects.owe(animal, owed)
+    if "routes" in sections and sim.navigation != None:
+        for animal, (x, y, goal_col, goal_row) in zip(sim.animals, sections["routes"].tolist()):
+            animal._route.point.set(x, y)
+            animal._route.goal = (goal_col, goal_row) if goal_col >= 0 else None
+
+    if sim.herd != None:
+        sim.herd.get_random().bit_generator.state = metadata["herd_random"]
+    version, gauss = metadata["random"]
+    sim.get_random().setstate((version, tuple(sections["random"].tolist()), gauss))
+    if sim.terrain != None:
+        sim.terrain.flush()
+    return sim
@@ -1,35 +1,107 @@
 from game import Game, ImageLibrary, GameObject, Vector2D
-from random import choice, shuffle
+from herd import HerdEngine
+from terrain import TerrainLayer
+from vegetation import VegetationGrid, GRASS, FLOWER
+from snapshot import run_threaded
+from replay import Recorder, Recording, replay
+from telemetry import TelemetryWriter
+from offscreen import OffscreenRenderer, FrameExporter
+from animation import Animation, Animator
+from forage import ForageSystem
+from navigation import FlowFields, Route
+import forage
+import argparse
 import random
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 class Tile(GameObject):
     """
     Represents a base tile in the ecosystem simulation. This is an abstract class for other specific tile types.
+    Tiles never change on their own, so they are not updated every frame.
     """
+    static = True
+
     def __init__(self, position, game, width=96, height=96, sourceImage=None):
         """
         Initializes the tile with a position, size, image, and game reference.
         """
         super().__init__(position, width, height, sourceImage, game)
 
+    def _draw(self):
+        """
+        Draws the tile into the game's terrain layer, or as its own image
+        if the game has no terrain layer.
+        """
+        terrain = getattr(self.get_game(), "terrain", None)
+        if terrain == None:
+            super()._draw()
+        else:
+            terrain.set_tile(int(self.get_x() // terrain.tile_size),
+                             int(self.get_y() // terrain.tile_size),
+                             ImageLibrary.name_of(self.get_image()))
+
+    def destroy(self):
+        """
+        Removes the tile from the game and from the terrain layer.
+        """
+        terrain = getattr(self.get_game(), "terrain", None)
+        if terrain != None:
+            terrain.set_tile(int(self.get_x() // terrain.tile_size),
+                             int(self.get_y() // terrain.tile_size), None)
+        super().destroy()
+
 class DirtTile(Tile):
     """
     Represents a dirt tile that may grow grass in the ecosystem.
+    If the game has a vegetation grid, the grass on the tile is kept there.
     """
-    def __init__(self, position, game):
+    def __init__(self, position, game, grass=None):
         """
         Initializes the dirt tile and has a 50% chance to grow grass on top.
+        If grass is True or False, grass is or is not grown instead.
         """
         image = ImageLibrary.get('dirt_tile')
         super().__init__(position, game, width=96, height=96, sourceImage=image)
-        if random.random() < 0.5:
-            Grass(position, game)
+        self._has_grass = False
+        vegetation = getattr(game, "vegetation", None)
+        if vegetation != None:
+            vegetation.set_fertile(*self.get_cell())
+        if grass == None:
+            grass = game.get_random().random() < 0.5
+        if grass:
+            self.add_grass()
+
+    def get_cell(self):
+        """
+        Returns the (column, row) of the tile.
+        """
+        return (int(self.get_x() // 96), int(self.get_y() // 96))
+
+    @property
+    def has_grass(self):
+        """
+        True if grass is growing on the tile.
+        """
+        vegetation = getattr(self.get_game(), "vegetation", None)
+        if vegetation != None:
+            return vegetation.get(*self.get_cell()) == GRASS
+        return self._has_grass
+
+    @has_grass.setter
+    def has_grass(self, value):
+        self._has_grass = value
     
     def add_grass(self):
         """
         Adds grass to the dirt tile, indicating that grass is growing on it.
         """
-        if not self.has_grass:
+        vegetation = getattr(self.get_game(), "vegetation", None)
+        if vegetation != None:
+            vegetation.plant(*self.get_cell(), GRASS)
+        elif not self.has_grass:
             Grass(self.get_position(), self.get_game())
             self.has_grass = True
 
@@ -37,6 +109,9 @@ class DirtTile(Tile):
         """
         Removes grass from the dirt tile when eaten or destroyed.
         """
+        vegetation = getattr(self.get_game(), "vegetation", None)
+        if vegetation != None:
+            vegetation.clear(*self.get_cell())
         self.has_grass = False
 
     def update(self, timeElapsed):
@@ -58,10 +133,28 @@ class SandTile(Tile):
     def update(self, timeElapsed):
         pass
 
+class WaterTile(Tile):
+    """
+    Represents a water tile in the ecosystem. Wombats and snakes cannot
+    walk into water; birds fly over it.
+    """
+    def __init__(self, position, game):
+        """
+        Initializes the water tile.
+        """
+        super().__init__(position, game, width=96, height=96, sourceImage=ImageLibrary.get('water_tile'))
+
+    def update(self, timeElapsed):
+        pass
+
 class Grass(GameObject):
     """
     Represents grass that grows on dirt tiles and may spread to adjacent tiles.
+    Grass is static: instead of counting down every frame, it asks the game
+    to wake it when its growth timer runs out.
     """
+    static = True
+
     def __init__(self, position, game):
         """
         Initializes the grass with a growth timer that determines when it spreads.
@@ -70,27 +163,59 @@ class Grass(GameObject):
         height = 96
         sourceImage = ImageLibrary.get('grass_tuft')  
         super().__init__(position, width, height, sourceImage, game)
-        self.growth_timer = random.randint(5, 20)
+        self.growth_timer = None
+        self._growth = None
+        if getattr(game, "vegetation", None) == None:
+            self.growth_timer = game.get_random().randint(5, 20)
+            self._growth = game.schedule(self.growth_timer, self.grow)
+
+    def grow(self):
+        """
+        Called by the game when the growth timer runs out. Spreads the grass
+        and starts the timer again.
+        """
+        self.spread()
+        self.growth_timer = self.get_game().get_random().randint(5, 20)
+        self._growth = self.get_game().schedule(self.growth_timer, self.grow)
 
     def update(self, timeElapsed):
         """
-        Updates the grass growth timer. When the timer runs out, the grass spreads.
+        Grass does not change between growth timers.
         """
-        self.growth_timer -= timeElapsed
-        if self.growth_timer <= 0:
-            self.spread()
-            self.growth_timer = random.randint(5, 20)  
+        pass
     
     def spread(self):
         """
-        Spreads grass to adjacent dirt tiles.
+        Spreads grass to one adjacent dirt tile without grass.
+        If the game has a vegetation grid, spreading is done by the grid instead.
         """
-        pass
+        cells = free_dirt_neighbours(self)
+        if cells:
+            self.get_game().add_grass(*self.get_game().get_random().choice(cells))
+
+    def destroy(self):
+        """
+        Removes the grass from its tile and stops its growth timer.
+        """
+        game = self.get_game()
+        if self._growth != None:
+            game.cancel_timer(self._growth)
+        vegetation = getattr(game, "vegetation", None)
+        if vegetation != None:
+            vegetation.forget(self)
+        elif game.get_spatial_index() != None:
+            tile = game.tile_at(int(self.get_x() // 96), int(self.get_y() // 96))
+            if isinstance(tile, DirtTile):
+                tile.remove_grass()
+        super().destroy()
 
 class Flower(GameObject):
     """
     Represents a flower that grows on dirt tiles and spreads similar to grass.
+    Like grass, flowers are woken by the game instead of updated every frame.
     """
+    static = True
+
     def __init__(self, position, game):
         """
         Initializes the flower with a growth timer for spreading.
@@ -99,23 +224,76 @@ class Flower(GameObject):
         height = 96
         sourceImage = ImageLibrary.get('grass_tile')  
         super().__init__(position, width, height, sourceImage, game)
-        self.growth_timer = random.randint(5, 15)
+        self.growth_timer = None
+        self._growth = None
+        if getattr(game, "vegetation", None) == None:
+            self.growth_timer = game.get_random().randint(5, 15)
+            self._growth = game.schedule(self.growth_timer, self.grow)
+
+    def grow(self):
+        """
+        Called by the game when the growth timer runs out. Spreads the flower
+        and starts the timer again.
+        """
+        self.spread()
+        self.growth_timer = self.get_game().get_random().randint(5, 15)
+        self._growth = self.get_game().schedule(self.growth_timer, self.grow)
 
     def update(self, timeElapsed):
         """
-        Updates the flower's growth timer. Spreads when the timer runs out.
+        Flowers do not change between growth timers.
         """
-        self.growth_timer -= timeElapsed
-        if self.growth_timer <= 0:
-            self.spread()
-            self.growth_timer = random.randint(5, 15)  
+        pass
     
     def spread(self):
         """
-        Spreads the flower to adjacent dirt tiles.
+        Spreads the flower to one adjacent dirt tile without grass or flowers.
+        If the game has a vegetation grid, spreading is done by the grid instead.
         """
-        pass
+        game = self.get_game()
+        index = game.get_spatial_index()
+        cells = [cell for cell in free_dirt_neighbours(self) if not index.at(*cell, Flower)]
+        if cells:
+            col, row = game.get_random().choice(cells)
+            Flower(Vector2D(col * EcoSim.TILE_SIZE, row * EcoSim.TILE_SIZE), game)
+
+    def destroy(self):
+        """
+        Removes the flower and stops its growth timer.
+        """
+        game = self.get_game()
+        if self._growth != None:
+            game.cancel_timer(self._growth)
+        vegetation = getattr(game, "vegetation", None)
+        if vegetation != None:
+            vegetation.forget(self)
+        super().destroy()
     
+def free_dirt_neighbours(obj):
+    """
+    Returns the (column, row) of the dirt tiles without grass left, right,
+    above and below the tile the object is on. Tiles without a Tile object
+    are looked up in the terrain layer.
+    Returns an empty list if the game has no spatial index.
+    """
+    game = obj.get_game()
+    index = game.get_spatial_index()
+    if index == None:
+        return []
+    col = int(obj.get_x() // 96)
+    row = int(obj.get_y() // 96)
+    cells = []
+    for dc, dr in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+        cell = (col + dc, row + dr)
+        tile = game.tile_at(*cell)
+        if tile == None:
+            dirt = game.terrain_at(*cell) == 'dirt_tile'
+        else:
+            dirt = isinstance(tile, DirtTile)
+        if dirt and not index.at(*cell, Grass):
+            cells.append(cell)
+    return cells
+
 class OutOfBoundsException(Exception):
     """
     Custom exception for handling out-of-bounds target selections.
@@ -129,7 +307,15 @@ class OutOfBoundsException(Exception):
 class Animal(GameObject):
     """
     Represents a base class for animals in the ecosystem. Inherited by specific animals.
+    An animal with less than HUNGRY_ENERGY energy looks for food. While
+    the game's forage system has found food for it, foraging is True and
+    its target is the food. Animals whose class sets walks to True walk
+    around water; the others fly over it.
     """
+    ARRIVAL_DISTANCE = 48
+    HUNGRY_ENERGY = 20
+    walks = False
+
     def __init__(self, position, game, width, height, sourceImage, speed, energy):
         """
         Initializes the animal with position, size, image, speed, and energy.
@@ -137,6 +323,26 @@ class Animal(GameObject):
         super().__init__(position, width, height, sourceImage, game)
         self.speed = speed
         self.energy = energy
+        self.foraging = False
+        self._trajectory = Vector2D(0, 0)
+        self._route = Route()
+
+    def move_towards_target(self, timeElapsed):
+        """
+        Moves the animal towards its target without creating new vectors.
+        If the animal walks and the game has navigation flow fields, it
+        goes around impassable tiles by heading for the next tile on the
+        path instead.
+        Returns True if the animal is then within ARRIVAL_DISTANCE of the target.
+        """
+        position = self.get_position()
+        goal = self.target
+        navigation = getattr(self.get_game(), "navigation", None)
+        if navigation != None and self.walks:
+            goal = navigation.waypoint(self, self.target, self._route)
+        trajectory = position.step_toward(goal, self.speed * timeElapsed, self._trajectory)
+        self.move_by(trajectory.x, trajectory.y)
+        return position.distance_squared(self.target) < Animal.ARRIVAL_DISTANCE ** 2
 
     def update(self, timeElapsed):
         """
@@ -144,10 +350,39 @@ class Animal(GameObject):
         """
         pass
 
+    def blocked_by(self, tile):
+        """
+        Called by the game's contact system while the animal overlaps a
+        tile it cannot enter. Pushes the animal back out of the tile the
+        shortest way, and picks a new target unless it is foraging.
+        """
+        left = tile.get_x() + tile.get_width() - self.get_x()
+        right = self.get_x() + self.get_width() - tile.get_x()
+        up = tile.get_y() + tile.get_height() - self.get_y()
+        down = self.get_y() + self.get_height() - tile.get_y()
+        shortest = min(left, right, up, down)
+        if shortest == left:
+            self.move_by(left, 0)
+        elif shortest == right:
+            self.move_by(-right, 0)
+        elif shortest == up:
+            self.move_by(0, up)
+        else:
+            self.move_by(0, -down)
+        if not self.foraging and hasattr(self, "selectTarget"):
+            self.target = self.selectTarget()
+        herd = getattr(self.get_game(), "herd", None)
+        if herd != None:
+            herd.place(self)
+
 class Wombat(Animal):
     """
     Represents a wombat in the ecosystem that eats grass to restore energy.
     """
+    WALK = Animation(('wombat1', 'wombat2'), 0.4)
+    MEAL_ENERGY = 50
+    walks = True
+
     def __init__(self, position, game):
         """
         Initializes the wombat with specific attributes like speed and energy.
@@ -158,6 +393,7 @@ class Wombat(Animal):
         speed = 10
         energy = 100
         super().__init__(position, game, width, height, sourceImage, speed, energy)
+        game.animator.play(self, Wombat.WALK)
         self.target = self.selectTarget()
 
     def selectTarget(self):
@@ -165,10 +401,12 @@ class Wombat(Animal):
         Selects a random target within the game bounds for the wombat to move towards.
         Raises an OutOfBoundsException if the target is out of bounds.
         """
+        game = self.get_game()
         while True:
             try:
-                target = Vector2D(random.randint(0,11) * 96, random.randint(0,9) * 96)
-                if target.x < 0 or target.x > 1152 or target.y < 0 or target.y > 984:
+                target = game.random_tile_position()
+                if (target.x < 0 or target.x > game.get_world_width()
+                        or target.y < 0 or target.y > game.get_world_height()):
                     raise OutOfBoundsException(f"Target {target} is out of bounds")
                 return target
             except OutOfBoundsException as e:
@@ -176,24 +414,27 @@ class Wombat(Animal):
 
     def update(self, timeElapsed):
         """
-        Updates the wombat's behavior. Moves towards a target or eats grass when low on energy.
+        Updates the wombat's behavior. Moves towards a target, or towards
+        grass when low on energy.
         """
         self.energy -= timeElapsed
         if self.energy <= 0:
             self.destroy()
-        elif self.energy < 20:
-            pass
-
+        elif self.energy < Animal.HUNGRY_ENERGY:
+            if self.foraging:
+                self.move_towards_target(timeElapsed)
         else:
-            trajectory = self.target.subtract(self.get_position()).normalize().scale(self.speed * timeElapsed)
-            self.move_by(trajectory.x, trajectory.y)
-            if self.get_position().distance(self.target) < 48:
+            if self.move_towards_target(timeElapsed):
                 self.target = self.selectTarget()
 
 class Snake(Animal):
     """
     Represents a snake in the ecosystem that eats wombats to restore energy.
     """
+    WALK = Animation(('snake1', 'snake2'), 0.3)
+    MEAL_ENERGY = 60
+    walks = True
+
     def __init__(self, position, game):
         """
         Initializes the snake with specific attributes like speed and energy.
@@ -204,6 +445,7 @@ class Snake(Animal):
         speed = 15
         energy = 80
         super().__init__(position, game, width, height, sourceImage, speed, energy)
+        game.animator.play(self, Snake.WALK)
         self.target = self.selectTarget()
 
     def selectTarget(self):
@@ -211,10 +453,12 @@ class Snake(Animal):
         Selects a random target within the game bounds for the snake to move towards.
         Raises an OutOfBoundsException if the target is out of bounds.
         """
+        game = self.get_game()
         while True:
             try:
-                target = Vector2D(random.randint(0, 11) * 96, random.randint(0, 9) * 96)
-                if target.x < 0 or target.x > 1152 or target.y < 0 or target.y > 984:
+                target = game.random_tile_position()
+                if (target.x < 0 or target.x > game.get_world_width()
+                        or target.y < 0 or target.y > game.get_world_height()):
                     raise OutOfBoundsException(f"Target {target} is out of bounds")
                 return target
             except OutOfBoundsException as e:
@@ -222,24 +466,25 @@ class Snake(Animal):
     
     def update(self, timeElapsed):
         """
-        Updates the snake's behavior. Moves towards a target or eats wombats when low on energy.
+        Updates the snake's behavior. Moves towards a target, or chases
+        wombats when low on energy.
         """
         self.energy -= timeElapsed
         if self.energy <= 0:
             self.destroy()
-        elif self.energy < 20:
-            pass
-        
+        elif self.energy < Animal.HUNGRY_ENERGY:
+            if self.foraging:
+                self.move_towards_target(timeElapsed)
         else:
-            trajectory = self.target.subtract(self.get_position()).normalize().scale(self.speed * timeElapsed)
-            self.move_by(trajectory.x, trajectory.y)
-            if self.get_position().distance(self.target) < 48:
+            if self.move_towards_target(timeElapsed):
                 self.target = self.selectTarget()
 
 class Bird(Animal):
     """
     Represents a bird in the ecosystem that eats flowers to restore energy.
     """
+    MEAL_ENERGY = 40
+
     def __init__(self, position, game):
         """
         Initializes the bird with specific attributes like speed and energy.
@@ -252,55 +497,533 @@ class Bird(Animal):
         super().__init__(position, game, width, height, sourceImage, speed, energy)
 
     def update(self, timeElapsed):
+        """
+        Updates the bird's behavior. Stays put, or flies towards flowers
+        when low on energy. If the game has update tiers, a bird that is
+        not hungry sleeps until it will be.
+        """
         self.energy -= timeElapsed
         if self.energy <= 0:
             self.destroy()
-        elif self.energy < 20:
-            pass
-        else:
-            pass
+        elif self.energy < Animal.HUNGRY_ENERGY:
+            if self.foraging:
+                self.move_towards_target(timeElapsed)
+        elif self.get_game().get_update_tiers() != None:
+            self.sleep(self.energy - Animal.HUNGRY_ENERGY)
 
 class EcoSim(Game):
     """
     The main class that represents the ecosystem simulation.
     Responsible for setting up the environment with tiles and animals.
     """
+    TILE_SIZE = 96
     
-    def __init__(self):
+    def __init__(self, headless=False, renderer=None, herd=False, spatial_index=True,
+                 terrain_layer=True, vegetation_grid=False, cols=12, rows=10,
+                 wombats=10, snakes=5, birds=6, tile_objects=True, chunk_size=8,
+                 width=1152, height=984, seed=None, rng=None, setup=True, foraging=True,
+                 water_chance=0.0, update_tiers=False):
         """
         Initializes the ecosystem simulation by creating a grid of tiles and animals.
+        If headless is True, the simulation runs without opening a window.
+        If herd is True, animals are moved by a NumPy HerdEngine instead of
+        their own update methods.
+        If spatial_index is True, objects can be looked up by tile with
+        tile_at, objects_near and nearest.
+        If terrain_layer is True, tiles are drawn as a few baked images
+        instead of one canvas item each.
+        If vegetation_grid is True, grass and flowers are simulated by a
+        NumPy VegetationGrid instead of one timer per tuft.
+        If foraging is True and NumPy is installed, hungry wombats go to
+        the nearest grass, snakes to the nearest wombat and birds to the
+        nearest flower, found for all of them at once by a ForageSystem.
+
+        The world is cols * rows tiles and starts with the given number of
+        wombats, snakes and birds. Each tile is water with the probability
+        water_chance. If water_chance is above 0, wombats and snakes walk
+        around water along navigation flow fields and are kept out of it
+        by a ContactSystem, and random tiles are never water. The window is
+        width * height pixels; if the world is larger, it is split into
+        chunks of chunk_size * chunk_size tiles and only the chunks in view
+        are drawn. The view is moved with the arrow keys. For very large
+        worlds tile_objects may be False, so that tiles are only kept in the
+        terrain layer and vegetation grid rather than as one GameObject each.
+
+        If update_tiers is True, animals out of view or standing still are
+        updated only every few steps, and birds sleep until they are
+        hungry. The run then depends on what is shown, so it cannot be
+        replayed headless. Resuming from a checkpoint starts every animal
+        in the every-step tier again, caught up by the seconds it was owed.
+
+        All randomness comes from rng, or from a random.Random created
+        from seed if rng is None, so that a run can be repeated. The herd
+        engine and vegetation grid are seeded from it.
+
+        If setup is False the world is left empty, as when it is about to
+        be restored from a checkpoint.
         """
-        super().__init__()
+        if rng == None:
+            rng = random.Random(seed)
+        super().__init__(headless, renderer, width, height, rng)
+        self.seed = seed
+        self.cols = cols
+        self.rows = rows
+        self.populations = {Wombat: wombats, Snake: snakes, Bird: birds}
+        self.tile_objects = tile_objects
+        self.water_chance = water_chance
+        self.update_tiers = update_tiers
+        self.__dirt_tiles = 0
+        self.__dirt_version = None
+        self.__impassable = None
         self.tiles = []
         self.animals = []
-        self.setup_environment()
+        self.herd = None
+        self.terrain = None
+        self.vegetation = None
+        self.forager = None
+        self.navigation = None
+        self.animator = Animator(self)
+        if terrain_layer or not tile_objects:
+            self.terrain = TerrainLayer(self, cols, rows, EcoSim.TILE_SIZE, chunk_size)
+            self.add_system(self.terrain)
+        viewport = None
+        if self.get_window().get_renderer() != None and (
+                self.get_world_width() > self.get_window().get_canvas_width()
+                or self.get_world_height() > self.get_window().get_canvas_height()):
+            viewport = self.enable_viewport(self.get_world_width(), self.get_world_height(),
+                                            chunk_size * EcoSim.TILE_SIZE)
+            if self.terrain != None:
+                viewport.add_listener(self.terrain)
+        if spatial_index:
+            self.enable_spatial_index(EcoSim.TILE_SIZE)
+        if vegetation_grid:
+            self.vegetation = VegetationGrid(self, cols, rows, EcoSim.TILE_SIZE,
+                                             self.create_vegetation,
+                                             seed=rng.getrandbits(64))
+            self.add_system(self.vegetation)
+            if viewport != None:
+                viewport.add_listener(self.vegetation)
+        if herd:
+            self.herd = HerdEngine(self, cols, rows, EcoSim.TILE_SIZE,
+                                   seed=rng.getrandbits(64))
+        if foraging and forage.np is not None:
+            self.forager = ForageSystem(self, self.herd, Animal.HUNGRY_ENERGY,
+                                        Animal.ARRIVAL_DISTANCE, EcoSim.TILE_SIZE)
+            for eater, food in ((Wombat, Grass), (Snake, Wombat), (Bird, Flower)):
+                self.forager.add_diet(eater, lambda food=food: self.food(food), self.eat,
+                                      eater.MEAL_ENERGY)
+            self.add_system(self.forager)
+        if self.herd != None:
+            self.add_system(self.herd)
+        if water_chance > 0:
+            self.navigation = FlowFields(cols, rows, EcoSim.TILE_SIZE, self.is_passable,
+                                         self.terrain_version)
+            contacts = self.enable_contacts(EcoSim.TILE_SIZE, self.contact_objects)
+            for kind in (Wombat, Snake):
+                contacts.add_rule(kind, WaterTile, enter=kind.blocked_by, stay=kind.blocked_by)
+            if self.herd != None:
+                self.herd.navigate(self.navigation, self.impassable_tiles, (Wombat, Snake))
+        if update_tiers:
+            self.enable_update_tiers()
+        if setup:
+            self.setup_environment()
+
+    def get_world_width(self):
+        """
+        Returns the width of the world in pixels.
+        """
+        return self.cols * EcoSim.TILE_SIZE
+
+    def get_world_height(self):
+        """
+        Returns the height of the world in pixels.
+        """
+        return self.rows * EcoSim.TILE_SIZE
+
+    def random_tile_position(self):
+        """
+        Returns the top-left position of a random tile in the world.
+        If the world has navigation flow fields, the tile is passable
+        unless none was found in a hundred tries.
+        """
+        rng = self.get_random()
+        for i in range(100):
+            col = rng.randint(0, self.cols - 1)
+            row = rng.randint(0, self.rows - 1)
+            if self.navigation == None or self.is_passable(col, row):
+                break
+        return Vector2D(col * EcoSim.TILE_SIZE, row * EcoSim.TILE_SIZE)
+
+    def is_passable(self, col, row):
+        """
+        Returns True if wombats and snakes may walk on the tile in the given column and row.
+        """
+        return self.terrain_at(col, row) != 'water_tile'
+
+    def terrain_version(self):
+        """
+        Returns a number that changes whenever a tile is added, removed or changed.
+        """
+        if self.terrain != None:
+            return self.terrain.version
+        return self._gameObjects.version(Tile)
+
+    def on_key(self, event):
+        """
+        Moves the view with the arrow keys when the world is larger than the window.
+        """
+        viewport = self.get_viewport()
+        if viewport == None:
+            return
+        step = EcoSim.TILE_SIZE * 2
+        moves = {"Left": (-step, 0), "Right": (step, 0), "Up": (0, -step), "Down": (0, step)}
+        if event.keysym in moves:
+            viewport.pan(*moves[event.keysym])
+
+    def add_game_obj(self, obj):
+        """
+        Adds the object to the game, or to the herd engine if it is an animal.
+        """
+        if self.herd != None and isinstance(obj, Animal):
+            self.herd.add(obj)
+        else:
+            super().add_game_obj(obj)
+
+    def _remove_game_obj(self, obj):
+        """
+        Removes the object from the game, or from the herd engine if it is an animal.
+        """
+        if self.herd != None and isinstance(obj, Animal):
+            self.herd.remove(obj)
+        else:
+            super()._remove_game_obj(obj)
     
+    def create_vegetation(self, kind, position):
+        """
+        Creates the sprite for a tile of the vegetation grid.
+        """
+        if kind == FLOWER:
+            return Flower(position, self)
+        return Grass(position, self)
+
+    def tile_at(self, col, row):
+        """
+        Returns the tile in the given column and row, or None if there is none.
+        """
+        tiles = self.get_spatial_index().at(col, row, Tile)
+        if tiles:
+            return tiles[0]
+        return None
+
+    def objects_near(self, position, radius, kind=None):
+        """
+        Returns the objects of the given kind whose centre is within radius
+        pixels of the centre of the tile at position.
+        """
+        return self.get_spatial_index().query_radius(position.x + 48, position.y + 48,
+                                                     radius, kind)
+
+    def count_population(self):
+        """
+        Returns a dictionary with the number of wombats, snakes, birds,
+        grass tufts and flowers currently alive.
+        """
+        counts = {}
+        for kind in (Wombat, Snake, Bird, Grass, Flower):
+            counts[kind.__name__] = len(self.get_game_objs_of_type(kind))
+        if self.herd != None:
+            for kind, count in self.herd.counts_by_type().items():
+                counts[kind.__name__] += count
+        if self.vegetation != None:
+            counts["Grass"] = int((self.vegetation.state == GRASS).sum())
+            counts["Flower"] = int((self.vegetation.state == FLOWER).sum())
+        return counts
+
+    def get_animals(self, kind=None):
+        """
+        Returns a list of the living animals, or only those that are
+        instances of kind, including those moved by the herd engine.
+        """
+        if kind == None:
+            kind = Animal
+        animals = self.get_game_objs_of_type(kind)
+        if self.herd != None:
+            self.herd.sync()
+            animals.extend(animal for animal in self.herd.get_animals(pending=True)
+                           if isinstance(animal, kind))
+        return animals
+
+    def grass_coverage(self):
+        """
+        Returns the fraction of dirt tiles covered by grass.
+        """
+        if self.vegetation != None:
+            return self.vegetation.coverage(GRASS)
+        if self.terrain != None:
+            if self.__dirt_version != self.terrain.version:
+                self.__dirt_tiles = self.terrain.get_tiles().count('dirt_tile')
+                self.__dirt_version = self.terrain.version
+            dirt = self.__dirt_tiles
+        else:
+            dirt = len(self.get_game_objs_of_type(DirtTile))
+        if dirt == 0:
+            return 0.0
+        return len(self.get_game_objs_of_type(Grass)) / dirt
+
+    def telemetry_sample(self):
+        """
+        Returns a dictionary of the simulated time, the number of each kind
+        of animal and plant, the grass coverage, and the mean, 10th, 50th
+        and 90th percentile energy of each kind of animal.
+        """
+        sample = {"time": self.get_time()}
+        for name, count in self.count_population().items():
+            sample[name.lower() + "_count"] = count
+        sample["grass_coverage"] = self.grass_coverage()
+        energies = {kind: [] for kind in (Wombat, Snake, Bird)}
+        for animal in self.get_animals():
+            energies[type(animal)].append(animal.energy)
+        for kind, values in energies.items():
+            values.sort()
+            name = kind.__name__.lower()
+            count = len(values)
+            sample[name + "_energy_mean"] = sum(values) / count if count else 0.0
+            for q in (10, 50, 90):
+                sample[f"{name}_energy_p{q}"] = values[q * (count - 1) // 100] if count else 0.0
+        return sample
+
+    def get_drawables(self):
+        """
+        Returns the objects drawn as their own sprite: every object except
+        the tiles drawn by the terrain layer, and the animals in the herd engine.
+        """
+        objects = self._get_game_objs()
+        if self.terrain != None:
+            objects = [obj for obj in objects if not isinstance(obj, Tile)]
+        if self.herd != None:
+            self.herd.sync()
+            objects.extend(self.herd.get_animals())
+        return objects
+
+    def food(self, kind):
+        """
+        Returns the food of the given kind as a list of items and their
+        top-left positions, for the forage system. Grass and flowers of a
+        vegetation grid are (col, row) tiles; other food is living objects.
+        """
+        if self.vegetation != None and kind in (Grass, Flower):
+            cells, positions = self.vegetation.positions(GRASS if kind is Grass else FLOWER)
+            return cells.tolist(), positions
+        if self.herd != None and issubclass(kind, Animal):
+            return self.herd.of_type(kind)
+        items = [obj for obj in self.get_game_objs_of_type(kind) if not obj.is_destroyed()]
+        return items, [(obj.get_x(), obj.get_y()) for obj in items]
+
+    def eat(self, food):
+        """
+        Removes an item returned by food once it has been eaten.
+        """
+        if isinstance(food, GameObject):
+            food.destroy()
+        else:
+            self.vegetation.clear(*food)
+
+    def contact_objects(self, kind):
+        """
+        Returns the objects of the given kind for the contact system. Of
+        the animals in the herd engine, only those touching a tile they
+        cannot enter are returned, as those are the only contacts of
+        herd animals, and only their positions are copied back from the
+        engine's arrays.
+        """
+        if self.herd != None and issubclass(kind, Animal):
+            return self.herd.touching(kind, self.impassable_tiles(), EcoSim.TILE_SIZE)
+        return self.get_game_objs_of_type(kind)
+
+    def impassable_tiles(self):
+        """
+        Returns a (rows, cols) NumPy array that is True for every tile
+        wombats and snakes cannot enter, rebuilt when the terrain changes.
+        """
+        version = self.terrain_version()
+        if self.__impassable == None or self.__impassable[0] != version:
+            blocked = np.array([[not self.is_passable(col, row) for col in range(self.cols)]
+                                for row in range(self.rows)], dtype=bool).reshape(self.rows,
+                                                                                  self.cols)
+            self.__impassable = (version, blocked)
+        return self.__impassable[1]
+
+    def nearest(self, position, kind, k=1, exclude=None):
+        """
+        Returns up to k objects of the given kind nearest to the tile at position.
+        """
+        return self.get_spatial_index().nearest(position.x + 48, position.y + 48,
+                                                k, kind, exclude=exclude)
+
     def setup_environment(self):
         """
         Sets up the simulation environment by adding tiles and animals to the game.
         """
-        for y in range(10):
-            for x in range(12):
-                position = Vector2D(x * 96, y * 96)
-                tile_type = DirtTile if random.random() < 0.5 else SandTile
-                self.tiles.append(tile_type(position, self))
+        for y in range(self.rows):
+            for x in range(self.cols):
+                if self.water_chance > 0 and self.get_random().random() < self.water_chance:
+                    position = Vector2D(x * EcoSim.TILE_SIZE, y * EcoSim.TILE_SIZE)
+                    self.tiles.append(WaterTile(position, self))
+                    continue
+                dirt = self.get_random().random() < 0.5
+                if self.tile_objects:
+                    position = Vector2D(x * EcoSim.TILE_SIZE, y * EcoSim.TILE_SIZE)
+                    tile_type = DirtTile if dirt else SandTile
+                    self.tiles.append(tile_type(position, self))
+                else:
+                    self.add_terrain(x, y, dirt)
+
+        for kind in (Wombat, Snake, Bird):
+            for i in range(self.populations[kind]): 
+                self.animals.append(kind(self.random_tile_position(), self))
+
+        if self.terrain != None:
+            self.terrain.flush()
+
+    def add_terrain(self, col, row, dirt):
+        """
+        Adds a tile without creating a Tile object. Like a DirtTile, a dirt
+        tile has a 50% chance to start with grass.
+        """
+        self.terrain.set_tile(col, row, 'dirt_tile' if dirt else 'sand_tile')
+        if not dirt:
+            return
+        if self.vegetation != None:
+            self.vegetation.set_fertile(col, row)
+        if self.get_random().random() < 0.5:
+            if self.vegetation != None:
+                self.vegetation.plant(col, row, GRASS)
+            else:
+                Grass(Vector2D(col * EcoSim.TILE_SIZE, row * EcoSim.TILE_SIZE), self)
 
-        for i in range(10): 
-            position = Vector2D(random.randint(0, 11) * 96, random.randint(0, 9) * 96)
-            self.animals.append(Wombat(position, self))
-        for i in range(5): 
-            position = Vector2D(random.randint(0, 11) * 96, random.randint(0, 9) * 96)
-            self.animals.append(Snake(position, self))
-        for i in range(6): 
-            position = Vector2D(random.randint(0, 11) * 96, random.randint(0, 9) * 96)
-            self.animals.append(Bird(position, self))
+    def add_grass(self, col, row):
+        """
+        Grows grass on the dirt tile in the given column and row, through
+        its DirtTile if it has one.
+        """
+        tile = self.tile_at(col, row)
+        if isinstance(tile, DirtTile):
+            tile.add_grass()
+        else:
+            Grass(Vector2D(col * EcoSim.TILE_SIZE, row * EcoSim.TILE_SIZE), self)
+
+    def terrain_at(self, col, row):
+        """
+        Returns the image name of the tile in the given column and row, or None.
+        """
+        if self.terrain != None:
+            return self.terrain.get_tile(col, row)
+        tile = self.tile_at(col, row)
+        if tile == None:
+            return None
+        return ImageLibrary.name_of(tile.get_image())
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Run the ecosystem simulation.")
+    parser.add_argument("--headless", action="store_true",
+                        help="run without opening a window")
+    parser.add_argument("--ticks", type=int, default=None,
+                        help="stop after this many updates")
+    parser.add_argument("--seconds", type=float, default=None,
+                        help="stop after this many simulated seconds")
+    parser.add_argument("--herd", action="store_true",
+                        help="move animals with the NumPy herd engine")
+    parser.add_argument("--vegetation-grid", action="store_true",
+                        help="grow grass with the NumPy vegetation grid")
+    parser.add_argument("--cols", type=int, default=12, help="width of the world in tiles")
+    parser.add_argument("--rows", type=int, default=10, help="height of the world in tiles")
+    parser.add_argument("--wombats", type=int, default=10)
+    parser.add_argument("--snakes", type=int, default=5)
+    parser.add_argument("--birds", type=int, default=6)
+    parser.add_argument("--no-tile-objects", action="store_true",
+                        help="keep tiles only in the terrain layer, for very large worlds")
+    parser.add_argument("--water", type=float, default=0.0,
+                        help="chance of each tile being water, which wombats and snakes avoid")
+    parser.add_argument("--update-tiers", action="store_true",
+                        help="update animals out of view or standing still less often")
+    parser.add_argument("--no-foraging", action="store_true",
+                        help="leave hungry animals standing instead of looking for food")
+    parser.add_argument("--threaded", action="store_true",
+                        help="step the simulation on a worker thread and draw snapshots")
+    parser.add_argument("--profile", action="store_true",
+                        help="show where the time of each frame goes above the canvas")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed of the simulation's random numbers")
+    parser.add_argument("--record", metavar="PATH", default=None,
+                        help="record the run to a file that can be replayed")
+    parser.add_argument("--replay", metavar="PATH", default=None,
+                        help="replay a recorded run headless and check its final state")
+    parser.add_argument("--telemetry", metavar="PATH", default=None,
+                        help="stream population counts to a .csv or columnar .col file")
+    parser.add_argument("--telemetry-interval", type=float, default=1.0,
+                        help="simulated seconds between telemetry samples")
+    parser.add_argument("--export", metavar="DIRECTORY", default=None,
+                        help="draw offscreen and save PNG frames to a directory")
+    parser.add_argument("--export-every", type=int, default=6,
+                        help="steps between exported frames")
+    parser.add_argument("--resume", metavar="PATH", default=None,
+                        help="continue from a checkpoint instead of creating a new world")
+    parser.add_argument("--checkpoint", metavar="PATH", default=None,
+                        help="save a checkpoint when the run stops")
+    args = parser.parse_args()
+    if args.update_tiers and args.record != None:
+        parser.error("--update-tiers runs depend on the view and cannot be recorded")
+
     ImageLibrary.load('images')  
-    ecosim = EcoSim()
+    if args.replay != None:
+        recording = Recording.load(args.replay)
+        ecosim = replay(recording, lambda **params: EcoSim(headless=True, **params))
+        print(f"replayed {len(recording)} steps, {ecosim.get_time():.2f} simulated seconds")
+        return
+
+    seed = args.seed
+    if seed == None and args.record != None:
+        seed = random.randrange(2 ** 32)
+    params = {"herd": args.herd, "vegetation_grid": args.vegetation_grid,
+              "cols": args.cols, "rows": args.rows, "wombats": args.wombats,
+              "snakes": args.snakes, "birds": args.birds,
+              "tile_objects": not args.no_tile_objects, "foraging": not args.no_foraging,
+              "water_chance": args.water, "update_tiers": args.update_tiers}
+    headless = args.headless or args.threaded or args.export != None
+    renderer = None
+    if args.export != None:
+        renderer = OffscreenRenderer(1152, 984)
+    if args.resume != None:
+        import checkpoint
+        ecosim = checkpoint.load(args.resume, headless=headless, renderer=renderer)
+    else:
+        ecosim = EcoSim(headless=headless, renderer=renderer, seed=seed, **params)
+    if args.export != None:
+        ecosim.add_system(FrameExporter(renderer, args.export, args.export_every), late=True)
+    if args.profile:
+        ecosim.enable_profiler(overlay=True)
+    telemetry = None
+    if args.telemetry != None:
+        format = "csv" if args.telemetry.endswith(".csv") else "columnar"
+        telemetry = TelemetryWriter(args.telemetry, ecosim.telemetry_sample,
+                                    args.telemetry_interval, format)
+        ecosim.add_system(telemetry)
+    recorder = None
+    if args.record != None:
+        recorder = Recorder(ecosim, seed, params)
     
-    ecosim.run()
+    if args.threaded and not args.headless and args.export == None:
+        run_threaded(ecosim, ticks=args.ticks, seconds=args.seconds)
+    else:
+        ecosim.run(ticks=args.ticks, seconds=args.seconds)
+    if telemetry != None:
+        telemetry.close()
+    if recorder != None:
+        recorder.stop().save(args.record)
+    if args.checkpoint != None:
+        import checkpoint
+        checkpoint.save(ecosim, args.checkpoint)
 
 if __name__ == '__main__':
     main()
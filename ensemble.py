@@ -0,0 +1,204 @@
+'''Running many seeded EcoSim replicas in parallel.
+
+Each replica is a headless EcoSim with its own seed, run in a worker
+process of a ProcessPoolExecutor. Replicas stream their population
+counts back every few ticks while they run, and the counts are folded
+into a PopulationStats as they arrive, so the full history of every
+replica is never held in memory.
+
+Run with python ensemble.py to print the mean and quantiles of every
+population as CSV.
+'''
+import argparse
+import csv
+import os
+import queue
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
+from game import Game, ImageLibrary
+from ecosim import EcoSim
+
+
+
+IMAGE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'images')
+
+
+class PopulationStats:
+    '''PopulationStats aggregates population counts over many replicas.
+
+    For every sampled tick and species it keeps a histogram of the counts
+    seen, which is enough for exact means and quantiles while using memory
+    proportional to the number of distinct counts rather than replicas.
+    '''
+
+    def __init__(self):
+        '''Creates an empty PopulationStats.'''
+        self.__histograms = {}
+        self.replicas = set()
+
+    def add(self, replica, tick, counts):
+        '''Adds the population counts of a replica at the given tick.'''
+        self.replicas.add(replica)
+        for species, count in counts.items():
+            histogram = self.__histograms.get((species, tick))
+            if histogram == None:
+                histogram = self.__histograms[(species, tick)] = Counter()
+            histogram[count] += 1
+
+    def species(self):
+        '''Returns a sorted list of the species seen.'''
+        return sorted({species for species, tick in self.__histograms})
+
+    def ticks(self):
+        '''Returns a sorted list of the sampled ticks.'''
+        return sorted({tick for species, tick in self.__histograms})
+
+    def mean(self, species, tick):
+        '''Returns the mean count of the species at the tick.'''
+        histogram = self.__histograms[(species, tick)]
+        samples = sum(histogram.values())
+        return sum(count * times for count, times in histogram.items()) / samples
+
+    def quantile(self, species, tick, q):
+        '''Returns the q-quantile, from 0 to 1, of the count of the species
+        at the tick. The lower of two neighbouring counts is returned.'''
+        histogram = self.__histograms[(species, tick)]
+        samples = sum(histogram.values())
+        rank = q * (samples - 1)
+        seen = 0
+        for count in sorted(histogram):
+            seen += histogram[count]
+            if seen > rank:
+                return count
+        return count
+
+    def curve(self, species, q=None):
+        '''Returns a list of (tick, value) pairs with the mean of the species,
+        or its q-quantile if q is given.'''
+        if q == None:
+            return [(tick, self.mean(species, tick)) for tick in self.ticks()]
+        return [(tick, self.quantile(species, tick, q)) for tick in self.ticks()]
+
+
+def _load_images():
+    ImageLibrary.load(IMAGE_PATH, verbose=False)
+
+
+def _images_loaded():
+    try:
+        ImageLibrary.get('wombat1')
+    except KeyError:
+        return False
+    return True
+
+
+def run_replica(replica, seed, params, ticks, sample_every, time_step, samples=None):
+    '''Runs one headless EcoSim with the given seed and keyword params.
+
+    Every sample_every ticks, (replica, tick, counts) is put on the samples
+    queue, where counts is the result of EcoSim.count_population. Returns
+    the counts after the last tick.
+    '''
+    if not _images_loaded():
+        _load_images()
+    sim = EcoSim(headless=True, seed=seed, **params)
+    counts = sim.count_population()
+    if samples != None:
+        samples.put((replica, 0, counts))
+    for tick in range(1, ticks + 1):
+        sim.step(time_step)
+        if tick % sample_every == 0 or tick == ticks:
+            counts = sim.count_population()
+            if samples != None:
+                samples.put((replica, tick, counts))
+    return counts
+
+
+def run_ensemble(replicas, ticks, params=None, seed=0, workers=None, sample_every=60,
+                 time_step=None, callback=None):
+    '''Runs replicas headless EcoSims for the given number of ticks and
+    returns a PopulationStats of their population counts.
+
+    Replica i is seeded with seed + i and created with the keyword
+    arguments in params. Replicas run in up to workers processes; one
+    process per CPU by default. Counts are sampled every sample_every
+    ticks and after the last tick. If a callback is given, it is called
+    with (replica, tick, counts) as each sample arrives.
+    '''
+    if params == None:
+        params = {}
+    if time_step == None:
+        time_step = Game.TIME_STEP
+    stats = PopulationStats()
+
+    def receive(sample):
+        stats.add(*sample)
+        if callback != None:
+            callback(*sample)
+
+    with Manager() as manager:
+        samples = manager.Queue()
+        with ProcessPoolExecutor(workers, initializer=_load_images) as pool:
+            pending = {pool.submit(run_replica, replica, seed + replica, params, ticks,
+                                   sample_every, time_step, samples)
+                       for replica in range(replicas)}
+            while pending:
+                try:
+                    receive(samples.get(timeout=0.1))
+                except queue.Empty:
+                    pass
+                for future in [future for future in pending if future.done()]:
+                    pending.remove(future)
+                    future.result()
+        while True:
+            try:
+                receive(samples.get_nowait())
+            except queue.Empty:
+                break
+    return stats
+
+
+def write_csv(stats, file, quantiles=(0.1, 0.5, 0.9)):
+    '''Writes one row per species and tick with the mean and the quantiles.'''
+    writer = csv.writer(file)
+    writer.writerow(["species", "tick", "mean"] + [f"q{q:g}" for q in quantiles])
+    for species in stats.species():
+        for tick in stats.ticks():
+            writer.writerow([species, tick, f"{stats.mean(species, tick):.3f}"]
+                            + [stats.quantile(species, tick, q) for q in quantiles])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many seeded EcoSim replicas.")
+    parser.add_argument("--replicas", type=int, default=16)
+    parser.add_argument("--ticks", type=int, default=3600)
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first replica")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of processes, one per CPU by default")
+    parser.add_argument("--sample-every", type=int, default=60,
+                        help="ticks between population samples")
+    parser.add_argument("--output", default=None, help="CSV file, standard output by default")
+    parser.add_argument("--herd", action="store_true")
+    parser.add_argument("--vegetation-grid", action="store_true")
+    parser.add_argument("--cols", type=int, default=12)
+    parser.add_argument("--rows", type=int, default=10)
+    parser.add_argument("--wombats", type=int, default=10)
+    parser.add_argument("--snakes", type=int, default=5)
+    parser.add_argument("--birds", type=int, default=6)
+    args = parser.parse_args()
+
+    params = {"herd": args.herd, "vegetation_grid": args.vegetation_grid,
+              "cols": args.cols, "rows": args.rows, "wombats": args.wombats,
+              "snakes": args.snakes, "birds": args.birds}
+    stats = run_ensemble(args.replicas, args.ticks, params, args.seed, args.workers,
+                         args.sample_every)
+    if args.output == None:
+        write_csv(stats, sys.stdout)
+    else:
+        with open(args.output, "w", newline="") as file:
+            write_csv(stats, file)
+
+if __name__ == '__main__':
+    main()
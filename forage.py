@@ -0,0 +1,281 @@
+'''Sending hungry animals to the nearest food.
+
+FoodGrid answers "which food is nearest" for a whole batch of points in
+one call. The food positions are sorted by the cell of a uniform grid
+they fall in, and all queries search rings of cells around themselves
+together, with a few array operations per ring. A query stops once its
+best distance is shorter than any unsearched ring could beat. When the
+food is so sparse that the searched rings would hold more cells than
+there is food, the remaining queries are compared with every position
+instead. Rebuilding the grid sorts the food once, so a step costs
+O((animals + food) log food) rather than O(animals * food).
+
+ForageSystem is a Game system that uses a FoodGrid per diet every step.
+NumPy is optional; it is only needed when a FoodGrid or ForageSystem is
+created.
+'''
+try:
+    import numpy as np
+except ImportError:
+    np = None
+from game import Vector2D
+
+
+
+KEY_STRIDE = 1 << 32
+BRUTE_FORCE_CELLS = 1 << 20
+
+
+class FoodGrid:
+    '''FoodGrid finds the nearest of a set of positions for many points at once.
+
+    Positions are (x, y) pairs, given to rebuild. nearest returns the
+    index into those positions of the nearest one to every point, and its
+    distance. Cells are cell_size pixels, or larger if the food is
+    sparse, so that there is about one position per cell. Of two
+    positions at the same distance, the one with the lower x, then the
+    lower y, is returned, so the result does not depend on the order of
+    the positions; only equal positions fall back to the lower index.
+    '''
+
+    def __init__(self, cell_size=96):
+        '''Creates an empty FoodGrid with square cells of cell_size pixels.
+
+        Raises an ImportError if NumPy is not installed.
+        '''
+        if np is None:
+            raise ImportError("FoodGrid requires numpy")
+        self.cell_size = cell_size
+        self.__cell = float(cell_size)
+        self.__positions = np.zeros((0, 2))
+        self.__sorted = np.zeros((0, 2))
+        self.__order = np.zeros(0, dtype=np.int64)
+        self.__keys = np.zeros(0, dtype=np.int64)
+        self.__by_position = np.zeros(0, dtype=np.int64)
+        self.__rank = np.zeros(0, dtype=np.int64)
+        self.__low = None
+        self.__high = None
+        self.__rings = {}
+
+    def __len__(self):
+        return len(self.__positions)
+
+    def rebuild(self, positions):
+        '''Replaces the food with positions, a sequence or (n, 2) array of (x, y).'''
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        self.__positions = positions
+        if len(positions) == 0:
+            self.__keys = np.zeros(0, dtype=np.int64)
+            return
+        low = positions.min(axis=0)
+        high = positions.max(axis=0)
+        area = float(max(high[0] - low[0], 1.0) * max(high[1] - low[1], 1.0))
+        self.__cell = max(float(self.cell_size), (area / len(positions)) ** 0.5)
+        cells = np.floor(positions / self.__cell).astype(np.int64)
+        keys = cells[:, 0] * KEY_STRIDE + cells[:, 1]
+        order = np.argsort(keys, kind="stable")
+        self.__order = order
+        self.__keys = keys[order]
+        self.__sorted = positions[order]
+        by_position = np.lexsort((positions[:, 1], positions[:, 0]))
+        self.__by_position = by_position
+        self.__rank = np.empty(len(positions), dtype=np.int64)
+        self.__rank[by_position] = np.arange(len(positions))
+        self.__low = cells.min(axis=0)
+        self.__high = cells.max(axis=0)
+
+    def nearest(self, points):
+        '''Returns two arrays with an entry for each (x, y) of points: the
+        index of the nearest food position, or -1 if there is no food, and
+        the distance to it, or infinity.'''
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        found = np.full(len(points), -1, dtype=np.int64)
+        best = np.full(len(points), np.inf)
+        count = len(self.__positions)
+        if len(points) == 0 or count == 0:
+            return found, best
+        size = self.__cell
+        cells = np.floor(points / size).astype(np.int64)
+        max_ring = int(max(np.abs(cells - self.__low).max(), np.abs(cells - self.__high).max()))
+        pending = np.arange(len(points))
+        ring = 0
+        while len(pending) and ring <= max_ring:
+            if (2 * ring + 1) ** 2 > count:
+                self.__brute_force(points, pending, found, best)
+                break
+            offsets = self.__ring(ring)
+            around = cells[pending][:, None, :] + offsets[None, :, :]
+            keys = (around[:, :, 0] * KEY_STRIDE + around[:, :, 1]).ravel()
+            start = np.searchsorted(self.__keys, keys, "left")
+            counts = np.searchsorted(self.__keys, keys, "right") - start
+            total = int(counts.sum())
+            if total:
+                query = np.repeat(np.repeat(pending, len(offsets)), counts)
+                candidate = (np.repeat(start, counts) + np.arange(total)
+                             - np.repeat(np.cumsum(counts) - counts, counts))
+                delta = self.__sorted[candidate] - points[query]
+                distance = np.einsum("ij,ij->i", delta, delta)
+                self.__improve(found, best, query, self.__order[candidate], distance)
+            reach = ring * size
+            pending = pending[best[pending] >= reach * reach]
+            ring += 1
+        return found, np.sqrt(best)
+
+    def __ring(self, ring):
+        offsets = self.__rings.get(ring)
+        if offsets is None:
+            if ring == 0:
+                offsets = [(0, 0)]
+            else:
+                offsets = [(c, r) for c in range(-ring, ring + 1) for r in (-ring, ring)]
+                offsets += [(c, r) for r in range(-ring + 1, ring) for c in (-ring, ring)]
+            offsets = self.__rings[ring] = np.array(offsets, dtype=np.int64)
+        return offsets
+
+    def __improve(self, found, best, query, index, distance):
+        rank = self.__rank
+        order = np.lexsort((rank[index], distance, query))
+        query = query[order]
+        index = index[order]
+        distance = distance[order]
+        first = np.ones(len(query), dtype=bool)
+        first[1:] = query[1:] != query[:-1]
+        query = query[first]
+        index = index[first]
+        distance = distance[first]
+        current = found[query]
+        better = (distance < best[query]) | ((distance == best[query])
+                                             & ((current < 0) | (rank[index] < rank[current])))
+        found[query[better]] = index[better]
+        best[query[better]] = distance[better]
+
+    def __brute_force(self, points, pending, found, best):
+        by_position = self.__by_position
+        positions = self.__positions[by_position]
+        chunk = max(1, BRUTE_FORCE_CELLS // len(positions))
+        for i in range(0, len(pending), chunk):
+            queries = pending[i:i + chunk]
+            delta = positions[None, :, :] - points[queries][:, None, :]
+            distance = np.einsum("ijk,ijk->ij", delta, delta)
+            index = distance.argmin(axis=1)
+            found[queries] = by_position[index]
+            best[queries] = distance[np.arange(len(queries)), index]
+
+
+
+class ForageSystem:
+    '''ForageSystem sends hungry animals to their nearest food and feeds them.
+
+    Diets are added with add_diet. Every step, the hungry animals of each
+    diet, those with less than hungry_energy energy, are looked up in a
+    FoodGrid of its food in one batch. An animal within eat_distance of
+    its food eats it, unless another animal ate it first this step.
+    Every other hungry animal with food left in the world has its target
+    set to the food and its foraging attribute set to True, for its
+    update method to move towards; animals in a HerdEngine are instead
+    moved by the engine. Add the system before the HerdEngine, so that
+    it sees every step's positions before the herd moves.
+    '''
+
+    def __init__(self, game, herd=None, hungry_energy=20, eat_distance=48, cell_size=96):
+        '''Creates a ForageSystem without diets for the animals of game, or
+        for those of herd if it is a HerdEngine.
+
+        Raises an ImportError if NumPy is not installed.
+        '''
+        if np is None:
+            raise ImportError("ForageSystem requires numpy")
+        self.__game = game
+        self.__herd = herd
+        self.hungry_energy = hungry_energy
+        self.eat_distance = eat_distance
+        self.meals = 0
+        self.__grid = FoodGrid(cell_size)
+        self.__diets = []
+
+    def add_diet(self, eater, food, eat, energy):
+        '''Makes animals of the class eater eat food.
+
+        food is called without arguments and returns a list of food items
+        and a sequence or (n, 2) array of their (x, y) positions. eat is
+        called with an item when it is eaten, and must remove it. A meal
+        adds energy to the animal that ate it.'''
+        self.__diets.append((eater, food, eat, energy))
+
+    def update(self, seconds):
+        '''Finds food for every hungry animal. Called by the Game once per step.'''
+        if self.__herd != None:
+            self.__update_herd()
+        else:
+            self.__update_objects()
+
+    def __find(self, positions, food):
+        '''Returns the food items, their positions, the index of the food
+        nearest to each position, and whether the animal there can eat it.'''
+        items, food_positions = food()
+        self.__grid.rebuild(food_positions)
+        index, distance = self.__grid.nearest(positions)
+        eats = distance <= self.eat_distance
+        eating = np.flatnonzero(eats)
+        if len(eating):
+            unique, first = np.unique(index[eating], return_index=True)
+            eats[:] = False
+            eats[eating[first]] = True
+        return items, np.asarray(food_positions, dtype=float).reshape(-1, 2), index, eats
+
+    def __update_objects(self):
+        eaten = []
+        for eater, food, eat, energy in self.__diets:
+            animals = self.__game.get_game_objs_of_type(eater)
+            hungry = [animal for animal in animals
+                      if animal.energy < self.hungry_energy and not animal.is_destroyed()]
+            for animal in animals:
+                animal.foraging = False
+            if not hungry:
+                continue
+            items, food_positions, index, eats = self.__find(
+                [(animal.get_x(), animal.get_y()) for animal in hungry], food)
+            for animal, j, eating in zip(hungry, index.tolist(), eats.tolist()):
+                if j < 0:
+                    continue
+                if eating:
+                    animal.energy += energy
+                    eaten.append((eat, items[j]))
+                else:
+                    x, y = food_positions[j].tolist()
+                    if getattr(animal, "target", None) == None:
+                        animal.target = Vector2D(x, y)
+                    else:
+                        animal.target.set(x, y)
+                    animal.foraging = True
+        self.__eat(eaten)
+
+    def __update_herd(self):
+        herd = self.__herd
+        herd.admit()
+        positions = herd.get_positions()
+        energies = herd.get_energies()
+        eaten = []
+        forage_slots = []
+        forage_targets = []
+        for eater, food, eat, energy in self.__diets:
+            hungry = np.flatnonzero(herd.mask_of(eater)
+                                    & (energies < self.hungry_energy))
+            if not len(hungry):
+                continue
+            items, food_positions, index, eats = self.__find(positions[hungry], food)
+            herd.feed(hungry[eats], energy)
+            eaten.extend((eat, items[j]) for j in index[eats].tolist())
+            moving = (index >= 0) & ~eats
+            forage_slots.append(hungry[moving])
+            forage_targets.append(food_positions[index[moving]])
+        if forage_slots:
+            herd.set_foraging(np.concatenate(forage_slots), np.concatenate(forage_targets))
+        else:
+            herd.set_foraging(np.zeros(0, dtype=np.int64), np.zeros((0, 2)))
+        self.__eat(eaten)
+
+    def __eat(self, eaten):
+        for eat, item in eaten:
+            eat(item)
+        self.meals += len(eaten)
@@ -12,14 +12,24 @@ Date: 4 July 2021
 '''
 import tkinter as tk
 import time
+import re
 from PIL import ImageTk
 from PIL import Image as Img
 import abc
 import os
 import math
+import random
+import heapq
+from collections import OrderedDict
+from spatial import SpatialHash
+from viewport import Viewport
+from profiler import Profiler
 
 
 
+DEFAULT = object()
+
+
 class Window(tk.Tk):
     '''Window provides a simple graphic user interface for game development.
 
@@ -28,6 +38,8 @@ class Window(tk.Tk):
     layout containing a 1-line text area and a canvas for drawing graphics
     and shapes.
     '''
+
+    headless = False
     
     def __init__(self, title="Game", width=1152, height=984,
                 master=None, default_layout=True):
@@ -41,6 +53,7 @@ class Window(tk.Tk):
         self.title(title)
         self.geometry(str(width)+"x"+str(height)+"+0+0")
         self._canvas = None
+        self.__render_buffer = None
         self.__text_area = None
         
         if default_layout:
@@ -48,6 +61,7 @@ class Window(tk.Tk):
             self.__text_area.pack(side = tk.TOP)
             self._canvas = tk.Canvas(self, bg="light grey")
             self._canvas.pack(side = tk.BOTTOM, expand="YES", fill='both')
+            self.__render_buffer = RenderBuffer(self._canvas)
         
         self.update()
         self.__open = True
@@ -76,12 +90,42 @@ class Window(tk.Tk):
         '''
         return self._canvas
 
+    def get_renderer(self):
+        '''Returns the object that GameObjects draw themselves with.
+
+        For a Window this is a RenderBuffer, which queues drawing commands
+        for the canvas until the next call to update.
+        '''
+        return self.__render_buffer
+
+    def update(self):
+        '''Sends the queued drawing commands to the canvas, then redraws
+        the Window and processes pending events.
+        '''
+        if self.__render_buffer != None:
+            self.__render_buffer.flush()
+        super().update()
+
     def get_canvas_width(self):
         '''Returns the canvas's width.
 
         '''
         return self._canvas.winfo_width()
 
+    def set_scroll_region(self, width, height):
+        '''Lets the canvas scroll over an area of width * height pixels.
+        '''
+        self.__scroll_region = (width, height)
+        self._canvas.configure(scrollregion=(0, 0, width, height))
+
+    def scroll_to(self, x, y):
+        '''Scrolls the canvas so that x, y is shown at its top-left.
+        set_scroll_region must be called first.
+        '''
+        width, height = self.__scroll_region
+        self._canvas.xview_moveto(x / width)
+        self._canvas.yview_moveto(y / height)
+
     def get_canvas_height(self):
         '''Returns the canvas's height.
 
@@ -121,88 +165,1440 @@ class Window(tk.Tk):
 
 
 
+class RenderBuffer:
+    '''RenderBuffer queues drawing commands for a tkinter.Canvas.
+
+    It accepts the same canvas methods as RecordingRenderer. Commands are
+    collected during a frame and sent by flush() as one Tcl script, plus
+    one more for all created items, instead of one Tcl call each.
+    Repeated moves of an item are added together, moves of an item created
+    in the same frame are folded into its creation, and an item created
+    and deleted in the same frame is never sent at all.
+
+    Items are identified by handles chosen by the RenderBuffer, which stay
+    valid after flush(). canvas_id() returns the canvas's own id.
+    '''
+
+    def __init__(self, canvas):
+        '''Creates an empty RenderBuffer for the canvas.'''
+        self.__canvas = canvas
+        self.__ids = {}
+        self.__next_handle = 1
+        self.__creates = {}
+        self.__moves = {}
+        self.__coords = {}
+        self.__configs = {}
+        self.__lowers = []
+        self.__deletes = []
+        self.queued = 0
+        self.flushed = 0
+        self.tcl_calls = 0
+
+    def canvas_id(self, handle):
+        '''Returns the canvas id of the item, or None if it is not created yet.'''
+        return self.__ids.get(handle)
+
+    def __create(self, kind, coords, options):
+        handle = self.__next_handle
+        self.__next_handle += 1
+        self.__creates[handle] = [kind, list(coords), dict(options), False]
+        self.queued += 1
+        return handle
+
+    def create_rectangle(self, *coords, **options):
+        '''Queues the creation of a rectangle and returns its handle.'''
+        return self.__create("rectangle", coords, options)
+
+    def create_image(self, x, y, **options):
+        '''Queues the creation of an image and returns its handle.'''
+        return self.__create("image", (x, y), options)
+
+    def move(self, item, dx, dy):
+        '''Queues a relative move of the item.'''
+        self.queued += 1
+        pending = self.__creates.get(item)
+        coords = pending[1] if pending != None else self.__coords.get(item)
+        if coords != None:
+            for i in range(0, len(coords), 2):
+                coords[i] += dx
+                coords[i + 1] += dy
+            return
+        move = self.__moves.get(item)
+        if move == None:
+            self.__moves[item] = [dx, dy]
+        else:
+            move[0] += dx
+            move[1] += dy
+
+    def coords(self, item, *coords):
+        '''Queues new coordinates for the item.'''
+        self.queued += 1
+        pending = self.__creates.get(item)
+        if pending != None:
+            pending[1] = list(coords)
+        else:
+            self.__moves.pop(item, None)
+            self.__coords[item] = list(coords)
+
+    def itemconfig(self, item, **options):
+        '''Queues a change of the item's options.'''
+        self.queued += 1
+        pending = self.__creates.get(item)
+        if pending != None:
+            pending[2].update(options)
+        else:
+            self.__configs.setdefault(item, {}).update(options)
+
+    def tag_lower(self, item):
+        '''Queues moving the item below all other items.'''
+        self.queued += 1
+        pending = self.__creates.get(item)
+        if pending != None:
+            pending[3] = True
+        else:
+            self.__lowers.append(item)
+
+    def delete(self, item):
+        '''Queues the deletion of the item.'''
+        self.queued += 1
+        if self.__creates.pop(item, None) != None:
+            return
+        self.__moves.pop(item, None)
+        self.__coords.pop(item, None)
+        self.__configs.pop(item, None)
+        self.__deletes.append(item)
+
+    def flush(self):
+        '''Sends every queued command to the canvas.'''
+        canvas = self.__canvas
+        path = canvas._w
+        if self.__creates:
+            handles = list(self.__creates)
+            script = ["list"]
+            for handle in handles:
+                kind, coords, options, lower = self.__creates[handle]
+                script.append("[" + " ".join([path, "create", kind]
+                    + [_tcl_word(c) for c in coords] + _tcl_options(options)) + "]")
+            ids = canvas.tk.splitlist(canvas.tk.eval(" ".join(script)))
+            self.tcl_calls += 1
+            self.flushed += len(handles)
+            for handle, canvas_id in zip(handles, ids):
+                self.__ids[handle] = int(canvas_id)
+                if self.__creates[handle][3]:
+                    self.__lowers.append(handle)
+            self.__creates.clear()
+        script = []
+        ids = self.__ids
+        for item, (dx, dy) in self.__moves.items():
+            if dx != 0 or dy != 0:
+                script.append(" ".join((path, "move", str(ids[item]), _tcl_word(dx), _tcl_word(dy))))
+        for item, coords in self.__coords.items():
+            script.append(" ".join([path, "coords", str(ids[item])]
+                                   + [_tcl_word(c) for c in coords]))
+        for item, options in self.__configs.items():
+            script.append(" ".join([path, "itemconfigure", str(ids[item])] + _tcl_options(options)))
+        for item in self.__lowers:
+            if item in ids:
+                script.append(" ".join((path, "lower", str(ids[item]))))
+        for item in self.__deletes:
+            canvas_id = ids.pop(item, None)
+            if canvas_id != None:
+                script.append(" ".join((path, "delete", str(canvas_id))))
+        if script:
+            canvas.tk.eval("\n".join(script))
+            self.tcl_calls += 1
+        self.flushed += len(script)
+        self.__moves.clear()
+        self.__coords.clear()
+        self.__configs.clear()
+        self.__lowers.clear()
+        self.__deletes.clear()
+
+
+
+_TCL_PLAIN = re.compile(r"^[\w.+:-]+$")
+_TCL_SPECIAL = re.compile(r'([\\\[\]$"{};])')
+
+def _tcl_word(value):
+    '''Returns value as a word that Tcl reads back unchanged.'''
+    if isinstance(value, float):
+        return repr(float(value))
+    text = str(value)
+    if _TCL_PLAIN.match(text):
+        return text
+    return '"' + _TCL_SPECIAL.sub(r"\\\1", text).replace("\n", "\\n") + '"'
+
+def _tcl_options(options):
+    '''Returns keyword options as a list of Tcl words, skipping None.'''
+    words = []
+    for name, value in options.items():
+        if value != None:
+            words.append("-" + name)
+            words.append(_tcl_word(value))
+    return words
+
+
+
+class RecordingRenderer:
+    '''A stand-in for tkinter.Canvas that records drawing commands.
+
+    RecordingRenderer accepts the subset of canvas methods used by
+    Rectangle and GameObject. Instead of drawing, each call is appended
+    to the commands list as a tuple, which is useful for testing and for
+    replaying a headless run onto another renderer.
+    '''
+
+    def __init__(self):
+        '''Creates a RecordingRenderer with an empty command list.'''
+        self.commands = []
+        self.queued = 0
+        self.__next_id = 1
+
+    def __record(self, command):
+        self.queued += 1
+        self.commands.append(command)
+
+    def __new_id(self):
+        item = self.__next_id
+        self.__next_id += 1
+        return item
+
+    def create_rectangle(self, *coords, **options):
+        '''Records a rectangle creation and returns its item id.'''
+        item = self.__new_id()
+        self.__record(("create_rectangle", item, coords, options))
+        return item
+
+    def create_image(self, x, y, **options):
+        '''Records an image creation and returns its item id.'''
+        item = self.__new_id()
+        self.__record(("create_image", item, (x, y), options))
+        return item
+
+    def move(self, item, dx, dy):
+        '''Records a relative move of the item.'''
+        self.__record(("move", item, dx, dy))
+
+    def coords(self, item, *coords):
+        '''Records new coordinates for the item.'''
+        self.__record(("coords", item, coords))
+
+    def itemconfig(self, item, **options):
+        '''Records a change of the item's options.'''
+        self.__record(("itemconfig", item, options))
+
+    def delete(self, item):
+        '''Records the deletion of the item.'''
+        self.__record(("delete", item))
+
+    def tag_lower(self, item):
+        '''Records that the item is moved below all other items.'''
+        self.__record(("tag_lower", item))
+
+    def clear(self):
+        '''Discards all recorded commands.'''
+        self.commands.clear()
+
+
+
+class HeadlessWindow:
+    '''HeadlessWindow replaces Window when no display should be used.
+
+    It offers the same methods as Window, but never creates a tkinter.Tk.
+    By default nothing is drawn at all, so GameObjects only keep track of
+    their position and size. A renderer such as RecordingRenderer may be
+    given to capture the drawing commands instead.
+    '''
+
+    headless = True
+
+    def __init__(self, title="Game", width=1152, height=984, renderer=None):
+        '''Creates a HeadlessWindow of the given size.
+
+        If renderer is None, GameObjects will not be drawn.
+        '''
+        self.__title = title
+        self.__width = width
+        self.__height = height
+        self.__renderer = renderer
+        self.__text = ""
+        self.__open = True
+        self.__timer = time.time()
+
+    def title(self, new_title=None):
+        '''Returns the title, or changes it if new_title is given.'''
+        if new_title != None:
+            self.__title = new_title
+        return self.__title
+
+    def destroy(self):
+        '''Closes the window. After this, is_open will return False.'''
+        self.__open = False
+
+    def is_open(self):
+        '''Returns True if the HeadlessWindow has not been closed.'''
+        return self.__open
+
+    def get_canvas(self):
+        '''Returns None, as a HeadlessWindow has no tkinter.Canvas.'''
+        return None
+
+    def get_renderer(self):
+        '''Returns the renderer given to __init__, or None.'''
+        return self.__renderer
+
+    def get_canvas_width(self):
+        '''Returns the width given to __init__.'''
+        return self.__width
+
+    def set_scroll_region(self, width, height):
+        '''Does nothing, as there is no canvas to scroll.'''
+        pass
+
+    def scroll_to(self, x, y):
+        '''Passes the position on to the renderer if it can scroll, such as
+        an OffscreenRenderer. Otherwise does nothing.'''
+        scroll_to = getattr(self.__renderer, "scroll_to", None)
+        if scroll_to != None:
+            scroll_to(x, y)
+
+    def get_canvas_height(self):
+        '''Returns the height given to __init__.'''
+        return self.__height
+
+    def set_text(self, new_text):
+        '''Stores new_text, which can be read back with get_text.'''
+        self.__text = str(new_text)
+
+    def get_text(self):
+        '''Returns the text last given to set_text.'''
+        return self.__text
+
+    def get_time_elapsed(self):
+        '''Returns seconds as a float since the last call to this method.'''
+        secs = time.time()
+        diff = secs - self.__timer
+        self.__timer = secs
+        return diff
+
+    def bind_keys_to(self, function_arg):
+        '''Does nothing, as a HeadlessWindow receives no key presses.'''
+        pass
+
+    def update(self):
+        '''Does nothing, as there is no display to refresh.'''
+        pass
+
+    def __str__(self):
+        return "game.HeadlessWindow"
+
+
+
+class FixedStepScheduler:
+    '''FixedStepScheduler paces a game loop with a fixed simulation step.
+
+    Real time is collected in an accumulator and paid out in steps of
+    exactly time_step seconds, so the simulation behaves the same on fast
+    and slow machines. Render frames are paced separately and are capped
+    at max_fps. If the simulation falls behind, at most max_steps steps
+    are run per frame and the remaining time is dropped, so a slow machine
+    slows the simulation down instead of freezing it.
+    '''
+
+    def __init__(self, time_step=1/60, max_fps=60, max_steps=5):
+        '''Creates a FixedStepScheduler.
+
+        If max_fps is None, frames are not capped and the scheduler never
+        sleeps.
+        '''
+        self.time_step = time_step
+        self.max_fps = max_fps
+        self.max_steps = max_steps
+        self.dropped_time = 0.0
+        self.__accumulator = 0.0
+        self.__last_time = None
+        self.__next_frame = None
+
+    def advance(self, now=None):
+        '''Adds the real time since the previous call to the accumulator.
+
+        Returns how many fixed steps should be run before the next frame.
+        '''
+        if now == None:
+            now = time.perf_counter()
+        if self.__last_time == None:
+            self.__last_time = now
+        self.__accumulator += now - self.__last_time
+        self.__last_time = now
+        steps = int(self.__accumulator // self.time_step)
+        if steps > self.max_steps:
+            kept = self.__accumulator % self.time_step + self.max_steps * self.time_step
+            self.dropped_time += self.__accumulator - kept
+            self.__accumulator = kept
+            steps = self.max_steps
+        self.__accumulator -= steps * self.time_step
+        return steps
+
+    def get_alpha(self):
+        '''Returns how far, from 0 to 1, the current frame lies between
+        the previous step and the next one. May be used to interpolate.'''
+        return self.__accumulator / self.time_step
+
+    def wait_for_frame(self):
+        '''Sleeps until the next frame is due according to max_fps.'''
+        if self.max_fps == None:
+            return
+        frame_time = 1 / self.max_fps
+        now = time.perf_counter()
+        if self.__next_frame == None or now - self.__next_frame > frame_time:
+            self.__next_frame = now
+        self.__next_frame += frame_time
+        delay = self.__next_frame - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+
+class GameObjectRegistry:
+    '''GameObjectRegistry holds the GameObjects of a Game.
+
+    Every object gets a stable integer handle when it is added. Adding and
+    removing are O(1), and objects can be listed by type without scanning
+    all of them. While a step is in progress (between begin_step and
+    end_step) additions and removals are queued, so the objects being
+    iterated never change; the queue is applied when the step ends.
+    Objects removed during a step are skipped for the rest of that step.
+
+    Every object is in one of four update tiers. Objects whose static
+    attribute is True are kept, but never updated. The others are
+    updated every step, or once every few steps if given a rate with
+    set_rate or if their update_every attribute is above 1, or not at all
+    while asleep. An object that is not updated every step is given the
+    seconds passed since its previous update, according to clock(), when
+    it next is. Changes of tier made during a step take effect when the
+    step ends.
+    '''
+
+    def __init__(self, clock=None):
+        '''Creates an empty GameObjectRegistry. clock() returns the current
+        simulated time; by default it is always 0.'''
+        self.__objects = {}
+        self.__active = {}
+        self.__clock = clock if clock != None else (lambda: 0.0)
+        self.__steps = 0
+        self.__catch_up = {}
+        self.__coarse = {}
+        self.__bucket_of = {}
+        self.__sleeping = {}
+        self.__last = {}
+        self.__rates = {}
+        self.__asleep = set()
+        self.__pending_tier = {}
+        self.__by_type = {}
+        self.__views = {}
+        self.__next_handle = 1
+        self.__stepping = False
+        self.__pending_add = {}
+        self.__pending_remove = {}
+        self.__versions = {}
+
+    def __len__(self):
+        return len(self.__objects)
+
+    def __iter__(self):
+        return iter(list(self.__objects.values()))
+
+    def add(self, obj):
+        '''Adds the object and returns its handle.
+
+        During a step the object is added when the step ends.
+        '''
+        handle = self.__next_handle
+        self.__next_handle += 1
+        obj._handle = handle
+        if self.__stepping:
+            self.__pending_add[handle] = obj
+        else:
+            self.__insert(handle, obj)
+        return handle
+
+    def remove(self, obj):
+        '''Removes the object. Does nothing if it was not added.
+
+        During a step the object is removed when the step ends.
+        '''
+        handle = getattr(obj, "_handle", None)
+        if handle == None:
+            return
+        if self.__pending_add.pop(handle, None) != None:
+            return
+        if handle not in self.__objects:
+            return
+        if self.__stepping:
+            self.__pending_remove[handle] = obj
+        else:
+            self.__delete(handle, obj)
+
+    def get(self, handle):
+        '''Returns the object with the given handle, or None.'''
+        return self.__objects.get(handle)
+
+    def contains(self, obj):
+        '''Returns True if the object is added and not waiting for removal.'''
+        handle = getattr(obj, "_handle", None)
+        if handle in self.__pending_add:
+            return True
+        return handle in self.__objects and handle not in self.__pending_remove
+
+    def of_type(self, kind):
+        '''Returns a list of the objects that are instances of kind.'''
+        found = []
+        for objects in self.__view(kind):
+            found.extend(objects.values())
+        return found
+
+    def count(self, kind):
+        '''Returns how many objects are instances of kind.'''
+        return sum(len(objects) for objects in self.__view(kind))
+
+    def counts_by_type(self):
+        '''Returns a dictionary of each exact type to its number of objects.'''
+        return {kind: len(objects) for kind, objects in self.__by_type.items() if objects}
+
+    def version(self, kind):
+        '''Returns a number that changes whenever an instance of kind is
+        added to or removed from the registry.'''
+        return sum(version for exact, version in self.__versions.items()
+                   if issubclass(exact, kind))
+
+    def begin_step(self):
+        '''Starts queuing additions and removals.'''
+        self.__stepping = True
+
+    def end_step(self):
+        '''Stops queuing, then applies the queued additions, removals and
+        changes of tier.'''
+        self.__stepping = False
+        self.__steps += 1
+        if self.__catch_up:
+            for handle, obj in self.__catch_up.items():
+                del self.__last[handle]
+                self.__active[handle] = obj
+            self.__catch_up.clear()
+        if self.__pending_remove:
+            for handle, obj in self.__pending_remove.items():
+                self.__delete(handle, obj)
+            self.__pending_remove.clear()
+        if self.__pending_add:
+            for handle, obj in self.__pending_add.items():
+                self.__insert(handle, obj)
+            self.__pending_add.clear()
+        if self.__pending_tier:
+            for handle, obj in self.__pending_tier.items():
+                if handle in self.__objects:
+                    self.__place(handle, obj)
+            self.__pending_tier.clear()
+
+    def active_count(self):
+        '''Returns how many objects are updated every step.'''
+        return len(self.__active)
+
+    def tier_counts(self):
+        '''Returns a dictionary of how many objects are updated "every_step",
+        every few steps ("coarse"), "sleeping" and "static".'''
+        counts = {"every_step": len(self.__active) + len(self.__catch_up),
+                  "coarse": len(self.__bucket_of), "sleeping": len(self.__sleeping)}
+        counts["static"] = len(self.__objects) - sum(counts.values())
+        return counts
+
+    def set_rate(self, obj, every):
+        '''Updates the object once every every steps, or every step if every
+        is 1. Does nothing if the object is static or was not added.'''
+        handle = self.__handle_of(obj)
+        if handle == None:
+            return
+        if every > 1:
+            self.__rates[handle] = every
+        else:
+            self.__rates.pop(handle, None)
+        self.__retier(handle, obj)
+
+    def get_rate(self, obj):
+        '''Returns once every how many steps the object is updated while awake.'''
+        return self.__rates.get(getattr(obj, "_handle", None), 1)
+
+    def sleep(self, obj):
+        '''Stops updating the object until it is given to wake.'''
+        handle = self.__handle_of(obj)
+        if handle != None and handle not in self.__asleep:
+            self.__asleep.add(handle)
+            self.__retier(handle, obj)
+
+    def wake(self, obj):
+        '''Updates a sleeping object again, at its rate. Its next update is
+        given every second it slept through.'''
+        handle = getattr(obj, "_handle", None)
+        if handle in self.__asleep:
+            self.__asleep.discard(handle)
+            self.__retier(handle, obj)
+
+    def is_sleeping(self, obj):
+        '''Returns True if the object was given to sleep and not yet to wake.'''
+        return getattr(obj, "_handle", None) in self.__asleep
+
+    def owed(self, obj):
+        '''Returns the seconds passed since the object's previous update, or
+        0 if it is updated every step.'''
+        last = self.__last.get(getattr(obj, "_handle", None))
+        return 0.0 if last == None else self.__clock() - last
+
+    def owe(self, obj, seconds):
+        '''Gives the object's next update seconds more, as if its previous
+        update had been seconds earlier. Used when restoring a Game.'''
+        handle = self.__handle_of(obj)
+        if handle == None or seconds <= 0:
+            return
+        self.__last[handle] = self.__last.get(handle, self.__clock()) - seconds
+        if handle in self.__active:
+            del self.__active[handle]
+            self.__catch_up[handle] = obj
+
+    def updatable(self):
+        '''Returns a list of the objects that are not static, in any tier.'''
+        found = list(self.__active.values())
+        found.extend(self.__catch_up.values())
+        for buckets in self.__coarse.values():
+            for bucket in buckets:
+                found.extend(bucket.values())
+        found.extend(self.__sleeping.values())
+        return found
+
+    def stepping(self, seconds):
+        '''Yields (object, seconds) for every object due an update in a step
+        of the given seconds that has not been removed during it. Objects
+        that are not updated every step are given the seconds since their
+        previous update instead.'''
+        removed = self.__pending_remove
+        for handle, obj in self.__active.items():
+            if removed and handle in removed:
+                continue
+            yield obj, seconds
+        if not (self.__catch_up or self.__bucket_of):
+            return
+        now = self.__clock()
+        last = self.__last
+        for handle, obj in self.__catch_up.items():
+            if removed and handle in removed:
+                continue
+            yield obj, now - last[handle]
+        step = self.__steps
+        for every, buckets in self.__coarse.items():
+            for handle, obj in buckets[step % every].items():
+                if removed and handle in removed:
+                    continue
+                elapsed = now - last[handle]
+                last[handle] = now
+                yield obj, elapsed
+
+    def __handle_of(self, obj):
+        handle = getattr(obj, "_handle", None)
+        if obj.static or not (handle in self.__objects or handle in self.__pending_add):
+            return None
+        return handle
+
+    def __retier(self, handle, obj):
+        if handle in self.__pending_add:
+            return
+        if self.__stepping:
+            self.__pending_tier[handle] = obj
+        else:
+            self.__place(handle, obj)
+
+    def __place(self, handle, obj):
+        '''Moves the object into the tier it belongs in. Objects updated
+        every step are up to date; the others keep the time of their
+        previous update, and are caught up by their next one.'''
+        now = self.__clock()
+        last = self.__last.pop(handle, now)
+        self.__unplace(handle)
+        if handle in self.__asleep:
+            self.__sleeping[handle] = obj
+        elif handle in self.__rates:
+            every = self.__rates[handle]
+            buckets = self.__coarse.get(every)
+            if buckets == None:
+                buckets = self.__coarse[every] = [{} for i in range(every)]
+            bucket = self.__bucket_of[handle] = buckets[handle % every]
+            bucket[handle] = obj
+        elif last < now:
+            self.__catch_up[handle] = obj
+        else:
+            self.__active[handle] = obj
+            return
+        self.__last[handle] = last
+
+    def __unplace(self, handle):
+        self.__active.pop(handle, None)
+        self.__catch_up.pop(handle, None)
+        self.__sleeping.pop(handle, None)
+        bucket = self.__bucket_of.pop(handle, None)
+        if bucket != None:
+            del bucket[handle]
+
+    def __view(self, kind):
+        view = self.__views.get(kind)
+        if view == None:
+            view = [objects for exact, objects in self.__by_type.items()
+                    if issubclass(exact, kind)]
+            self.__views[kind] = view
+        return view
+
+    def __insert(self, handle, obj):
+        self.__objects[handle] = obj
+        if not obj.static:
+            if obj.update_every > 1 and handle not in self.__rates:
+                self.__rates[handle] = obj.update_every
+            self.__place(handle, obj)
+        objects = self.__by_type.get(type(obj))
+        if objects == None:
+            objects = self.__by_type[type(obj)] = {}
+            self.__views.clear()
+        objects[handle] = obj
+        self.__versions[type(obj)] = self.__versions.get(type(obj), 0) + 1
+
+    def __delete(self, handle, obj):
+        del self.__objects[handle]
+        self.__unplace(handle)
+        self.__last.pop(handle, None)
+        self.__rates.pop(handle, None)
+        self.__asleep.discard(handle)
+        self.__pending_tier.pop(handle, None)
+        del self.__by_type[type(obj)][handle]
+        self.__versions[type(obj)] += 1
+
+
+
+class Timer:
+    '''A callback waiting in a TimerQueue until the simulated time reaches time.'''
+
+    __slots__ = ("time", "order", "callback")
+
+    def __init__(self, time, order, callback):
+        '''Creates a Timer. Use TimerQueue.push or Game.schedule instead.'''
+        self.time = time
+        self.order = order
+        self.callback = callback
+
+    def __lt__(self, other):
+        return (self.time, self.order) < (other.time, other.order)
+
+    def active(self):
+        '''Returns True if the Timer has neither fired nor been cancelled.'''
+        return self.callback != None
+
+
+
+class TimerQueue:
+    '''TimerQueue is a priority queue of callbacks ordered by time.
+
+    Timers due at the same time fire in the order they were pushed.
+    Cancelled timers stay in the heap until they reach its top, so
+    cancelling is O(1).
+    '''
+
+    def __init__(self):
+        '''Creates an empty TimerQueue.'''
+        self.__heap = []
+        self.__order = 0
+        self.__active = 0
+
+    def __len__(self):
+        return self.__active
+
+    def push(self, time, callback):
+        '''Adds a callback to be called at the given time. Returns its Timer.'''
+        self.__order += 1
+        timer = Timer(time, self.__order, callback)
+        heapq.heappush(self.__heap, timer)
+        self.__active += 1
+        return timer
+
+    def cancel(self, timer):
+        '''Stops the Timer from firing. Does nothing if it already fired.'''
+        if timer.callback != None:
+            timer.callback = None
+            self.__active -= 1
+
+    def next_time(self):
+        '''Returns the time of the next active Timer, or None.'''
+        heap = self.__heap
+        while heap and heap[0].callback == None:
+            heapq.heappop(heap)
+        if heap:
+            return heap[0].time
+        return None
+
+    def run_due(self, now):
+        '''Calls, in order, every callback due at or before now.
+
+        Callbacks may push new timers; those are run too if they are due.
+        Returns how many callbacks were called.
+        '''
+        heap = self.__heap
+        called = 0
+        while heap and heap[0].time <= now:
+            timer = heapq.heappop(heap)
+            callback = timer.callback
+            if callback == None:
+                continue
+            timer.callback = None
+            self.__active -= 1
+            callback()
+            called += 1
+        return called
+
+
+
+class ContactSystem:
+    '''ContactSystem reports which GameObjects overlap, once per step.
+
+    Only instances of the kinds given to add_rule take part. Every kind
+    gets a category bit, and every type a mask of the categories its
+    rules let it touch. Each step the bounds of every moving object are
+    hashed into the cells of a uniform grid, kept apart by category, and
+    an object is only tested against the categories in its mask that
+    share a cell with it, so pairs no rule is interested in are never
+    tested, and moving objects that no moving kind may touch are not
+    hashed at all. The cost grows with the number of objects and
+    contacts rather than with its square. Static objects are hashed
+    once, and again only when objects of their kind are added or
+    removed; contacts between two static objects are not reported.
+
+    Two objects are in contact if their bounds overlap by more than an
+    edge. The callbacks of a rule are called with (a, b), where a is an
+    instance of the rule's first kind: enter when a contact begins, stay
+    on every later step it lasts and exit when it ends, also when one of
+    them was destroyed. The exit callbacks are called first, then enter
+    or stay for each contact in the order the contacts were found, so
+    that the order does not depend on which contacts began this step.
+    entered, stayed and exited hold the pairs of the last step.
+    '''
+
+    def __init__(self, game, cell_size=96, objects_of=None):
+        '''Creates a ContactSystem without rules for the GameObjects of game.
+
+        objects_of(kind) returns the objects of a kind; by default
+        game.get_game_objs_of_type.'''
+        self.__game = game
+        self.cell_size = cell_size
+        self.__objects_of = objects_of if objects_of != None else game.get_game_objs_of_type
+        self.__kinds = []
+        self.__rules = []
+        self.__flags = {}
+        self.__pair_rules = {}
+        self.__static = {}
+        self.__contacts = {}
+        self.entered = []
+        self.stayed = []
+        self.exited = []
+
+    def add_rule(self, kind_a, kind_b, enter=None, stay=None, exit=None):
+        '''Reports contacts between instances of kind_a and kind_b to the
+        given callbacks, each called with (a, b).'''
+        for kind in (kind_a, kind_b):
+            if kind not in self.__kinds:
+                self.__kinds.append(kind)
+        self.__rules.append((kind_a, kind_b, enter, stay, exit))
+        self.__flags.clear()
+        self.__pair_rules.clear()
+
+    def get_contacts(self):
+        '''Returns a list of the (a, b) pairs in contact after the last step.'''
+        return [(a, b) for a, b, rule in self.__contacts.values()]
+
+    def __flags_of(self, kind):
+        flags = self.__flags.get(kind)
+        if flags == None:
+            category = 0
+            mask = 0
+            for bit, registered in enumerate(self.__kinds):
+                if issubclass(kind, registered):
+                    category |= 1 << bit
+            for kind_a, kind_b, enter, stay, exit in self.__rules:
+                if issubclass(kind, kind_a):
+                    mask |= 1 << self.__kinds.index(kind_b)
+                if issubclass(kind, kind_b):
+                    mask |= 1 << self.__kinds.index(kind_a)
+            flags = self.__flags[kind] = (category, mask)
+        return flags
+
+    def __rule_of(self, kind, other):
+        key = (kind, other)
+        found = self.__pair_rules.get(key, False)
+        if found is False:
+            found = None
+            for rule in self.__rules:
+                if issubclass(kind, rule[0]) and issubclass(other, rule[1]):
+                    found = (rule, False)
+                    break
+                if issubclass(other, rule[0]) and issubclass(kind, rule[1]):
+                    found = (rule, True)
+                    break
+            self.__pair_rules[key] = found
+        return found
+
+    def __cells(self, x0, y0, x1, y1):
+        size = self.cell_size
+        for row in range(int(y0 // size), int(math.ceil(y1 / size))):
+            for col in range(int(x0 // size), int(math.ceil(x1 / size))):
+                yield (col, row)
+
+    def __entry(self, obj):
+        x = obj.get_x()
+        y = obj.get_y()
+        category, mask = self.__flags_of(type(obj))
+        return (x, y, x + obj.get_width(), y + obj.get_height(), category, mask, obj)
+
+    def __static_cells(self, kind):
+        version = self.__game._gameObjects.version(kind)
+        cached = self.__static.get(kind)
+        if cached != None and cached[0] == version:
+            return cached[1]
+        cells = {}
+        for obj in self.__objects_of(kind):
+            if obj.static:
+                entry = self.__entry(obj)
+                for cell in self.__cells(*entry[:4]):
+                    cells.setdefault(cell, []).append(entry)
+        self.__static[kind] = (version, cells)
+        return cells
+
+    def update(self, seconds):
+        '''Finds the contacts of this step and calls the rules' callbacks.
+        Called by the Game once per step.'''
+        moving = {}
+        static = []
+        for kind in self.__kinds:
+            if getattr(kind, "static", False):
+                static.append((self.__flags_of(kind)[0], self.__static_cells(kind)))
+                continue
+            for obj in self.__objects_of(kind):
+                if not obj.is_destroyed():
+                    moving[id(obj)] = obj
+        entries = []
+        categories = 0
+        wanted = 0
+        for obj in moving.values():
+            entry = self.__entry(obj)
+            if entry[5] == 0:
+                continue
+            entries.append(entry)
+            categories |= entry[4]
+            wanted |= entry[5]
+        grid = {}
+        contacts = {}
+        for entry in entries:
+            x0, y0, x1, y1, category, mask, obj = entry
+            touches_moving = mask & categories
+            touched = category & wanted
+            statics = [cells for bits, cells in static if bits & mask]
+            for cell in self.__cells(x0, y0, x1, y1):
+                if touches_moving:
+                    buckets = grid.get(cell)
+                    if buckets != None:
+                        for bits, others in buckets.items():
+                            if bits & mask:
+                                for other in others:
+                                    self.__test(entry, other, contacts)
+                for cells in statics:
+                    for other in cells.get(cell, ()):
+                        self.__test(entry, other, contacts)
+                if touched:
+                    buckets = grid.get(cell)
+                    if buckets == None:
+                        buckets = grid[cell] = {}
+                    others = buckets.get(category)
+                    if others == None:
+                        others = buckets[category] = []
+                    others.append(entry)
+        previous = self.__contacts
+        self.__contacts = contacts
+        entered = [pair for key, pair in contacts.items() if key not in previous]
+        stayed = [pair for key, pair in contacts.items() if key in previous]
+        exited = [pair for key, pair in previous.items() if key not in contacts]
+        self.entered = [(a, b) for a, b, rule in entered]
+        self.stayed = [(a, b) for a, b, rule in stayed]
+        self.exited = [(a, b) for a, b, rule in exited]
+        for a, b, rule in exited:
+            if rule[4] != None:
+                rule[4](a, b)
+        for key, (a, b, rule) in contacts.items():
+            callback = rule[3] if key in previous else rule[2]
+            if callback != None:
+                callback(a, b)
+
+    def __test(self, entry, other, contacts):
+        if not (entry[5] & other[4]) or other[6] is entry[6]:
+            return
+        if not (entry[0] < other[2] and other[0] < entry[2]
+                and entry[1] < other[3] and other[1] < entry[3]):
+            return
+        a = entry[6]
+        b = other[6]
+        found = self.__rule_of(type(a), type(b))
+        if found == None:
+            return
+        rule, swapped = found
+        if swapped:
+            a, b = b, a
+        key = (id(a), id(b))
+        if key not in contacts:
+            contacts[key] = (a, b, rule)
+
+
+
+class UpdateTiers:
+    '''UpdateTiers updates GameObjects less often while little changes for them.
+
+    Once every check_every steps it puts every GameObject that is not
+    static into a tier: a hidden one, outside the Viewport, is updated once
+    every hidden_every steps, and one that has not moved for idle_steps
+    steps once every idle_every steps, each given the seconds passed since
+    its previous update. An object is put back into its own tier, set by
+    its update_every attribute, as soon as it is shown or moves.
+    Sleeping objects are left asleep.
+
+    Hidden objects are only known when the Game draws through a Viewport,
+    so with update tiers the result of a run depends on what is shown.
+    '''
+
+    def __init__(self, game, hidden_every=4, idle_every=8, idle_steps=60, check_every=15):
+        '''Creates an UpdateTiers for the GameObjects of game.'''
+        self.__game = game
+        self.hidden_every = hidden_every
+        self.idle_every = idle_every
+        self.idle_steps = idle_steps
+        self.check_every = check_every
+        self.promotions = 0
+        self.demotions = 0
+        self.__steps = 0
+        self.__moved = {}
+        self.__rates = {}
+
+    def update(self, seconds):
+        '''Moves GameObjects between tiers once every check_every steps.
+        Called by the Game once per step.'''
+        self.__steps += 1
+        if self.__steps % self.check_every != 0:
+            return
+        registry = self.__game._gameObjects
+        steps = self.__steps
+        moved = {}
+        rates = {}
+        for obj in registry.updatable():
+            handle = obj._handle
+            last_moved = self.__moved.get(handle, steps)
+            moved[handle] = last_moved
+            rate = obj.update_every
+            if obj.is_hidden():
+                rate = max(rate, self.hidden_every)
+            if steps - last_moved >= self.idle_steps:
+                rate = max(rate, self.idle_every)
+            current = registry.get_rate(obj)
+            if rate != current:
+                if rate > current:
+                    self.demotions += 1
+                else:
+                    self.promotions += 1
+                registry.set_rate(obj, rate)
+            if rate != obj.update_every:
+                rates[handle] = rate
+        self.__moved = moved
+        self.__rates = rates
+
+    def moved(self, obj):
+        '''Notes that the GameObject moved. Called by GameObject.move_by.'''
+        handle = obj._handle
+        self.__moved[handle] = self.__steps
+        if handle in self.__rates:
+            self.__promote(obj, handle)
+
+    def shown(self, obj):
+        '''Notes that the GameObject entered the view. Called by GameObject.show.'''
+        if obj._handle in self.__rates:
+            self.__promote(obj, obj._handle)
+
+    def __promote(self, obj, handle):
+        rate = obj.update_every
+        if obj.is_hidden():
+            rate = max(rate, self.hidden_every)
+        if rate == self.__rates[handle]:
+            return
+        if rate == obj.update_every:
+            del self.__rates[handle]
+        else:
+            self.__rates[handle] = rate
+        self.promotions += 1
+        self.__game._gameObjects.set_rate(obj, rate)
+
+
+
 class Game():
-    '''Game updates a list of GameObjects within a Window.
+    '''Game updates a GameObjectRegistry of GameObjects within a Window.
 
     Game should be inherited by another class.
     '''
-    def __init__(self):
-        '''Creates a Window and an empty list of GameObjects.'''
-        self._window = Window()
-        self._gameObjects = []
+
+    TIME_STEP = 1 / 60
+    MAX_FPS = 60
+    MAX_STEPS_PER_FRAME = 5
+
+    def __init__(self, headless=False, renderer=None, width=1152, height=984, rng=None):
+        '''Creates a Window of width * height pixels and an empty list of
+        GameObjects.
+
+        If headless is True a HeadlessWindow is created instead, which
+        optionally draws into the given renderer.
+        rng is the random.Random used by the simulation; a new unseeded
+        one is created if it is None.
+        '''
+        if headless:
+            self._window = HeadlessWindow(width=width, height=height, renderer=renderer)
+        else:
+            self._window = Window(width=width, height=height)
+        self._gameObjects = GameObjectRegistry(self.get_time)
+        self._systems = []
+        self._late_systems = []
+        self._spatial_index = None
+        self._viewport = None
+        self._time = 0.0
+        self._timers = TimerQueue()
+        self._random = rng if rng != None else random.Random()
+        self._inputs = []
+        self._recorder = None
+        self._profiler = None
+        self._contacts = None
+        self._update_tiers = None
+        self._window.bind_keys_to(self.queue_input)
     
     def add_game_obj(self, obj):
         '''Adds the argument GameObject to the list.'''
-        self._gameObjects.append(obj)
+        self._gameObjects.add(obj)
 
     def _get_game_objs(self):
         '''Returns a list containing all the GameObjects.
         
         This should not be called directly; 
         Create your own composition and aggregation relationships instead.'''         
-        return self._gameObjects
+        return list(self._gameObjects)
+
+    def get_drawables(self):
+        '''Returns the GameObjects that are drawn as their own sprite.
+
+        Used by a SnapshotWriter. Subclasses which draw some GameObjects
+        in another way, or keep some outside the list, may override this.'''
+        return self._get_game_objs()
+
+    def get_game_objs_of_type(self, kind):
+        '''Returns a list of the GameObjects that are instances of kind.'''
+        return self._gameObjects.of_type(kind)
     
     def _remove_game_obj(self, obj):
         '''Removes the argument GameObject from the list.
         
         This should not be called directly; 
         Call the GameObject's destroy() method instead.'''
-        while obj in self._gameObjects:
-            self._gameObjects.remove(obj)
+        self._gameObjects.remove(obj)
+
+    def add_system(self, system, late=False):
+        '''Adds a system which is updated once per step before the GameObjects.
+
+        A system is any object with an update(seconds) method that
+        works on many GameObjects at once. If late is True, it is updated
+        after the GameObjects instead, once the step has ended, so that it
+        sees the state the step left behind.'''
+        if late:
+            self._late_systems.append(system)
+        else:
+            self._systems.append(system)
+
+    def get_time(self):
+        '''Returns the simulated seconds passed since the Game was created.'''
+        return self._time
+
+    def get_random(self) -> random.Random:
+        '''Returns the random.Random that all randomness in the simulation
+        should come from, so that a run can be repeated from its seed.'''
+        return self._random
+
+    def queue_input(self, event):
+        '''Queues a key press event. Queued events are given to on_key at
+        the start of the next step, so that they can be recorded and
+        replayed at the same point of the simulation.'''
+        self._inputs.append(event)
+
+    def on_key(self, event):
+        '''Called at the start of a step for every key pressed since the
+        previous step. Does nothing unless overridden.'''
+        pass
+
+    def set_recorder(self, recorder):
+        '''Makes recorder.record_step(seconds, inputs) be called before
+        every step, or stops recording if recorder is None.'''
+        self._recorder = recorder
+
+    def schedule(self, delay, callback):
+        '''Calls callback, without arguments, once delay simulated seconds
+        have passed. Returns a Timer which may be given to cancel_timer.
+
+        Scheduling a wake-up instead of counting down in update lets an
+        object be static and leave the per-step update loop entirely.'''
+        return self._timers.push(self._time + delay, callback)
+
+    def cancel_timer(self, timer):
+        '''Stops a Timer returned by schedule from firing.'''
+        self._timers.cancel(timer)
+
+    def enable_spatial_index(self, cell_size=96):
+        '''Creates a SpatialHash that tracks the position of every GameObject.
+
+        GameObjects created afterwards are added automatically, and every
+        GameObject keeps its entry up to date as it moves.'''
+        if self._spatial_index == None:
+            self._spatial_index = SpatialHash(cell_size)
+            for obj in self._get_game_objs():
+                self._spatial_index.insert(obj)
+        return self._spatial_index
+
+    def get_spatial_index(self) -> SpatialHash:
+        '''Returns the SpatialHash, or None if it has not been enabled.'''
+        return self._spatial_index
+
+    def enable_viewport(self, world_width, world_height, chunk_size):
+        '''Creates a Viewport over a world of world_width * world_height pixels.
+
+        From then on only GameObjects in chunks of chunk_size pixels that
+        intersect the visible part of the canvas are drawn.'''
+        if self._viewport == None:
+            self._viewport = Viewport(self, world_width, world_height, chunk_size)
+            for obj in self._get_game_objs():
+                self._viewport.track(obj)
+                if not self._viewport.contains(obj):
+                    obj.hide()
+        return self._viewport
+
+    def get_viewport(self) -> Viewport:
+        '''Returns the Viewport, or None if it has not been enabled.'''
+        return self._viewport
+
+    def enable_profiler(self, overlay=False):
+        '''Creates a Profiler that times every step and frame from now on.
+
+        If overlay is True, a summary is shown in the Window's text area.'''
+        if self._profiler == None:
+            self._profiler = Profiler(overlay=overlay)
+        return self._profiler
+
+    def disable_profiler(self):
+        '''Stops profiling. The Profiler keeps what it has measured.'''
+        self._profiler = None
+
+    def get_profiler(self) -> Profiler:
+        '''Returns the Profiler, or None if profiling is not enabled.'''
+        return self._profiler
+
+    def enable_contacts(self, cell_size=96, objects_of=None):
+        '''Creates a ContactSystem and adds it as a system, so that from
+        then on contacts are found once per step. Rules are added to it
+        with add_rule.'''
+        if self._contacts == None:
+            self._contacts = ContactSystem(self, cell_size, objects_of)
+            self.add_system(self._contacts)
+        return self._contacts
+
+    def get_contacts(self) -> ContactSystem:
+        '''Returns the ContactSystem, or None if it has not been enabled.'''
+        return self._contacts
+
+    def enable_update_tiers(self, hidden_every=4, idle_every=8, idle_steps=60, check_every=15):
+        '''Creates an UpdateTiers and adds it as a system, so that from then
+        on GameObjects outside the Viewport and GameObjects that stand
+        still are updated less often, see UpdateTiers.'''
+        if self._update_tiers == None:
+            self._update_tiers = UpdateTiers(self, hidden_every, idle_every, idle_steps,
+                                             check_every)
+            self.add_system(self._update_tiers)
+        return self._update_tiers
+
+    def get_update_tiers(self) -> UpdateTiers:
+        '''Returns the UpdateTiers, or None if it has not been enabled.'''
+        return self._update_tiers
 
     def get_window(self) -> Window:
         '''Returns a reference to the window.'''
         return self._window
+
+    def is_headless(self):
+        '''Returns True if the Game was created without a display.'''
+        return self._window.headless
+
+    def step(self, seconds):
+        '''Updates every system and GameObject once, as if seconds had passed.
+
+        Queued key presses are handled first, then timers that are due by
+        the end of the step fire.
+        GameObjects created or destroyed during the step are added to or
+        removed from the list when the step ends.'''
+        inputs = self._inputs
+        self._inputs = []
+        if self._recorder != None:
+            self._recorder.record_step(seconds, inputs)
+        self._gameObjects.begin_step()
+        try:
+            for event in inputs:
+                self.on_key(event)
+            self._time += seconds
+            if self._profiler != None:
+                self._profiler.run_step(seconds, self._time, self._timers, self._systems,
+                                        self._gameObjects.stepping(seconds))
+            else:
+                self._timers.run_due(self._time)
+                for system in self._systems:
+                    system.update(seconds)
+                for object, elapsed in self._gameObjects.stepping(seconds):
+                    object.update(elapsed)
+        finally:
+            self._gameObjects.end_step()
+        for system in self._late_systems:
+            system.update(seconds)
     
-    def run(self):
+    def run(self, ticks=None, seconds=None, time_step=None, max_fps=DEFAULT,
+            max_steps_per_frame=None):
         '''Starts a loop that updates all GameObjects and the window.
+
+        Every update advances the simulation by exactly time_step seconds,
+        and the window is redrawn at most max_fps times per second, by
+        default Game.MAX_FPS, or as often as possible if max_fps is None;
+        see FixedStepScheduler. A headless Game does not wait for real time
+        and runs one update after another as fast as the CPU allows.
+        The loop stops when the Window is closed, after the given number
+        of ticks, or once the given number of simulated seconds has passed.
         
         Code written after calling run() may not execute until the 
         Window is closed.'''
+        if time_step == None:
+            time_step = Game.TIME_STEP
+        if max_fps is DEFAULT:
+            max_fps = Game.MAX_FPS
+        if max_steps_per_frame == None:
+            max_steps_per_frame = Game.MAX_STEPS_PER_FRAME
+        scheduler = FixedStepScheduler(time_step, max_fps, max_steps_per_frame)
+        headless = self.is_headless()
+        tick = 0
         while self._window.is_open():
-            timeElapsed = self._window.get_time_elapsed()
-            for object in self._get_game_objs():
-                object.update(timeElapsed)
-
+            profiler = self._profiler
+            if profiler != None:
+                profiler.begin_frame()
+            steps = 1 if headless else scheduler.advance()
+            for i in range(steps):
+                if ticks != None and tick >= ticks:
+                    return
+                if seconds != None and tick * time_step >= seconds:
+                    return
+                self.step(time_step)
+                tick += 1
+            if profiler != None:
+                profiler.begin_render()
             self._window.update()
+            if profiler != None:
+                profiler.end_frame(self)
+            if not headless:
+                scheduler.wait_for_frame()
 
 
 
 class Vector2D:
     '''Contains an x and y coordinate. 
     A Vector2D may be used as a position, or a direction with length.
+
+    add, subtract, scale and normalize return a new Vector2D. The methods
+    starting with i, normalize_inplace, set and the step and move methods
+    change the Vector2D itself and allocate nothing, which is preferable
+    in code that runs every frame.
     '''
 
+    __slots__ = ("x", "y")
+
     def __init__(self, x, y):
         '''Constructs the Vector2D to the argument x and y.'''
         self.x = x
         self.y = y
+
+    def set(self, x, y):
+        '''Changes this object's x and y. Returns this object.'''
+        self.x = x
+        self.y = y
+        return self
     
     def add(self, vec):
         '''Adds the given Vector2D's x and y to this object's x and y.
         Returns as a new Vector2D.'''
         return Vector2D(self.x + vec.x, self.y + vec.y)
+
+    def iadd(self, vec):
+        '''Adds the given Vector2D's x and y to this object's x and y.
+        Returns this object.'''
+        self.x += vec.x
+        self.y += vec.y
+        return self
     
     def subtract(self, vec):
         '''Subtracts the given Vector2D's x and y to this object's x and y.
         Returns as a new Vector2D.'''
         return Vector2D(self.x - vec.x, self.y - vec.y)
+
+    def isub(self, vec):
+        '''Subtracts the given Vector2D's x and y from this object's x and y.
+        Returns this object.'''
+        self.x -= vec.x
+        self.y -= vec.y
+        return self
     
     def scale(self, scalar):
         '''Scales the calling object by multiplying the x and y by the scalar.
         Returns as a new Vector2D.'''
         return Vector2D(self.x * scalar, self.y * scalar)
 
+    def iscale(self, scalar):
+        '''Multiplies this object's x and y by the scalar. Returns this object.'''
+        self.x *= scalar
+        self.y *= scalar
+        return self
+
     def length(self):
         '''Calculates and returns the distance between (0, 0) and this object's (x, y).
         '''
         return math.sqrt(self.x**2 + self.y**2)
 
+    def length_squared(self):
+        '''Returns the squared length. Cheaper than length, as no square root
+        is needed, and enough to compare lengths.
+        '''
+        return self.x * self.x + self.y * self.y
+
     def distance(self, vec):
         '''Calculates and returns the distance between the given Vector2D's (x, y) and this object's (x, y).
         '''
         return math.sqrt((self.x - vec.x)**2 + (self.y - vec.y)**2)
 
+    def distance_squared(self, vec):
+        '''Returns the squared distance between the given Vector2D and this object.
+        Compare it with a squared distance, e.g. d < 48 * 48.
+        '''
+        dx = self.x - vec.x
+        dy = self.y - vec.y
+        return dx * dx + dy * dy
+
     def normalize(self):
         '''Normalizes this object so that the vector is scaled to a length of 1.
         '''
@@ -210,10 +1606,44 @@ class Vector2D:
         if length != 0:
             return Vector2D(self.x / length, self.y / length)
         return Vector2D(self.x, self.y)
+
+    def normalize_inplace(self):
+        '''Scales this object to a length of 1, unless its length is 0.
+        Returns this object.'''
+        length = math.sqrt(self.x * self.x + self.y * self.y)
+        if length != 0:
+            self.x /= length
+            self.y /= length
+        return self
+
+    def step_toward(self, target, step, out):
+        '''Stores in out the vector of length step pointing from this object
+        towards target. Same as target.subtract(self).normalize().scale(step),
+        without creating any Vector2D. Returns out.'''
+        dx = target.x - self.x
+        dy = target.y - self.y
+        length = math.sqrt(dx * dx + dy * dy)
+        if length != 0:
+            step /= length
+        return out.set(dx * step, dy * step)
+
+    def move_toward(self, target, step, arrival_distance=0):
+        '''Moves this object step units towards target.
+        Returns True if it is then closer than arrival_distance to target.'''
+        dx = target.x - self.x
+        dy = target.y - self.y
+        length = math.sqrt(dx * dx + dy * dy)
+        if length != 0:
+            step /= length
+        self.x += dx * step
+        self.y += dy * step
+        return self.distance_squared(target) < arrival_distance * arrival_distance
     
     def __eq__(self, other):
-        if other == None:
+        if other is None:
             return False
+        if not isinstance(other, Vector2D):
+            return NotImplemented
         return self.x == other.x and self.y == other.y
 
     def __str__(self):
@@ -249,7 +1679,10 @@ class Rectangle:
     def _draw(self):
         '''This is called by the __init__ method.
         Should not be called directly.'''
-        self._id = self._window.get_canvas().create_rectangle(
+        renderer = self._window.get_renderer()
+        if renderer == None:
+            return
+        self._id = renderer.create_rectangle(
             self._position.x,
             self._position.y,
             self._position.x + self.__width,
@@ -286,17 +1719,21 @@ class Rectangle:
         '''Changes the width of the Rectangle to the argument.
         '''
         self.__width = w
-        coords = self._window.get_canvas().coords(self._id)
-        if len(coords) == 4:
-            self._window.get_canvas().coords(self._id, coords[0], coords[1], coords[0]+w, coords[3])
+        self._resize_item()
 
     def set_height(self, h):
         '''Changes the height of the Rectangle to the argument.
         '''
         self.__height = h
-        coords = self._window.get_canvas().coords(self._id)
-        if len(coords) == 4:
-            self._window.get_canvas().coords(self._id, coords[0], coords[1], coords[2], coords[1]+h)
+        self._resize_item()
+
+    def _resize_item(self):
+        '''Updates the drawn item to the current width and height.
+        Should not be called directly.'''
+        if self._id != None:
+            self._window.get_renderer().coords(self._id,
+                self._position.x, self._position.y,
+                self._position.x + self.__width, self._position.y + self.__height)
 
     def move_by(self, dx, dy):
         '''Adds the argument dx to the x coordinate and dy to the y coordinate.
@@ -306,16 +1743,20 @@ class Rectangle:
         '''
         self._position.x += dx
         self._position.y += dy
-        if self._window.get_canvas() != None:
-            self._window.get_canvas().move(self._id, dx, dy)
+        if self._id != None:
+            self._window.get_renderer().move(self._id, dx, dy)
 
     def move_to(self, x, y):
         '''Sets the Rectangle's x and y coordinates to the argument x and y.
+        The coordinates are set exactly, however many moves came before.
         '''
         self.move_by(-self._position.x+x, -self._position.y+y)
+        self._position.x = x
+        self._position.y = y
 
     def get_id(self):
-        '''Returns the id of this object in the canvas.
+        '''Returns the id of this object in the Window's renderer.
+        For a Window, RenderBuffer.canvas_id converts it to a canvas id.
         If canvas was set to None in __init__, this will return None.
         '''
         return self._id
@@ -325,7 +1766,8 @@ class Rectangle:
         The Rectangle will not be drawable after a call to this method.
         '''
         if self._window != None:
-            self._window.get_canvas().delete(self._id)
+            if self._id != None:
+                self._window.get_renderer().delete(self._id)
             self._id = None
             self._window = None
         
@@ -344,42 +1786,112 @@ class GameObject(Rectangle, metaclass = abc.ABCMeta):
     Contains an image to be drawn in the attached Game's window.
     Subclasses of this must implement the abstract update method.
     Closely related to the Game class.
+    Subclasses which never change may set static to True, so that the
+    Game does not call their update method. Subclasses which need not be
+    updated every step may set update_every to the number of steps
+    between updates; their update method is then given the seconds
+    passed since its previous call.
     '''
 
+    static = False
+    update_every = 1
+
     def __init__(self, position: Vector2D, width: float, height: float, 
                 sourceImage: Img.Image, game: Game):
         '''Initializes the argument image and attaches it to the Game.
         '''
         self.__source = sourceImage
         self.__image = None
+        self.__image_key = None
         self.__game = game
-        self.__game.add_game_obj(self)
+        self._handle = None
+        self._hidden = False
+        self._wake_timer = None
         super().__init__(position, width, height, game._window)   
+        self.__game.add_game_obj(self)
+        if game._spatial_index != None:
+            game._spatial_index.insert(self)
+        if game._viewport != None:
+            game._viewport.track(self)
 
     def get_game(self) -> Game:
         '''Returns the attached Game.'''
         return self.__game
+
+    def get_handle(self):
+        '''Returns the handle given by the Game's GameObjectRegistry, or None.'''
+        return self._handle
     
     def _draw(self):
         '''This is called by the __init__ method.
         Should not be called directly.'''
         if self._window != None:
-            self.__image = ImageTk.PhotoImage(
-                self.__source.resize((int(self.get_width()), int(self.get_height())), 
-                Img.NEAREST))
-            self._id = self._window.get_canvas().create_image(self._position.x, 
+            renderer = self._window.get_renderer()
+            if renderer == None:
+                return
+            viewport = self.__game._viewport
+            if self._hidden or (viewport != None and not viewport.contains(self)):
+                self._hidden = True
+                return
+            self.__image = self._make_image()
+            self._id = renderer.create_image(self._position.x, 
             self._position.y, anchor=tk.NW, image=self.__image)
 
+    def _make_image(self):
+        '''Returns the source image scaled to the current width and height.
+
+        A headless Window receives a PIL image, any other Window receives
+        an ImageTk.PhotoImage. Images loaded by ImageLibrary are shared
+        through its cache.
+        Should not be called directly.'''
+        width = int(self.get_width())
+        height = int(self.get_height())
+        photo = not self._window.headless
+        previous = self.__image_key
+        name = ImageLibrary.name_of(self.__source)
+        if name != None:
+            self.__image_key = (name, width, height, photo)
+            image = ImageLibrary.acquire(name, width, height, photo)
+        else:
+            self.__image_key = None
+            image = self.__source.resize((width, height), Img.NEAREST)
+            if photo:
+                image = ImageTk.PhotoImage(image)
+        if previous != None:
+            ImageLibrary.release(*previous)
+        return image
+
+    def _release_image(self):
+        '''Gives the scaled image back to the ImageLibrary cache.
+        Should not be called directly.'''
+        self.__image = None
+        if self.__image_key != None:
+            ImageLibrary.release(*self.__image_key)
+            self.__image_key = None
+
+    def _refresh_image(self):
+        '''Redraws the image after the source or size has changed.
+        Should not be called directly.'''
+        if self._id == None:
+            self._release_image()
+            return
+        self.__image = self._make_image()
+        self._window.get_renderer().itemconfig(self._id, anchor=tk.NW, image=self.__image)
+
+    def _resize_item(self):
+        '''Images are resized by _refresh_image instead of by coords.
+        Should not be called directly.'''
+        pass
+
     def set_image(self, img):
         '''May be called to change the source image.
-        This can be used to animate the GameObject.
+        This can be used to animate the GameObject, see animation.Animator.
+        Does nothing if img already is the source image.
         '''
+        if img is self.__source:
+            return
         self.__source = img
-        self.__image = ImageTk.PhotoImage(
-            self.__source.resize((int(self.get_width()), int(self.get_height())), 
-                Img.NEAREST))
-        if self._window != None:
-            self._window.get_canvas().itemconfig(self._id, anchor=tk.NW, image=self.__image)
+        self._refresh_image()
     
     def get_image(self) -> Img.Image:
         '''Return the source image.
@@ -390,27 +1902,96 @@ class GameObject(Rectangle, metaclass = abc.ABCMeta):
         '''Changes the width of the image/rectangle to the argument.
         '''
         super().set_width(w)
-        self.__image = ImageTk.PhotoImage(
-            self.__source.resize((int(self.get_width()), int(self.get_height())), 
-            Img.NEAREST))
-        if self._window != None:
-            self._window.get_canvas().itemconfig(self._id, anchor=tk.NW, image=self.__image)
+        self._refresh_image()
 
     def set_height(self, h):
         '''Changes the height of the image/rectangle to the argument.
         '''
         super().set_height(h)
-        self.__image = ImageTk.PhotoImage(
-            self.__source.resize((int(self.get_width()), int(self.get_height())), 
-            Img.NEAREST))
-        if self._window != None:
-            self._window.get_canvas().itemconfig(self._id, anchor=tk.NW, image=self.__image)
+        self._refresh_image()
     
     def destroy(self):
         '''Removes the GameObject from the attached Game and from its Window.
         '''
         super().destroy()
+        self._release_image()
+        if self._wake_timer != None:
+            self.__game.cancel_timer(self._wake_timer)
+            self._wake_timer = None
         self.__game._remove_game_obj(self)
+        if self.__game._spatial_index != None:
+            self.__game._spatial_index.remove(self)
+        if self.__game._viewport != None:
+            self.__game._viewport.untrack(self)
+
+    def hide(self):
+        '''Removes the GameObject's canvas item, but keeps it in the Game.
+        Used by the Viewport for objects outside the visible area.
+        '''
+        self._hidden = True
+        if self._id != None:
+            self._window.get_renderer().delete(self._id)
+            self._id = None
+        self._release_image()
+
+    def show(self):
+        '''Draws a hidden GameObject again.
+        '''
+        if not self._hidden:
+            return
+        self._hidden = False
+        if self._window != None and self._id == None:
+            self._draw()
+        if self.__game._update_tiers != None:
+            self.__game._update_tiers.shown(self)
+
+    def is_hidden(self):
+        '''Returns True if the GameObject was hidden by hide().
+        '''
+        return self._hidden
+
+    def is_destroyed(self):
+        '''Returns True once destroy() has been called.
+        '''
+        return self._window == None
+
+    def move_by(self, dx, dy):
+        '''Adds the argument dx to the x coordinate and dy to the y coordinate,
+        and keeps the Game's spatial index up to date.
+        '''
+        super().move_by(dx, dy)
+        if self.__game._spatial_index != None:
+            self.__game._spatial_index.update(self)
+        if self.__game._viewport != None:
+            self.__game._viewport.moved(self)
+        if self.__game._update_tiers != None:
+            self.__game._update_tiers.moved(self)
+
+    def sleep(self, seconds=None):
+        '''Stops the Game from calling update until wake is called, or
+        until seconds simulated seconds have passed if seconds is given.
+        The first update after waking is given every second slept through.
+        '''
+        game = self.__game
+        if self._wake_timer != None:
+            game.cancel_timer(self._wake_timer)
+            self._wake_timer = None
+        game._gameObjects.sleep(self)
+        if seconds != None:
+            self._wake_timer = game.schedule(seconds, self.wake)
+
+    def wake(self):
+        '''Lets the Game call update again after sleep.
+        '''
+        if self._wake_timer != None:
+            self.__game.cancel_timer(self._wake_timer)
+            self._wake_timer = None
+        self.__game._gameObjects.wake(self)
+
+    def is_sleeping(self):
+        '''Returns True between calls to sleep and wake.
+        '''
+        return self.__game._gameObjects.is_sleeping(self)
 
     @abc.abstractmethod
     def update(self, seconds): 
@@ -425,24 +2006,41 @@ class ImageLibrary:
     '''ImageLibrary is a collection which maps .PNG images to names.
     Must first call the load method to read .PNG images from a folder.
     Then images may be accessed using their name, without the .png 
-    extension.'''
+    extension.
+
+    ImageLibrary also keeps a cache of scaled copies, so that all
+    GameObjects showing the same image at the same size share one
+    ImageTk.PhotoImage. Copies are counted while in use and up to
+    cache_size unused copies are kept, least recently used first out.
+    images_created and image_seconds count the scaled copies made and
+    the time spent making them.'''
 
     __images = {}
+    __names = {}
+    __scaled = OrderedDict()
+    __unused = 0
+    cache_size = 64
+    images_created = 0
+    image_seconds = 0.0
     
-    def load(path):
+    def load(path, verbose=True):
         '''Reads all .PNG images in the argument folder, and its 
         subfolders. Each image is added to a dictionary using its
         name as the key. The names do not contain the .png extension.
+        If verbose is False, nothing is printed.
         '''
         for root, dirs, files in os.walk(path):
-            print(root, dirs, files)
+            if verbose:
+                print(root, dirs, files)
             for name in files:
                 if name.endswith('.png'):
                     alias = name[: len(name)-4]
                     image = Img.open(root+'/'+name)
                     ImageLibrary.__images[alias] = image
-        print(ImageLibrary.__images)
-        print(path)
+                    ImageLibrary.__names[id(image)] = alias
+        if verbose:
+            print(ImageLibrary.__images)
+            print(path)
 
 
     def get(name) -> Img.Image:
@@ -450,3 +2048,67 @@ class ImageLibrary:
         '''
         return ImageLibrary.__images[name]
 
+    def name_of(image):
+        '''Returns the name of a loaded image, or None if it was not loaded.
+        '''
+        return ImageLibrary.__names.get(id(image))
+
+    def acquire(name, width, height, photo=True):
+        '''Returns the named image scaled to width * height pixels.
+
+        If photo is True the result is an ImageTk.PhotoImage, otherwise a
+        PIL image. Scaled copies are shared; every call must be matched by
+        a call to release with the same arguments once it is not needed.
+        '''
+        key = (name, int(width), int(height), photo)
+        entry = ImageLibrary.__scaled.get(key)
+        if entry == None:
+            start = time.perf_counter()
+            image = ImageLibrary.__images[name].resize((key[1], key[2]), Img.NEAREST)
+            if photo:
+                image = ImageTk.PhotoImage(image)
+            ImageLibrary.images_created += 1
+            ImageLibrary.image_seconds += time.perf_counter() - start
+            entry = [image, 0]
+            ImageLibrary.__scaled[key] = entry
+        else:
+            ImageLibrary.__scaled.move_to_end(key)
+            if entry[1] == 0:
+                ImageLibrary.__unused -= 1
+        entry[1] += 1
+        return entry[0]
+
+    def release(name, width, height, photo=True):
+        '''Marks one use of a scaled image from acquire as finished.
+        '''
+        key = (name, int(width), int(height), photo)
+        entry = ImageLibrary.__scaled.get(key)
+        if entry == None or entry[1] == 0:
+            return
+        entry[1] -= 1
+        if entry[1] == 0:
+            ImageLibrary.__unused += 1
+            ImageLibrary.__evict()
+
+    def __evict():
+        if ImageLibrary.__unused <= ImageLibrary.cache_size:
+            return
+        for key in list(ImageLibrary.__scaled):
+            if ImageLibrary.__scaled[key][1] == 0:
+                del ImageLibrary.__scaled[key]
+                ImageLibrary.__unused -= 1
+                if ImageLibrary.__unused <= ImageLibrary.cache_size:
+                    return
+
+    def cache_info():
+        '''Returns the number of cached scaled images and how many are unused.
+        '''
+        return len(ImageLibrary.__scaled), ImageLibrary.__unused
+
+    def clear_cache():
+        '''Removes every unused scaled image from the cache.
+        '''
+        for key in list(ImageLibrary.__scaled):
+            if ImageLibrary.__scaled[key][1] == 0:
+                del ImageLibrary.__scaled[key]
+        ImageLibrary.__unused = 0
@@ -0,0 +1,432 @@
+'''A NumPy engine that moves many animals at once.
+
+HerdEngine keeps the position, target, speed and energy of every animal
+in contiguous NumPy arrays, and updates all of them with a few array
+operations per step instead of one Python call per animal. NumPy is
+optional; it is only needed when a HerdEngine is created.
+'''
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+
+class HerdEngine:
+    '''HerdEngine updates the movement and energy of many animals.
+
+    Animals are added with add() and are taken into the arrays at the
+    start of the next update. Each update drains energy, removes animals
+    that starved, moves animals with a target towards it and picks a new
+    random tile when the target is reached. Hungry animals stand still
+    unless set_foraging sends them towards food. The sprite of an animal
+    is moved when its centre crosses into another cell of the Game's
+    spatial index or chunk of its Viewport, and every step while it is
+    in a visible chunk, or every step if the Game draws into a renderer
+    without a Viewport. These animals are found for all animals at once,
+    and a sprite that stays in its cell and chunk only has its position
+    and canvas item moved. sync() copies the arrays back to every animal
+    on demand.
+
+    An animal is moved if it has a target attribute. The engine records
+    its slot in the animal's _herd_slot attribute. Animals of the kinds
+    given to navigate walk around impassable tiles; their waypoints are
+    read from and written back to their _route attribute, a
+    navigation.Route, when they are added and by sync().
+    '''
+
+    ARRIVAL_DISTANCE = 48
+    HUNGRY_ENERGY = 20
+
+    def __init__(self, game, cols, rows, tile_size=96, capacity=1024, seed=None):
+        '''Creates an empty HerdEngine for a world of cols * rows tiles.
+
+        Raises an ImportError if NumPy is not installed.
+        '''
+        if np is None:
+            raise ImportError("HerdEngine requires numpy")
+        self.__game = game
+        self.__cols = cols
+        self.__rows = rows
+        self.__tile_size = tile_size
+        self.__rng = np.random.default_rng(seed)
+        self.__animals = []
+        self.__pending = []
+        self.__count = 0
+        self.__position = np.zeros((capacity, 2))
+        self.__target = np.zeros((capacity, 2))
+        self.__speed = np.zeros(capacity)
+        self.__energy = np.zeros(capacity)
+        self.__mobile = np.zeros(capacity, dtype=bool)
+        self.__foraging = np.zeros(capacity, dtype=bool)
+        self.__half = np.zeros((capacity, 2))
+        self.__kind = np.zeros(capacity, dtype=np.int32)
+        self.__waypoint = np.zeros((capacity, 2))
+        self.__route = np.full(capacity, -1, dtype=np.int64)
+        self.__types = []
+        self.__navigation = None
+        self.__blocked = None
+        self.__walkers = ()
+
+    def __len__(self):
+        return self.__count + len(self.__pending)
+
+    def add(self, animal):
+        '''Adds the animal to the engine at the start of the next update.'''
+        animal._herd_slot = None
+        self.__pending.append(animal)
+
+    def remove(self, animal):
+        '''Removes the animal from the engine.
+
+        The last animal in the arrays is moved into the freed slot.
+        '''
+        slot = getattr(animal, "_herd_slot", None)
+        if slot == None:
+            if animal in self.__pending:
+                self.__pending.remove(animal)
+            return
+        last = self.__count - 1
+        if slot != last:
+            moved = self.__animals[last]
+            self.__position[slot] = self.__position[last]
+            self.__target[slot] = self.__target[last]
+            self.__speed[slot] = self.__speed[last]
+            self.__energy[slot] = self.__energy[last]
+            self.__mobile[slot] = self.__mobile[last]
+            self.__foraging[slot] = self.__foraging[last]
+            self.__half[slot] = self.__half[last]
+            self.__kind[slot] = self.__kind[last]
+            self.__waypoint[slot] = self.__waypoint[last]
+            self.__route[slot] = self.__route[last]
+            self.__animals[slot] = moved
+            moved._herd_slot = slot
+        self.__animals.pop()
+        self.__foraging[last] = False
+        self.__count = last
+        animal._herd_slot = None
+
+    def get_animals(self, pending=False):
+        '''Returns a list of the animals in slot order. If pending is True,
+        animals not yet taken into the arrays follow in the order added.'''
+        if pending:
+            return self.__animals + self.__pending
+        return list(self.__animals)
+
+    def get_random(self):
+        '''Returns the numpy.random.Generator used to pick new targets.'''
+        return self.__rng
+
+    def counts_by_type(self):
+        '''Returns a dictionary of each exact type to its number of animals,
+        including animals not yet taken into the arrays.'''
+        counts = {}
+        for animal in self.__animals + self.__pending:
+            counts[type(animal)] = counts.get(type(animal), 0) + 1
+        return counts
+
+    def mask_of(self, kind):
+        '''Returns a bool array with an entry per slot, True for the animals
+        in the arrays that are instances of kind.'''
+        kinds = [i for i, exact in enumerate(self.__types) if issubclass(exact, kind)]
+        return np.isin(self.__kind[:self.__count], kinds)
+
+    def of_type(self, kind):
+        '''Returns a list of the animals in the arrays that are instances of
+        kind, and a (n, 2) array of their positions.'''
+        slots = np.flatnonzero(self.mask_of(kind))
+        animals = self.__animals
+        return [animals[slot] for slot in slots.tolist()], self.__position[slots]
+
+    def touching(self, kind, blocked, cell_size):
+        '''Returns a list of the animals in the arrays that are instances of
+        kind and whose bounds overlap a cell of blocked, a (rows, cols)
+        bool array of square cells of cell_size pixels, by more than an
+        edge. Only the positions of those animals are copied back to them.
+        Animals must not be larger than a cell.'''
+        slots = np.flatnonzero(self.mask_of(kind))
+        low = self.__position[slots]
+        first = np.floor(low / cell_size).astype(np.int64)
+        last = np.ceil((low + 2 * self.__half[slots]) / cell_size).astype(np.int64) - 1
+        rows, cols = blocked.shape
+        touches = np.zeros(len(slots), dtype=bool)
+        for col in (first[:, 0], last[:, 0]):
+            for row in (first[:, 1], last[:, 1]):
+                inside = (col >= 0) & (col < cols) & (row >= 0) & (row < rows)
+                touches |= inside & blocked[np.clip(row, 0, rows - 1), np.clip(col, 0, cols - 1)]
+        slots = slots[touches]
+        animals = self.__animals
+        found = []
+        for slot, (x, y) in zip(slots.tolist(), self.__position[slots].tolist()):
+            animals[slot].move_to(x, y)
+            found.append(animals[slot])
+        return found
+
+    def navigate(self, navigation, blocked, kinds):
+        '''Makes the animals that are instances of one of kinds walk around
+        impassable tiles. They pick new random targets only on passable
+        tiles, and head for the tile corners on the path to their target
+        given by navigation, a FlowFields, as FlowFields.waypoint does.
+        The animals heading for the same tile share its field, and look
+        up their next step in it all at once. blocked is called with no
+        arguments and returns a (rows, cols) bool array, True for every
+        impassable tile.'''
+        self.__navigation = navigation
+        self.__blocked = blocked
+        self.__walkers = tuple(kinds)
+
+    def get_positions(self):
+        '''Returns a (n, 2) view of the positions of the animals.'''
+        return self.__position[:self.__count]
+
+    def get_energies(self):
+        '''Returns a view of the energy of the animals.'''
+        return self.__energy[:self.__count]
+
+    def admit(self):
+        '''Takes the animals added since the last update into the arrays now,
+        so that their slots are known before the update.'''
+        if self.__pending:
+            self.__admit_pending()
+
+    def place(self, animal):
+        '''Copies the position and target of an animal that was moved by
+        something other than the engine back into the arrays.'''
+        slot = getattr(animal, "_herd_slot", None)
+        if slot == None:
+            return
+        position = animal.get_position()
+        self.__position[slot] = (position.x, position.y)
+        target = getattr(animal, "target", None)
+        if target != None and self.__mobile[slot]:
+            self.__target[slot] = (target.x, target.y)
+
+    def feed(self, slots, energy):
+        '''Adds energy to the animals in the given slots.'''
+        self.__energy[slots] += energy
+
+    def set_foraging(self, slots, targets):
+        '''Sends the animals in slots towards targets, an array of (x, y)
+        positions, instead of a random tile, and stops every other animal
+        from foraging. Foraging animals move even when they are hungry.'''
+        self.__foraging[:self.__count] = False
+        self.__foraging[slots] = True
+        self.__target[slots] = targets
+
+    def __grow(self, needed):
+        capacity = len(self.__speed)
+        while capacity < needed:
+            capacity *= 2
+        for name in ("position", "target", "speed", "energy", "mobile", "foraging", "half",
+                     "kind", "waypoint", "route"):
+            attribute = "_HerdEngine__" + name
+            old = getattr(self, attribute)
+            new = np.full((capacity,) + old.shape[1:], -1 if name == "route" else 0,
+                          dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, attribute, new)
+
+    def __admit_pending(self):
+        needed = self.__count + len(self.__pending)
+        if needed > len(self.__speed):
+            self.__grow(needed)
+        for animal in self.__pending:
+            slot = self.__count
+            position = animal.get_position()
+            self.__position[slot] = (position.x, position.y)
+            self.__speed[slot] = animal.speed
+            self.__energy[slot] = animal.energy
+            self.__half[slot] = (animal.get_width() / 2, animal.get_height() / 2)
+            if type(animal) not in self.__types:
+                self.__types.append(type(animal))
+            self.__kind[slot] = self.__types.index(type(animal))
+            target = getattr(animal, "target", None)
+            self.__mobile[slot] = target != None
+            if target != None:
+                self.__target[slot] = (target.x, target.y)
+            route = getattr(animal, "_route", None)
+            if route != None:
+                self.__waypoint[slot] = (route.point.x, route.point.y)
+                if route.goal != None:
+                    self.__route[slot] = route.goal[1] * self.__cols + route.goal[0]
+                else:
+                    self.__route[slot] = -1
+            animal._herd_slot = slot
+            self.__animals.append(animal)
+            self.__count += 1
+        self.__pending.clear()
+
+    def update(self, seconds):
+        '''Moves and drains every animal in one vectorized pass.
+
+        Called automatically by the Game the engine was added to.
+        '''
+        self.admit()
+        n = self.__count
+        if n == 0:
+            return
+        energy = self.__energy[:n]
+        energy -= seconds
+
+        foraging = self.__foraging[:n]
+        moving = np.flatnonzero(self.__mobile[:n] & (energy >= HerdEngine.HUNGRY_ENERGY)
+                                | foraging)
+        if len(moving):
+            renderer = self.__game.get_window().get_renderer()
+            drawn = renderer != None
+            viewport = self.__game.get_viewport() if drawn else None
+            index = self.__game.get_spatial_index()
+            sizes = []
+            if index != None:
+                sizes.append(index.cell_size)
+            if viewport != None:
+                sizes.append(viewport.chunk_size)
+            position = self.__position[moving]
+            half = self.__half[moving]
+            cells = [np.floor((position + half) / size) for size in sizes]
+            target = self.__target[moving]
+            heading = target
+            walking = None
+            if self.__navigation != None:
+                walking = self.__walking(n)
+                walkers = moving[walking[moving]]
+                if len(walkers):
+                    heading = target.copy()
+                    heading[walking[moving]] = self.__waypoints(walkers)
+            delta = heading - position
+            distance = np.hypot(delta[:, 0], delta[:, 1])
+            step = self.__speed[moving] * seconds
+            factor = np.divide(step, distance, out=np.zeros_like(distance),
+                               where=distance > 0)
+            position += delta * factor[:, None]
+            self.__position[moving] = position
+
+            delta = target - position
+            arrived = moving[(np.einsum("ij,ij->i", delta, delta)
+                              < HerdEngine.ARRIVAL_DISTANCE ** 2) & ~foraging[moving]]
+            if len(arrived):
+                if walking is not None:
+                    self.__pick_targets(arrived[~walking[arrived]])
+                    self.__pick_passable_targets(arrived[walking[arrived]])
+                else:
+                    self.__pick_targets(arrived)
+
+            if drawn or sizes:
+                centre = self.__position[moving] + half
+                crossed = np.zeros(len(moving), dtype=bool)
+                for size, before in zip(sizes, cells):
+                    crossed |= (np.floor(centre / size) != before).any(axis=1)
+                self.__sync_sprites(moving[crossed])
+                if drawn:
+                    shown = ~crossed
+                    if viewport != None:
+                        first_col, first_row, last_col, last_row = viewport.get_bounds()
+                        chunk = np.floor(centre / viewport.chunk_size)
+                        shown &= ((chunk[:, 0] >= first_col) & (chunk[:, 0] <= last_col)
+                                  & (chunk[:, 1] >= first_row) & (chunk[:, 1] <= last_row))
+                    self.__move_items(renderer, moving[shown])
+
+        dead = np.flatnonzero(energy <= 0)
+        for slot in dead[::-1]:
+            animal = self.__animals[slot]
+            animal.energy = 0
+            animal.destroy()
+
+    def __pick_targets(self, slots):
+        self.__target[slots, 0] = self.__rng.integers(
+            0, self.__cols, len(slots)) * self.__tile_size
+        self.__target[slots, 1] = self.__rng.integers(
+            0, self.__rows, len(slots)) * self.__tile_size
+
+    def __pick_passable_targets(self, slots):
+        free = np.flatnonzero(~self.__blocked().ravel())
+        if not len(free):
+            self.__pick_targets(slots)
+            return
+        tiles = free[self.__rng.integers(0, len(free), len(slots))]
+        self.__target[slots, 0] = tiles % self.__cols * self.__tile_size
+        self.__target[slots, 1] = tiles // self.__cols * self.__tile_size
+
+    def __walking(self, n):
+        walking = np.zeros(n, dtype=bool)
+        for kind in self.__walkers:
+            walking |= self.mask_of(kind)
+        return walking
+
+    def __waypoints(self, slots):
+        navigation = self.__navigation
+        size = self.__tile_size
+        cols = self.__cols
+        rows = self.__rows
+        arrival = navigation.ARRIVAL
+        position = self.__position[slots]
+        target = self.__target[slots]
+        point = self.__waypoint[slots]
+        route = self.__route[slots]
+        heading = target.copy()
+
+        goal = np.floor((target + size / 2) / size).astype(np.int64)
+        inside = (goal[:, 0] >= 0) & (goal[:, 0] < cols) & (goal[:, 1] >= 0) & (goal[:, 1] < rows)
+        key = goal[:, 1] * cols + goal[:, 0]
+        keep = (inside & (route == key)
+                & (np.abs(point - position) > arrival).any(axis=1))
+        heading[keep] = point[keep]
+        route[~keep] = -1
+
+        here = np.floor((position + self.__half[slots]) / size).astype(np.int64)
+        corner = here * size
+        leaving = ~keep & inside & (here != goal).any(axis=1)
+        off = leaving & (np.abs(corner - position) > arrival).any(axis=1)
+        point[off] = corner[off]
+        route[off] = key[off]
+        heading[off] = corner[off]
+
+        stepping = np.flatnonzero(leaving & ~off & (here[:, 0] >= 0) & (here[:, 0] < cols)
+                                  & (here[:, 1] >= 0) & (here[:, 1] < rows))
+        width = cols + 2
+        for goal_key in np.unique(key[stepping]).tolist():
+            group = stepping[key[stepping] == goal_key]
+            row, col = divmod(goal_key, cols)
+            field = navigation.field((col, row))
+            following = np.frombuffer(field.steps(), dtype=np.intc)
+            step = following[(here[group, 1] + 1) * width + here[group, 0] + 1]
+            found = (step >= 0) & (step != (row + 1) * width + col + 1)
+            group = group[found]
+            step = step[found]
+            point[group, 0] = (step % width - 1) * size
+            point[group, 1] = (step // width - 1) * size
+            route[group] = goal_key
+            heading[group] = point[group]
+
+        self.__waypoint[slots] = point
+        self.__route[slots] = route
+        return heading
+
+    def __sync_sprites(self, slots):
+        animals = self.__animals
+        for slot, (x, y) in zip(slots.tolist(), self.__position[slots].tolist()):
+            animals[slot].move_to(x, y)
+
+    def __move_items(self, renderer, slots):
+        animals = self.__animals
+        for slot, (x, y) in zip(slots.tolist(), self.__position[slots].tolist()):
+            animal = animals[slot]
+            position = animal.get_position()
+            item = animal.get_id()
+            if item != None:
+                renderer.move(item, x - position.x, y - position.y)
+            position.set(x, y)
+
+    def sync(self):
+        '''Copies position, target, energy and waypoint back to every animal.'''
+        for slot, animal in enumerate(self.__animals):
+            animal.move_to(float(self.__position[slot, 0]), float(self.__position[slot, 1]))
+            animal.energy = float(self.__energy[slot])
+            if self.__mobile[slot]:
+                animal.target.x = float(self.__target[slot, 0])
+                animal.target.y = float(self.__target[slot, 1])
+            route = getattr(animal, "_route", None)
+            if route != None:
+                route.point.set(float(self.__waypoint[slot, 0]), float(self.__waypoint[slot, 1]))
+                goal = int(self.__route[slot])
+                route.goal = (goal % self.__cols, goal // self.__cols) if goal >= 0 else None
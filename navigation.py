@@ -0,0 +1,203 @@
+'''Finding paths around impassable tiles with shared flow fields.
+
+Searching a path for every animal would cost a search per animal each
+time it picks a target. A flow field instead stores, for every tile of
+the grid, the neighbouring tile to step to in order to reach one goal
+tile by the shortest path. It is computed once with a single Dijkstra
+search outwards from the goal, after which any number of animals heading
+for that goal look up their next step in O(1).
+
+FlowFields keeps the fields of the most recently used goals, and drops
+them all when the terrain changes. A Route walks one GameObject along a
+field from tile corner to tile corner, so that its bounds never sweep
+over a tile next to the path.
+'''
+import heapq
+import math
+from array import array
+from collections import OrderedDict
+from game import Vector2D
+
+
+
+CACHED_TILES = 1 << 22
+
+
+class FlowField:
+    '''FlowField holds the next step towards one goal tile from every tile.
+
+    Moves go to the eight neighbouring tiles, and a diagonal move is only
+    allowed if both tiles it passes between are passable, so paths never
+    cut corners.
+    '''
+
+    def __init__(self, cols, rows, goal, passable):
+        '''Computes the field for a grid of cols * rows tiles and the goal
+        (col, row). passable is a list with a bool for every tile of the
+        grid with a border of impassable tiles around it, row by row, as
+        made by FlowFields.'''
+        self.cols = cols
+        self.rows = rows
+        self.goal = goal
+        width = cols + 2
+        count = width * (rows + 2)
+        self.__width = width
+        self.__next = following = array("i", [-1]) * count
+        goal_index = (goal[1] + 1) * width + goal[0] + 1
+        if not passable[goal_index]:
+            return
+        diagonal = math.sqrt(2)
+        straight = ((1, 1.0), (-1, 1.0), (width, 1.0), (-width, 1.0))
+        corners = ((width + 1, 1, width, diagonal), (width - 1, -1, width, diagonal),
+                   (-width + 1, 1, -width, diagonal), (-width - 1, -1, -width, diagonal))
+        distance = [math.inf] * count
+        distance[goal_index] = 0.0
+        following[goal_index] = goal_index
+        heap = [(0.0, goal_index)]
+        while heap:
+            cost, index = heapq.heappop(heap)
+            if cost > distance[index]:
+                continue
+            for offset, step in straight:
+                neighbour = index + offset
+                if passable[neighbour] and cost + step < distance[neighbour]:
+                    distance[neighbour] = cost + step
+                    following[neighbour] = index
+                    heapq.heappush(heap, (cost + step, neighbour))
+            for offset, across, along, step in corners:
+                neighbour = index + offset
+                if (passable[neighbour] and passable[index + across] and passable[index + along]
+                        and cost + step < distance[neighbour]):
+                    distance[neighbour] = cost + step
+                    following[neighbour] = index
+                    heapq.heappush(heap, (cost + step, neighbour))
+
+    def step_from(self, col, row):
+        '''Returns the (col, row) to step to from the tile at col, row, the
+        goal itself once there, or None if the goal cannot be reached.'''
+        if not (0 <= col < self.cols and 0 <= row < self.rows):
+            return None
+        index = self.__next[(row + 1) * self.__width + col + 1]
+        if index < 0:
+            return None
+        row, col = divmod(index, self.__width)
+        return (col - 1, row - 1)
+
+    def steps(self):
+        '''Returns an array.array with the index of the tile to step to
+        from every tile, or -1 where the goal cannot be reached. Tiles are
+        indexed row by row on the grid with a border, so that the tile at
+        col, row has the index (row + 1) * (cols + 2) + col + 1.'''
+        return self.__next
+
+    def reachable(self, col, row):
+        '''Returns True if the goal can be reached from the tile at col, row.'''
+        return self.step_from(col, row) != None
+
+
+
+class Route:
+    '''Route remembers the tile corner a GameObject is walking to.
+
+    Give one Route per GameObject to FlowFields.waypoint.
+    '''
+
+    __slots__ = ("point", "goal")
+
+    def __init__(self):
+        '''Creates a Route that is not heading anywhere yet.'''
+        self.point = Vector2D(0, 0)
+        self.goal = None
+
+
+
+class FlowFields:
+    '''FlowFields computes and caches a FlowField per goal tile.
+
+    passable(col, row) says whether a tile may be walked on, and version()
+    returns a number that changes whenever a tile changes; the cached
+    fields are dropped when it does. Up to cache_size fields are kept,
+    least recently used first out; by default as many as fit in about
+    four million tiles.
+    '''
+
+    ARRIVAL = 1.0
+
+    def __init__(self, cols, rows, tile_size, passable, version, cache_size=None):
+        '''Creates an empty cache of fields for a grid of cols * rows tiles.'''
+        self.cols = cols
+        self.rows = rows
+        self.tile_size = tile_size
+        if cache_size == None:
+            cache_size = max(16, CACHED_TILES // ((cols + 2) * (rows + 2)))
+        self.cache_size = cache_size
+        self.fields_computed = 0
+        self.__passable = passable
+        self.__version = version
+        self.__seen = None
+        self.__grid = None
+        self.__fields = OrderedDict()
+
+    def cell_of(self, x, y):
+        '''Returns the (col, row) of the tile containing the point x, y.'''
+        return (int(x // self.tile_size), int(y // self.tile_size))
+
+    def field(self, goal):
+        '''Returns the FlowField towards the goal (col, row).'''
+        version = self.__version()
+        if version != self.__seen:
+            self.__seen = version
+            self.__grid = None
+            self.__fields.clear()
+        field = self.__fields.get(goal)
+        if field != None:
+            self.__fields.move_to_end(goal)
+            return field
+        if self.__grid == None:
+            border = [False] * (self.cols + 2)
+            grid = list(border)
+            for row in range(self.rows):
+                grid.append(False)
+                grid.extend(self.__passable(col, row) for col in range(self.cols))
+                grid.append(False)
+            grid.extend(border)
+            self.__grid = grid
+        field = FlowField(self.cols, self.rows, goal, self.__grid)
+        self.fields_computed += 1
+        self.__fields[goal] = field
+        if len(self.__fields) > self.cache_size:
+            self.__fields.popitem(last=False)
+        return field
+
+    def waypoint(self, obj, target, route):
+        '''Returns the point the GameObject obj should move towards on its
+        way to target, a Vector2D top-left position.
+
+        The point is the top-left corner of a tile on the path, kept in
+        route until obj reaches it: first the corner of the tile obj is
+        on, then the corners of the tiles the field steps through. Once
+        obj is on the target's tile, or if there is no path, the point is
+        target itself.'''
+        size = self.tile_size
+        goal = self.cell_of(target.x + size / 2, target.y + size / 2)
+        point = route.point
+        x = obj.get_x()
+        y = obj.get_y()
+        if route.goal == goal and (abs(point.x - x) > FlowFields.ARRIVAL
+                                   or abs(point.y - y) > FlowFields.ARRIVAL):
+            return point
+        route.goal = None
+        if not (0 <= goal[0] < self.cols and 0 <= goal[1] < self.rows):
+            return target
+        here = self.cell_of(x + obj.get_width() / 2, y + obj.get_height() / 2)
+        if here == goal:
+            return target
+        if abs(here[0] * size - x) > FlowFields.ARRIVAL or abs(here[1] * size - y) > FlowFields.ARRIVAL:
+            step = here
+        else:
+            step = self.field(goal).step_from(*here)
+            if step == None or step == goal:
+                return target
+        route.goal = goal
+        point.set(step[0] * size, step[1] * size)
+        return point
@@ -0,0 +1,276 @@
+'''Drawing a Game into a PIL image instead of a tkinter.Canvas.
+
+OffscreenRenderer accepts the same drawing commands as a RenderBuffer,
+so it can be given to a HeadlessWindow as its renderer. A headless
+GameObject draws itself with a PIL image from the ImageLibrary cache,
+and the OffscreenRenderer composites those images into a framebuffer.
+
+The world is divided into square cells. Every command marks the cells
+under the item's old and new bounds dirty, and render() only redraws
+the dirty cells, so a frame in which a few animals moved costs a few
+small pastes rather than a full redraw. FrameExporter is a late Game
+system that renders and saves a PNG every few steps, once they have
+ended.
+'''
+import os
+from PIL import Image as Img
+from PIL import ImageDraw
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+
+class OffscreenRenderer:
+    '''OffscreenRenderer composites items into a width * height RGBA image.
+
+    Items keep the canvas's stacking order: later items are drawn above
+    earlier ones, and tag_lower moves an item below all others. Only
+    images anchored at "nw" or "center" and filled or outlined rectangles
+    are supported. The part of the world shown starts at the position
+    given to scroll_to.
+    '''
+
+    def __init__(self, width, height, background=(211, 211, 211, 255), cell_size=128):
+        '''Creates an OffscreenRenderer with an empty framebuffer.'''
+        self.width = width
+        self.height = height
+        self.background = background
+        self.cell_size = cell_size
+        self.frame = Img.new("RGBA", (width, height), background)
+        self.queued = 0
+        self.redrawn_cells = 0
+        self.__items = {}
+        self.__cells = {}
+        self.__dirty = set()
+        self.__all_dirty = True
+        self.__next_id = 1
+        self.__top = 0
+        self.__bottom = 0
+        self.__x = 0
+        self.__y = 0
+        self.__rgba = {}
+
+    def create_rectangle(self, *coords, **options):
+        '''Adds a rectangle and returns its item id.'''
+        return self.__create("rectangle", list(coords), options)
+
+    def create_image(self, x, y, **options):
+        '''Adds an image and returns its item id.'''
+        return self.__create("image", [x, y], options)
+
+    def move(self, item, dx, dy):
+        '''Moves the item by dx, dy.'''
+        entry = self.__items[item]
+        coords = entry[1]
+        for i in range(0, len(coords), 2):
+            coords[i] += dx
+            coords[i + 1] += dy
+        self.__changed(item, entry)
+
+    def coords(self, item, *coords):
+        '''Gives the item new coordinates.'''
+        entry = self.__items[item]
+        entry[1] = list(coords)
+        self.__changed(item, entry)
+
+    def itemconfig(self, item, **options):
+        '''Changes the item's options.'''
+        entry = self.__items[item]
+        entry[2].update(options)
+        self.__changed(item, entry)
+
+    def tag_lower(self, item):
+        '''Moves the item below every other item.'''
+        entry = self.__items[item]
+        self.__bottom -= 1
+        entry[3] = self.__bottom
+        self.__changed(item, entry)
+
+    def delete(self, item):
+        '''Removes the item.'''
+        self.queued += 1
+        entry = self.__items.pop(item, None)
+        if entry != None:
+            self.__unplace(item, entry[4])
+
+    def scroll_to(self, x, y):
+        '''Shows the part of the world whose top-left corner is at x, y.'''
+        x = round(x)
+        y = round(y)
+        if (x, y) != (self.__x, self.__y):
+            self.__x = x
+            self.__y = y
+            self.__all_dirty = True
+
+    def item_count(self):
+        '''Returns the number of items.'''
+        return len(self.__items)
+
+    def __create(self, kind, coords, options):
+        self.queued += 1
+        item = self.__next_id
+        self.__next_id += 1
+        self.__top += 1
+        entry = [kind, coords, dict(options), self.__top, None]
+        self.__items[item] = entry
+        self.__place(item, entry)
+        return item
+
+    def __changed(self, item, entry):
+        self.queued += 1
+        self.__unplace(item, entry[4])
+        self.__place(item, entry)
+
+    def __bounds(self, entry):
+        kind, coords, options = entry[0], entry[1], entry[2]
+        if kind == "rectangle":
+            return (round(min(coords[0], coords[2])), round(min(coords[1], coords[3])),
+                    round(max(coords[0], coords[2])), round(max(coords[1], coords[3])))
+        image = options.get("image")
+        if image == None:
+            return None
+        width, height = image.size
+        x, y = coords[0], coords[1]
+        if options.get("anchor") == "center":
+            x -= width / 2
+            y -= height / 2
+        x = round(x)
+        y = round(y)
+        return (x, y, x + width, y + height)
+
+    def __cells_of(self, bounds):
+        size = self.cell_size
+        for row in range(int(bounds[1] // size), int((bounds[3] - 1) // size) + 1):
+            for col in range(int(bounds[0] // size), int((bounds[2] - 1) // size) + 1):
+                yield (col, row)
+
+    def __place(self, item, entry):
+        bounds = self.__bounds(entry)
+        entry[4] = bounds
+        if bounds == None:
+            return
+        for cell in self.__cells_of(bounds):
+            self.__cells.setdefault(cell, {})[item] = None
+            self.__dirty.add(cell)
+
+    def __unplace(self, item, bounds):
+        if bounds == None:
+            return
+        for cell in self.__cells_of(bounds):
+            items = self.__cells.get(cell)
+            if items != None:
+                items.pop(item, None)
+                if not items:
+                    del self.__cells[cell]
+            self.__dirty.add(cell)
+
+    def render(self):
+        '''Redraws the dirty parts of the framebuffer and returns it.'''
+        size = self.cell_size
+        if self.__all_dirty:
+            cells = set(self.__cells_of((self.__x, self.__y, self.__x + self.width,
+                                         self.__y + self.height)))
+            self.__all_dirty = False
+        else:
+            cells = self.__dirty
+        for col, row in cells:
+            left = max(col * size, self.__x)
+            top = max(row * size, self.__y)
+            right = min((col + 1) * size, self.__x + self.width)
+            bottom = min((row + 1) * size, self.__y + self.height)
+            if left < right and top < bottom:
+                self.__draw_region(self.__cells.get((col, row), {}), left, top, right, bottom)
+                self.redrawn_cells += 1
+        self.__dirty = set()
+        return self.frame
+
+    def __draw_region(self, items, left, top, right, bottom):
+        frame = self.frame
+        ox = self.__x
+        oy = self.__y
+        frame.paste(self.background, (int(left - ox), int(top - oy),
+                                      int(right - ox), int(bottom - oy)))
+        entries = sorted((self.__items[item] for item in items), key=lambda entry: entry[3])
+        for kind, coords, options, z, bounds in entries:
+            x0 = max(bounds[0], left)
+            y0 = max(bounds[1], top)
+            x1 = min(bounds[2], right)
+            y1 = min(bounds[3], bottom)
+            if x0 >= x1 or y0 >= y1:
+                continue
+            if kind == "image":
+                image = self.__as_rgba(options["image"])
+                frame.alpha_composite(image, (int(x0 - ox), int(y0 - oy)),
+                                      (int(x0 - bounds[0]), int(y0 - bounds[1]),
+                                       int(x1 - bounds[0]), int(y1 - bounds[1])))
+            else:
+                self.__draw_rectangle(options, bounds, x0, y0, x1, y1)
+
+    def __draw_rectangle(self, options, bounds, x0, y0, x1, y1):
+        ox = self.__x
+        oy = self.__y
+        region = (int(x0 - ox), int(y0 - oy), int(x1 - ox), int(y1 - oy))
+        fill = options.get("fill")
+        if fill:
+            self.frame.paste(Img.new("RGBA", (1, 1), fill).getpixel((0, 0)), region)
+        outline = options.get("outline", "black")
+        if outline:
+            clip = self.frame.crop(region)
+            draw = ImageDraw.Draw(clip)
+            draw.rectangle((bounds[0] - x0, bounds[1] - y0,
+                            bounds[2] - x0 - 1, bounds[3] - y0 - 1), outline=outline)
+            self.frame.paste(clip, region[:2])
+
+    def __as_rgba(self, image):
+        if image.mode == "RGBA":
+            return image
+        converted = self.__rgba.get(id(image))
+        if converted == None or converted[0] is not image:
+            converted = (image, image.convert("RGBA"))
+            self.__rgba[id(image)] = converted
+        return converted[1]
+
+    def to_array(self):
+        '''Renders and returns the framebuffer as a (height, width, 4) NumPy array.
+
+        Raises an ImportError if NumPy is not installed.'''
+        if np is None:
+            raise ImportError("to_array requires numpy")
+        return np.asarray(self.render())
+
+
+class FrameExporter:
+    '''FrameExporter saves a PNG of an OffscreenRenderer every few steps.
+
+    Add it with Game.add_system(exporter, late=True), so that every frame
+    shows the state at the end of its step. Frames are written to
+    directory as prefix000000.png, prefix000001.png and so on; they may
+    be turned into a video with a tool such as ffmpeg.
+    '''
+
+    def __init__(self, renderer, directory, every=1, prefix="frame", compress_level=1):
+        '''Creates a FrameExporter that saves a frame once every every steps.'''
+        self.renderer = renderer
+        self.directory = directory
+        self.every = every
+        self.prefix = prefix
+        self.compress_level = compress_level
+        self.frames = 0
+        self.__steps = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def update(self, seconds):
+        '''Counts a step and saves a frame when one is due.
+        Called by the Game once each step has ended.'''
+        if self.__steps % self.every == 0:
+            self.save()
+        self.__steps += 1
+
+    def save(self):
+        '''Renders and saves a frame now. Returns its path.'''
+        path = os.path.join(self.directory, f"{self.prefix}{self.frames:06d}.png")
+        self.renderer.render().save(path, compress_level=self.compress_level)
+        self.frames += 1
+        return path
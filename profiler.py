@@ -0,0 +1,165 @@
+'''Measuring where the time of each frame goes.
+
+A Profiler is attached to a Game with Game.enable_profiler. While it is
+attached, Game.step times every timer run, every system update and the
+update of every GameObject, grouped by class, and Game.run times the
+redraw of the Window and counts the canvas commands sent each frame.
+When no Profiler is attached, the Game runs its usual loops and pays for
+a single None check per step.
+'''
+import time
+from collections import deque
+
+
+
+class Profiler:
+    '''Profiler collects timings of a Game.
+
+    Update times and call counts are kept per name, where the name is
+    the class of the updated system or GameObject followed by ".update",
+    or "timers" for fired timers. The last frames frame times are kept
+    for a rolling histogram. If overlay is True, summary() is shown with
+    Window.set_text every overlay_interval seconds.
+    '''
+
+    HISTOGRAM_BINS = (0.004, 0.008, 1 / 60, 1 / 30, 1 / 15)
+
+    def __init__(self, frames=300, overlay=False, overlay_interval=0.5):
+        '''Creates an empty Profiler.'''
+        self.overlay = overlay
+        self.overlay_interval = overlay_interval
+        self.__frame_times = deque(maxlen=frames)
+        self.__canvas_ops = deque(maxlen=frames)
+        self.__updates = {}
+        self.__counts = {}
+        self.__frame_start = None
+        self.__render_start = None
+        self.__queued = None
+        self.__images = None
+        self.__last_overlay = 0.0
+        self.frames = 0
+        self.render_seconds = 0.0
+        self.image_seconds = 0.0
+
+    def reset(self):
+        '''Forgets everything measured so far.'''
+        self.__frame_times.clear()
+        self.__canvas_ops.clear()
+        self.__updates.clear()
+        self.__counts = {}
+        self.frames = 0
+        self.render_seconds = 0.0
+        self.image_seconds = 0.0
+
+    def add(self, name, seconds, calls=1):
+        '''Adds seconds spent in calls calls of name.'''
+        entry = self.__updates.get(name)
+        if entry == None:
+            entry = self.__updates[name] = [0, 0.0]
+        entry[0] += calls
+        entry[1] += seconds
+
+    def run_step(self, seconds, now, timers, systems, objects):
+        '''Runs the timers, systems and GameObjects of one Game.step,
+        timing each of them. objects yields (GameObject, seconds) pairs.
+        Called by Game.step.'''
+        clock = time.perf_counter
+        start = clock()
+        timers.run_due(now)
+        self.add("timers", clock() - start)
+        for system in systems:
+            start = clock()
+            system.update(seconds)
+            self.add(type(system).__name__ + ".update", clock() - start)
+        updates = self.__updates
+        for obj, elapsed in objects:
+            start = clock()
+            obj.update(elapsed)
+            elapsed = clock() - start
+            name = type(obj).__name__ + ".update"
+            entry = updates.get(name)
+            if entry == None:
+                entry = updates[name] = [0, 0.0]
+            entry[0] += 1
+            entry[1] += elapsed
+
+    def begin_frame(self):
+        '''Marks the start of a frame. Called by Game.run.'''
+        self.__frame_start = time.perf_counter()
+
+    def begin_render(self):
+        '''Marks the start of the Window redraw. Called by Game.run.'''
+        self.__render_start = time.perf_counter()
+
+    def end_frame(self, game):
+        '''Marks the end of a frame and updates the overlay. Called by Game.run.'''
+        from game import ImageLibrary
+        now = time.perf_counter()
+        if self.__frame_start == None:
+            return
+        self.frames += 1
+        self.__frame_times.append(now - self.__frame_start)
+        if self.__render_start != None:
+            self.render_seconds += now - self.__render_start
+        renderer = game.get_window().get_renderer()
+        queued = getattr(renderer, "queued", None)
+        if queued != None:
+            if self.__queued != None:
+                self.__canvas_ops.append(queued - self.__queued)
+            self.__queued = queued
+        image_seconds = ImageLibrary.image_seconds
+        if self.__images != None:
+            self.image_seconds += image_seconds - self.__images
+        self.__images = image_seconds
+        self.__counts = {kind.__name__: count
+                         for kind, count in game._gameObjects.counts_by_type().items()}
+        if self.overlay and now - self.__last_overlay >= self.overlay_interval:
+            self.__last_overlay = now
+            game.get_window().set_text(self.summary())
+
+    def get_updates(self):
+        '''Returns a list of (name, calls, seconds), slowest first.'''
+        return sorted(((name, calls, seconds)
+                       for name, (calls, seconds) in self.__updates.items()),
+                      key=lambda entry: entry[2], reverse=True)
+
+    def get_counts(self):
+        '''Returns the number of GameObjects of each class at the last frame.'''
+        return dict(self.__counts)
+
+    def get_frame_times(self):
+        '''Returns the recent frame times in seconds, oldest first.'''
+        return list(self.__frame_times)
+
+    def get_canvas_ops(self):
+        '''Returns the number of canvas commands queued in each recent frame.'''
+        return list(self.__canvas_ops)
+
+    def histogram(self, bins=None):
+        '''Returns a list of (upper bound, count) for the recent frame times.
+        The last upper bound is None and counts every slower frame.'''
+        if bins == None:
+            bins = Profiler.HISTOGRAM_BINS
+        counts = [0] * (len(bins) + 1)
+        for frame_time in self.__frame_times:
+            i = 0
+            while i < len(bins) and frame_time > bins[i]:
+                i += 1
+            counts[i] += 1
+        return list(zip(list(bins) + [None], counts))
+
+    def summary(self, top=3):
+        '''Returns a one-line description of the recent frames.'''
+        frame_times = self.__frame_times
+        if not frame_times:
+            return "no frames"
+        average = sum(frame_times) / len(frame_times)
+        text = [f"frame {average * 1000:.1f} ms (max {max(frame_times) * 1000:.1f})"]
+        if self.frames:
+            text.append(f"render {self.render_seconds / self.frames * 1000:.1f} ms")
+        if self.__canvas_ops:
+            text.append(f"{sum(self.__canvas_ops) / len(self.__canvas_ops):.0f} ops")
+        for name, calls, seconds in self.get_updates()[:top]:
+            text.append(f"{name} {seconds / max(self.frames, 1) * 1000:.2f} ms")
+        text.append(" ".join(f"{name} {count}" for name, count in sorted(self.__counts.items())))
+        return " | ".join(text)
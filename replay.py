@@ -0,0 +1,147 @@
+'''Recording a run of a Game and replaying it exactly.
+
+A run is fully determined by the seed of the Game's random.Random, the
+arguments the Game was created with, the seconds passed to every step
+and the key presses handled before each step. A Recorder logs these
+while a Game runs, and replay creates the Game again and feeds it the
+same steps and key presses, without waiting for real time. A digest of
+the final state is stored with the recording, so a replay can check
+that it ended in exactly the same state.
+'''
+import hashlib
+import json
+from collections import namedtuple
+
+
+
+InputEvent = namedtuple("InputEvent", ["keysym", "char"])
+InputEvent.__doc__ = '''A recorded key press, passed to Game.on_key during a replay.'''
+
+
+class Recording:
+    '''Recording holds the seed, creation arguments, steps and key presses of a run.
+
+    Steps are stored run-length encoded as [seconds, count] pairs, as a
+    fixed time step repeats the same seconds for every step. Key presses
+    are stored as [step, keysym, char], where step is the index of the
+    step they were handled in.
+    '''
+
+    def __init__(self, seed=None, params=None):
+        '''Creates an empty Recording of a Game created with seed and the
+        keyword arguments in params.'''
+        self.seed = seed
+        self.params = dict(params) if params != None else {}
+        self.steps = []
+        self.inputs = []
+        self.digest = None
+        self.__count = 0
+
+    def __len__(self):
+        return self.__count
+
+    def add_step(self, seconds, inputs=()):
+        '''Adds a step of the given seconds, and the key presses handled in it.'''
+        for event in inputs:
+            self.inputs.append([self.__count, event.keysym, getattr(event, "char", "")])
+        if self.steps and self.steps[-1][0] == seconds:
+            self.steps[-1][1] += 1
+        else:
+            self.steps.append([seconds, 1])
+        self.__count += 1
+
+    def each_step(self):
+        '''Yields (seconds, inputs) for every step in order, where inputs is
+        a list of InputEvents.'''
+        inputs = iter(self.inputs)
+        pending = next(inputs, None)
+        index = 0
+        for seconds, count in self.steps:
+            for i in range(count):
+                events = []
+                while pending != None and pending[0] == index:
+                    events.append(InputEvent(pending[1], pending[2]))
+                    pending = next(inputs, None)
+                yield seconds, events
+                index += 1
+
+    def save(self, path):
+        '''Writes the Recording to a JSON file.
+
+        Floats are written with repr, so they are read back exactly.'''
+        data = {"seed": self.seed, "params": self.params, "steps": self.steps,
+                "inputs": self.inputs, "digest": self.digest}
+        with open(path, "w") as file:
+            json.dump(data, file)
+
+    def load(path):
+        '''Reads a Recording written by save.'''
+        with open(path) as file:
+            data = json.load(file)
+        recording = Recording(data["seed"], data["params"])
+        recording.steps = data["steps"]
+        recording.inputs = data["inputs"]
+        recording.digest = data["digest"]
+        recording.__count = sum(count for seconds, count in recording.steps)
+        return recording
+
+
+class Recorder:
+    '''Recorder logs every step of a Game into a Recording.
+
+    The Game must have been created with the given seed and params, and
+    recording should start before its first step.
+    '''
+
+    def __init__(self, game, seed, params=None):
+        '''Starts recording the game.'''
+        self.__game = game
+        self.recording = Recording(seed, params)
+        game.set_recorder(self)
+
+    def record_step(self, seconds, inputs):
+        '''Called by the Game before every step.'''
+        self.recording.add_step(seconds, inputs)
+
+    def stop(self):
+        '''Stops recording, stores the digest of the Game's state and
+        returns the Recording.'''
+        self.__game.set_recorder(None)
+        self.recording.digest = digest(self.__game)
+        return self.recording
+
+
+def digest(game):
+    '''Returns a hex digest of the state of the game: the simulated time,
+    the state of its random.Random, the result of count_population if the
+    game has one, and the type, position and energy of every drawn
+    GameObject that is not static. Static objects, which may only exist
+    when the game is drawn, are left out so that a headless replay of a
+    run with a window gives the same digest.'''
+    state = hashlib.sha256(repr((game.get_time(), game.get_random().getstate())).encode())
+    count_population = getattr(game, "count_population", None)
+    if count_population != None:
+        state.update(repr(sorted(count_population().items())).encode())
+    for obj in game.get_drawables():
+        if not obj.static:
+            energy = getattr(obj, "energy", None)
+            state.update(repr((type(obj).__name__, float(obj.get_x()), float(obj.get_y()),
+                               None if energy == None else float(energy))).encode())
+    return state.hexdigest()
+
+
+def replay(recording, factory):
+    '''Creates a Game with factory(seed=recording.seed, **recording.params)
+    and runs the recorded steps and key presses on it as fast as possible.
+
+    Returns the Game. Raises a ValueError if the Recording has a digest
+    and the Game does not end in the same state.
+    '''
+    game = factory(seed=recording.seed, **recording.params)
+    for seconds, inputs in recording.each_step():
+        for event in inputs:
+            game.queue_input(event)
+        game.step(seconds)
+    if recording.digest != None and digest(game) != recording.digest:
+        raise ValueError("replay did not reproduce the recorded run")
+    return game
@@ -0,0 +1,267 @@
+'''Running a Game on a worker thread and drawing it from snapshots.
+
+Game.run steps the simulation and redraws the Window on the same thread,
+so a slow redraw slows the simulation and a slow step freezes the
+Window. A SimulationThread instead steps a headless Game on its own
+thread and publishes an immutable Snapshot after every step. The Tk main
+loop only ever draws the latest Snapshot with a SnapshotView, so the
+simulation rate and the render rate are independent of each other.
+'''
+import threading
+import time
+import tkinter as tk
+from collections import namedtuple
+from types import MappingProxyType
+from game import Game, ImageLibrary, Window, FixedStepScheduler, DEFAULT
+from terrain import TerrainLayer
+
+
+
+class Snapshot(namedtuple("Snapshot", ["tick", "time", "keys", "positions", "sprites",
+                                       "terrain", "spawned", "died"])):
+    '''Snapshot is the drawable state of a Game after a step.
+
+    keys holds a key for every drawn GameObject, and positions holds
+    their x and y one after the other. sprites maps each key to the
+    (image name, width, height) of its sprite. spawned and died hold the
+    keys added and removed since the previous Snapshot. terrain is None,
+    or (cols, rows, tile_size, names) for a Game with a TerrainLayer.
+
+    All fields are tuples or read-only mappings. sprites and terrain are
+    shared with the previous Snapshot while they do not change.
+    '''
+    __slots__ = ()
+
+
+class SnapshotWriter:
+    '''SnapshotWriter builds the Snapshots of a Game.
+
+    Objects are keyed by id. The writer keeps the objects of the previous
+    Snapshot alive, so a key is never reused by a new object in the
+    following Snapshot.
+    '''
+
+    def __init__(self, game):
+        '''Creates a SnapshotWriter for the game.'''
+        self.__game = game
+        self.__objects = {}
+        self.__sprites = MappingProxyType({})
+        self.__terrain = None
+        self.__terrain_version = None
+
+    def capture(self, tick):
+        '''Returns a Snapshot of the game after the given tick.'''
+        objects = {}
+        keys = []
+        positions = []
+        changed = False
+        sprites = self.__sprites
+        for obj in self.__game.get_drawables():
+            key = id(obj)
+            name = ImageLibrary.name_of(obj.get_image())
+            if name == None:
+                continue
+            objects[key] = obj
+            keys.append(key)
+            positions.append(obj.get_x())
+            positions.append(obj.get_y())
+            if sprites.get(key) != (name, obj.get_width(), obj.get_height()):
+                changed = True
+        previous = self.__objects
+        spawned = tuple(key for key in keys if key not in previous)
+        died = tuple(key for key in previous if key not in objects)
+        if changed or died:
+            sprites = MappingProxyType({key: (ImageLibrary.name_of(obj.get_image()),
+                                              obj.get_width(), obj.get_height())
+                                        for key, obj in objects.items()})
+            self.__sprites = sprites
+        self.__objects = objects
+        return Snapshot(tick, self.__game.get_time(), tuple(keys), tuple(positions),
+                        sprites, self.__capture_terrain(), spawned, died)
+
+    def __capture_terrain(self):
+        terrain = getattr(self.__game, "terrain", None)
+        if terrain == None:
+            return None
+        if terrain.version != self.__terrain_version:
+            names = tuple(terrain.get_tile(col, row)
+                          for row in range(terrain.rows) for col in range(terrain.cols))
+            self.__terrain = (terrain.cols, terrain.rows, terrain.tile_size, names)
+            self.__terrain_version = terrain.version
+        return self.__terrain
+
+
+class SimulationThread(threading.Thread):
+    '''SimulationThread steps a headless Game on a worker thread.
+
+    After every step a Snapshot is published, which the main thread reads
+    with latest(). If realtime is True, the thread runs one step every
+    time_step real seconds; otherwise it steps as fast as it can. The
+    thread stops after the given number of ticks or simulated seconds,
+    or when stop is called. The Game must not be touched by other threads
+    while the SimulationThread is running.
+    '''
+
+    def __init__(self, game, time_step=None, realtime=True, ticks=None, seconds=None):
+        '''Creates a SimulationThread for the game. Call start() to run it.'''
+        super().__init__(name="simulation", daemon=True)
+        if time_step == None:
+            time_step = Game.TIME_STEP
+        self.time_step = time_step
+        self.realtime = realtime
+        self.ticks = ticks
+        self.seconds = seconds
+        self.error = None
+        self.__game = game
+        self.__writer = SnapshotWriter(game)
+        self.__latest = self.__writer.capture(0)
+        self.__lock = threading.Lock()
+        self.__stopped = threading.Event()
+
+    def latest(self) -> Snapshot:
+        '''Returns the most recently published Snapshot.'''
+        with self.__lock:
+            return self.__latest
+
+    def stop(self):
+        '''Asks the thread to stop after the current step.'''
+        self.__stopped.set()
+
+    def run(self):
+        '''Steps the Game and publishes a Snapshot after every step.
+        Called by start(); should not be called directly.'''
+        tick = 0
+        start = time.perf_counter()
+        try:
+            while not self.__stopped.is_set():
+                if self.ticks != None and tick >= self.ticks:
+                    break
+                if self.seconds != None and tick * self.time_step >= self.seconds:
+                    break
+                self.__game.step(self.time_step)
+                tick += 1
+                snapshot = self.__writer.capture(tick)
+                with self.__lock:
+                    self.__latest = snapshot
+                if self.realtime:
+                    delay = start + tick * self.time_step - time.perf_counter()
+                    if delay > 0:
+                        self.__stopped.wait(delay)
+        except Exception as error:
+            self.error = error
+        finally:
+            self.__stopped.set()
+
+    def is_finished(self):
+        '''Returns True once the thread has stopped stepping the Game.'''
+        return self.__stopped.is_set() and not self.is_alive()
+
+
+class SnapshotView:
+    '''SnapshotView draws Snapshots into a Window.
+
+    Every sprite is one canvas item, which is created, moved or deleted
+    to match the Snapshot. Terrain is drawn with a TerrainLayer. Drawing
+    is done through the Window's renderer, so must happen on the thread
+    that owns the Window.
+    '''
+
+    def __init__(self, window):
+        '''Creates a SnapshotView that draws into the window.'''
+        self.__window = window
+        self.__items = {}
+        self.__drawn = None
+        self.__terrain = None
+        self.__terrain_names = None
+
+    def get_window(self):
+        '''Returns the Window drawn into.'''
+        return self.__window
+
+    def item_count(self):
+        '''Returns how many sprites currently have a canvas item.'''
+        return len(self.__items)
+
+    def draw(self, snapshot):
+        '''Changes the canvas items to match the snapshot.
+
+        Drawing the same Snapshot twice does nothing. Snapshots may be
+        skipped; the items are compared with the whole Snapshot rather
+        than with its spawned and died keys.'''
+        if snapshot is self.__drawn:
+            return
+        renderer = self.__window.get_renderer()
+        if renderer == None:
+            return
+        if snapshot.terrain != None:
+            self.__draw_terrain(snapshot.terrain)
+        photo = not self.__window.headless
+        items = self.__items
+        sprites = snapshot.sprites
+        if self.__drawn == None or sprites is not self.__drawn.sprites:
+            for key in [key for key in items if sprites.get(key) != items[key][1]]:
+                self.__delete(key, renderer, photo)
+        positions = snapshot.positions
+        for i, key in enumerate(snapshot.keys):
+            x = positions[2 * i]
+            y = positions[2 * i + 1]
+            entry = items.get(key)
+            if entry == None:
+                name, width, height = sprites[key]
+                image = ImageLibrary.acquire(name, int(width), int(height), photo)
+                item = renderer.create_image(x, y, anchor=tk.NW, image=image)
+                items[key] = [item, sprites[key], x, y, image]
+            elif entry[2] != x or entry[3] != y:
+                renderer.coords(entry[0], x, y)
+                entry[2] = x
+                entry[3] = y
+        self.__drawn = snapshot
+
+    def __delete(self, key, renderer, photo):
+        item, (name, width, height), x, y, image = self.__items.pop(key)
+        renderer.delete(item)
+        ImageLibrary.release(name, int(width), int(height), photo)
+
+    def __draw_terrain(self, terrain):
+        cols, rows, tile_size, names = terrain
+        if names is self.__terrain_names:
+            return
+        if self.__terrain == None:
+            self.__terrain = TerrainLayer(self, cols, rows, tile_size)
+            previous = (None,) * len(names)
+        else:
+            previous = self.__terrain_names
+        for index, name in enumerate(names):
+            if name != previous[index]:
+                self.__terrain.set_tile(index % cols, index // cols, name)
+        self.__terrain_names = names
+        self.__terrain.flush()
+
+
+def run_threaded(game, ticks=None, seconds=None, time_step=None, max_fps=DEFAULT,
+                 width=1152, height=984):
+    '''Runs a headless game on a SimulationThread and draws it in a new Window.
+
+    The Window is redrawn at most max_fps times per second with the latest
+    Snapshot, however fast or slow the simulation steps; by default
+    Game.MAX_FPS, or as often as possible if max_fps is None. Returns when the
+    Window is closed or the simulation stops. Exceptions raised by the
+    simulation are raised again here.
+    '''
+    if max_fps is DEFAULT:
+        max_fps = Game.MAX_FPS
+    window = Window(width=width, height=height)
+    view = SnapshotView(window)
+    simulation = SimulationThread(game, time_step, ticks=ticks, seconds=seconds)
+    scheduler = FixedStepScheduler(max_fps=max_fps)
+    simulation.start()
+    try:
+        while window.is_open() and not simulation.is_finished():
+            view.draw(simulation.latest())
+            window.update()
+            scheduler.wait_for_frame()
+    finally:
+        simulation.stop()
+        simulation.join()
+    if simulation.error != None:
+        raise simulation.error
@@ -0,0 +1,173 @@
+'''A uniform grid index for finding GameObjects by position.
+
+SpatialHash divides the world into square cells, by default the size of
+one 96 pixel tile, and remembers which objects have their centre in which
+cell. This turns "what is on this tile" into a dictionary lookup, and
+radius or nearest neighbour queries into a search of nearby cells only.
+'''
+import heapq
+import math
+
+
+
+class SpatialHash:
+    '''SpatialHash maps cells of a uniform grid to the objects inside them.
+
+    Objects must provide get_x, get_y, get_width and get_height, as
+    Rectangle does. An object belongs to the cell containing its centre.
+    Call update() after an object has moved; GameObject does this
+    automatically when its Game has a SpatialHash.
+    '''
+
+    def __init__(self, cell_size=96):
+        '''Creates an empty SpatialHash with square cells of cell_size pixels.'''
+        self.cell_size = cell_size
+        self.__cells = {}
+        self.__where = {}
+        self.__bounds = None
+
+    def __len__(self):
+        return len(self.__where)
+
+    def __contains__(self, obj):
+        return obj in self.__where
+
+    def cell_of(self, x, y):
+        '''Returns the (column, row) of the cell containing the point x, y.'''
+        return (int(x // self.cell_size), int(y // self.cell_size))
+
+    def __add(self, obj, key):
+        self.__where[obj] = key
+        self.__cells.setdefault(key, {})[obj] = None
+        if self.__bounds == None:
+            self.__bounds = [key[0], key[1], key[0], key[1]]
+        else:
+            bounds = self.__bounds
+            bounds[0] = min(bounds[0], key[0])
+            bounds[1] = min(bounds[1], key[1])
+            bounds[2] = max(bounds[2], key[0])
+            bounds[3] = max(bounds[3], key[1])
+
+    def __key(self, obj):
+        return self.cell_of(obj.get_x() + obj.get_width() / 2,
+                            obj.get_y() + obj.get_height() / 2)
+
+    def insert(self, obj):
+        '''Adds the object to the cell containing its centre.'''
+        if obj in self.__where:
+            self.update(obj)
+            return
+        self.__add(obj, self.__key(obj))
+
+    def remove(self, obj):
+        '''Removes the object from the index. Does nothing if it is not indexed.'''
+        key = self.__where.pop(obj, None)
+        if key == None:
+            return
+        cell = self.__cells[key]
+        del cell[obj]
+        if not cell:
+            del self.__cells[key]
+
+    def update(self, obj):
+        '''Moves the object to another cell if its centre has left its cell.'''
+        old = self.__where.get(obj)
+        if old == None:
+            return
+        key = self.__key(obj)
+        if key == old:
+            return
+        cell = self.__cells[old]
+        del cell[obj]
+        if not cell:
+            del self.__cells[old]
+        self.__add(obj, key)
+
+    def at(self, col, row, kind=None):
+        '''Returns a list of the objects in the cell at col, row.
+
+        If kind is given, only instances of that class are returned.
+        '''
+        cell = self.__cells.get((col, row))
+        if cell == None:
+            return []
+        if kind == None:
+            return list(cell)
+        return [obj for obj in cell if isinstance(obj, kind)]
+
+    def query_radius(self, x, y, radius, kind=None):
+        '''Returns a list of the objects whose centre is within radius of x, y.
+
+        If kind is given, only instances of that class are returned.
+        '''
+        first_col, first_row = self.cell_of(x - radius, y - radius)
+        last_col, last_row = self.cell_of(x + radius, y + radius)
+        limit = radius * radius
+        found = []
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                cell = self.__cells.get((col, row))
+                if cell == None:
+                    continue
+                for obj in cell:
+                    if kind != None and not isinstance(obj, kind):
+                        continue
+                    dx = obj.get_x() + obj.get_width() / 2 - x
+                    dy = obj.get_y() + obj.get_height() / 2 - y
+                    if dx * dx + dy * dy <= limit:
+                        found.append(obj)
+        return found
+
+    def nearest(self, x, y, k=1, kind=None, max_radius=None, exclude=None):
+        '''Returns a list of up to k objects whose centres are closest to x, y.
+
+        The list is sorted from nearest to furthest. Cells are searched in
+        rings around x, y, and the search stops as soon as no unsearched
+        ring can hold a closer object. If kind is given, only instances of
+        that class are returned. The object exclude is never returned.
+        '''
+        if not self.__where:
+            return []
+        centre_col, centre_row = self.cell_of(x, y)
+        min_col, min_row, max_col, max_row = self.__bounds
+        max_ring = max(abs(centre_col - min_col), abs(centre_col - max_col),
+                       abs(centre_row - min_row), abs(centre_row - max_row))
+        if max_radius != None:
+            max_ring = min(max_ring, int(math.ceil(max_radius / self.cell_size)))
+        best = []
+        counter = 0
+        for ring in range(max_ring + 1):
+            if len(best) == k:
+                reach = (ring - 1) * self.cell_size
+                if reach > 0 and reach * reach > -best[0][0]:
+                    break
+            for col, row in self.__ring(centre_col, centre_row, ring):
+                cell = self.__cells.get((col, row))
+                if cell == None:
+                    continue
+                for obj in cell:
+                    if obj is exclude or (kind != None and not isinstance(obj, kind)):
+                        continue
+                    dx = obj.get_x() + obj.get_width() / 2 - x
+                    dy = obj.get_y() + obj.get_height() / 2 - y
+                    distance = dx * dx + dy * dy
+                    if max_radius != None and distance > max_radius * max_radius:
+                        continue
+                    counter += 1
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, counter, obj))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, counter, obj))
+        best.sort(key=lambda entry: (-entry[0], entry[1]))
+        return [entry[2] for entry in best]
+
+    def __ring(self, col, row, ring):
+        if ring == 0:
+            yield (col, row)
+            return
+        for c in range(col - ring, col + ring + 1):
+            yield (c, row - ring)
+            yield (c, row + ring)
+        for r in range(row - ring + 1, row + ring):
+            yield (col - ring, r)
+            yield (col + ring, r)
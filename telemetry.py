@@ -0,0 +1,202 @@
+'''Streaming time series of a running Game to disk.
+
+A TelemetryWriter is a Game system. Every interval simulated seconds it
+takes a sample, a dictionary of numbers such as the population counts
+returned by EcoSim.telemetry_sample, and appends it to a buffer. Full
+buffers are handed to a background thread, which appends them to a CSV
+file or a columnar binary file. The simulation never waits for the disk:
+at most max_pending buffers wait to be written, and if the disk falls
+further behind the oldest waiting buffer is dropped and counted.
+
+The columnar format is a sequence of blocks after a header line:
+
+    header  b"ECOCOL1\\n", then the column names as a JSON list and b"\\n"
+    block   uint32 row count, then one float64 array per column, in the
+            order of the header, all little-endian
+
+Blocks are only ever appended, so a file that is still being written
+can be read up to its last complete block with read_columnar.
+'''
+import csv
+import json
+import queue
+import struct
+import sys
+import threading
+from array import array
+
+
+
+COLUMNAR_MAGIC = b"ECOCOL1\n"
+BLOCK_HEADER = struct.Struct("<I")
+
+
+class CsvSink:
+    '''Appends rows to a CSV file, with the column names as the first row.'''
+
+    def __init__(self, path, columns):
+        '''Creates the file and writes the column names.'''
+        self.__file = open(path, "w", newline="")
+        self.__writer = csv.writer(self.__file)
+        self.__writer.writerow(columns)
+
+    def write(self, rows):
+        '''Appends rows, each a list of values in column order.'''
+        self.__writer.writerows(rows)
+        self.__file.flush()
+
+    def close(self):
+        '''Closes the file.'''
+        self.__file.close()
+
+
+class ColumnarSink:
+    '''Appends rows to a columnar binary file, one block per call to write.'''
+
+    def __init__(self, path, columns):
+        '''Creates the file and writes its header.'''
+        self.__file = open(path, "wb")
+        self.__columns = len(columns)
+        self.__file.write(COLUMNAR_MAGIC + json.dumps(list(columns)).encode("utf-8") + b"\n")
+
+    def write(self, rows):
+        '''Appends rows, each a list of numbers in column order, as one block.'''
+        self.__file.write(BLOCK_HEADER.pack(len(rows)))
+        for column in range(self.__columns):
+            values = array("d", (row[column] for row in rows))
+            if sys.byteorder != "little":
+                values.byteswap()
+            self.__file.write(values.tobytes())
+        self.__file.flush()
+
+    def close(self):
+        '''Closes the file.'''
+        self.__file.close()
+
+
+def read_columnar(path):
+    '''Returns a dictionary of column name to a list of floats, read from a
+    file written by a ColumnarSink. An incomplete last block is ignored.'''
+    with open(path, "rb") as file:
+        if file.readline() != COLUMNAR_MAGIC:
+            raise ValueError(f"{path} is not a columnar telemetry file")
+        columns = json.loads(file.readline())
+        data = {column: [] for column in columns}
+        while True:
+            header = file.read(BLOCK_HEADER.size)
+            if len(header) < BLOCK_HEADER.size:
+                break
+            rows = BLOCK_HEADER.unpack(header)[0]
+            block = file.read(8 * rows * len(columns))
+            if len(block) < 8 * rows * len(columns):
+                break
+            values = array("d", block)
+            if sys.byteorder != "little":
+                values.byteswap()
+            for i, column in enumerate(columns):
+                data[column].extend(values[i * rows:(i + 1) * rows])
+    return data
+
+
+class TelemetryWriter:
+    '''TelemetryWriter samples a Game and streams the samples to disk.
+
+    sample is called without arguments and returns a dictionary of
+    column name to number; the columns are fixed by the first sample.
+    A sample is taken every interval simulated seconds, or every step if
+    interval is 0. format is "csv" or "columnar". Add the writer with
+    Game.add_system, and call close when the run is over.
+    '''
+
+    def __init__(self, path, sample, interval=1.0, format="csv", buffer_rows=256,
+                 max_pending=8):
+        '''Creates a TelemetryWriter that writes to path.
+
+        Rows are handed to the background thread buffer_rows at a time.'''
+        if format not in ("csv", "columnar"):
+            raise ValueError(f"unknown telemetry format {format}")
+        self.path = path
+        self.format = format
+        self.interval = interval
+        self.buffer_rows = buffer_rows
+        self.rows = 0
+        self.dropped = 0
+        self.error = None
+        self.__sample = sample
+        self.__columns = None
+        self.__buffer = []
+        self.__elapsed = 0.0
+        self.__pending = queue.Queue(max_pending)
+        self.__thread = None
+
+    def get_columns(self):
+        '''Returns the column names, or None before the first sample.'''
+        return self.__columns
+
+    def update(self, seconds):
+        '''Takes a sample once every interval simulated seconds.
+        Called by the Game once per step.'''
+        self.__elapsed += seconds
+        if self.__elapsed + 1e-9 < self.interval:
+            return
+        self.__elapsed -= self.interval
+        self.record()
+
+    def record(self):
+        '''Takes a sample now.'''
+        sample = self.__sample()
+        if self.__columns == None:
+            self.__columns = list(sample)
+            self.__thread = threading.Thread(target=self.__write_loop, name="telemetry",
+                                             daemon=True)
+            self.__thread.start()
+        self.__buffer.append([sample[column] for column in self.__columns])
+        self.rows += 1
+        if len(self.__buffer) >= self.buffer_rows:
+            self.flush()
+
+    def flush(self):
+        '''Hands the buffered rows to the background thread without waiting.'''
+        if not self.__buffer:
+            return
+        rows = self.__buffer
+        self.__buffer = []
+        while True:
+            try:
+                self.__pending.put_nowait(rows)
+                return
+            except queue.Full:
+                try:
+                    self.dropped += len(self.__pending.get_nowait())
+                except queue.Empty:
+                    pass
+
+    def close(self):
+        '''Writes every remaining row and waits for the file to be closed.'''
+        if self.__thread == None:
+            return
+        self.flush()
+        self.__pending.put(None)
+        self.__thread.join()
+        self.__thread = None
+        if self.error != None:
+            raise self.error
+
+    def __write_loop(self):
+        sink_type = CsvSink if self.format == "csv" else ColumnarSink
+        try:
+            sink = sink_type(self.path, self.__columns)
+        except OSError as error:
+            self.error = error
+            sink = None
+        while True:
+            rows = self.__pending.get()
+            if rows == None:
+                break
+            if sink != None:
+                try:
+                    sink.write(rows)
+                except OSError as error:
+                    self.error = error
+        if sink != None:
+            sink.close()
@@ -0,0 +1,152 @@
+'''A layer that draws a grid of static tiles as a few large images.
+
+Drawing every tile as its own canvas item is slow once maps grow. The
+TerrainLayer instead pastes the tiles of each chunk of the grid into one
+PIL image, so the canvas only holds one item per chunk. When a tile
+changes, only the chunk containing it is baked again.
+'''
+import tkinter as tk
+from PIL import ImageTk
+from PIL import Image as Img
+from game import ImageLibrary
+
+
+
+class TerrainLayer:
+    '''TerrainLayer holds the name of the image shown on each tile.
+
+    Tiles are grouped into square chunks of chunk_size * chunk_size tiles.
+    Changing a tile marks its chunk dirty; dirty chunks are baked again on
+    the next update, which the Game calls once per step when the layer is
+    added with Game.add_system. Chunk images are placed below every other
+    item on the canvas. Nothing is baked if the Game's window has no
+    renderer. If a Viewport calls set_view, only the chunks it shows are
+    baked and hold a canvas item.
+    '''
+
+    def __init__(self, game, cols, rows, tile_size=96, chunk_size=8):
+        '''Creates an empty TerrainLayer of cols * rows tiles.'''
+        self.__game = game
+        self.cols = cols
+        self.rows = rows
+        self.tile_size = tile_size
+        self.chunk_size = chunk_size
+        self.version = 0
+        self.__names = [None] * (cols * rows)
+        self.__dirty = set()
+        self.__items = {}
+        self.__images = {}
+        self.__view = None
+
+    def get_tile(self, col, row):
+        '''Returns the image name of the tile at col, row, or None.'''
+        if 0 <= col < self.cols and 0 <= row < self.rows:
+            return self.__names[row * self.cols + col]
+        return None
+
+    def set_tile(self, col, row, name):
+        '''Changes the image name of the tile at col, row.
+
+        A name of None leaves the tile empty.
+        '''
+        index = row * self.cols + col
+        if self.__names[index] == name:
+            return
+        self.__names[index] = name
+        self.version += 1
+        self.__dirty.add((col // self.chunk_size, row // self.chunk_size))
+
+    def get_tiles(self):
+        '''Returns a list of the image names of every tile, row by row.'''
+        return list(self.__names)
+
+    def set_tiles(self, names):
+        '''Replaces the image names of every tile with a list given row by
+        row, and marks every chunk dirty.'''
+        if len(names) != self.cols * self.rows:
+            raise ValueError(f"expected {self.cols * self.rows} tile names, got {len(names)}")
+        self.__names = list(names)
+        self.version += 1
+        size = self.chunk_size
+        self.__dirty.update((col, row) for row in range((self.rows + size - 1) // size)
+                            for col in range((self.cols + size - 1) // size))
+
+    def set_view(self, first_col, first_row, end_col, end_row):
+        '''Limits drawing to the chunks holding the given tiles, where end
+        is exclusive. Chunks leaving the view lose their canvas item, and
+        chunks entering it are baked on the next update.'''
+        size = self.chunk_size
+        view = (first_col // size, first_row // size,
+                (end_col - 1) // size, (end_row - 1) // size)
+        self.__view = view
+        renderer = self.__game.get_window().get_renderer()
+        for chunk in list(self.__items):
+            if not self.__in_view(chunk):
+                item = self.__items.pop(chunk)
+                del self.__images[chunk]
+                if renderer != None:
+                    renderer.delete(item)
+        for row in range(view[1], min(view[3] + 1, (self.rows + size - 1) // size)):
+            for col in range(view[0], min(view[2] + 1, (self.cols + size - 1) // size)):
+                if (col, row) not in self.__items:
+                    self.__dirty.add((col, row))
+
+    def __in_view(self, chunk):
+        view = self.__view
+        return view == None or (view[0] <= chunk[0] <= view[2]
+                                and view[1] <= chunk[1] <= view[3])
+
+    def chunk_count(self):
+        '''Returns how many chunks currently have a canvas item.'''
+        return len(self.__items)
+
+    def update(self, seconds):
+        '''Bakes every dirty chunk again.'''
+        if self.__dirty:
+            self.flush()
+
+    def flush(self):
+        '''Bakes every dirty chunk and updates its canvas item.'''
+        window = self.__game.get_window()
+        renderer = window.get_renderer()
+        if renderer == None:
+            self.__dirty.clear()
+            return
+        for chunk in sorted(self.__dirty):
+            if self.__in_view(chunk):
+                self.__bake(chunk, renderer, window.headless)
+        self.__dirty.clear()
+
+    def bake_chunk(self, chunk_col, chunk_row):
+        '''Returns a PIL image of the tiles in the given chunk.'''
+        size = self.tile_size
+        first_col = chunk_col * self.chunk_size
+        first_row = chunk_row * self.chunk_size
+        cols = min(self.chunk_size, self.cols - first_col)
+        rows = min(self.chunk_size, self.rows - first_row)
+        image = Img.new("RGBA", (cols * size, rows * size), (0, 0, 0, 0))
+        for row in range(rows):
+            for col in range(cols):
+                name = self.__names[(first_row + row) * self.cols + first_col + col]
+                if name == None:
+                    continue
+                tile = ImageLibrary.acquire(name, size, size, False)
+                image.paste(tile, (col * size, row * size),
+                            tile if tile.mode == "RGBA" else None)
+                ImageLibrary.release(name, size, size, False)
+        return image
+
+    def __bake(self, chunk, renderer, headless):
+        image = self.bake_chunk(*chunk)
+        if not headless:
+            image = ImageTk.PhotoImage(image)
+        self.__images[chunk] = image
+        item = self.__items.get(chunk)
+        if item == None:
+            size = self.tile_size * self.chunk_size
+            item = renderer.create_image(chunk[0] * size, chunk[1] * size,
+                                         anchor=tk.NW, image=image)
+            renderer.tag_lower(item)
+            self.__items[chunk] = item
+        else:
+            renderer.itemconfig(item, image=image)
@@ -0,0 +1,19 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pytest
+from game import ImageLibrary
+
+
+@pytest.fixture(autouse=True, scope="session")
+def images():
+    '''Loads the images the game objects are drawn with, from the repository.'''
+    cwd = os.getcwd()
+    os.chdir(ROOT)
+    try:
+        ImageLibrary.load("images", verbose=False)
+    finally:
+        os.chdir(cwd)
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+import checkpoint
+import replay
+from ecosim import EcoSim
+from forage import FoodGrid
+
+
+STEP = 1 / 60
+
+
+@pytest.mark.parametrize("seed, water_chance", [(3, 0.1), (5, 0.15)])
+def test_resumed_run_matches_continuous_run(tmp_path, seed, water_chance):
+    game = EcoSim(headless=True, tile_objects=False, water_chance=water_chance, seed=seed)
+    for _ in range(900):
+        game.step(STEP)
+    path = str(tmp_path / "run.ckpt")
+    checkpoint.save(game, path)
+    resumed = checkpoint.load(path, headless=True)
+    for step in range(900):
+        game.step(STEP)
+        resumed.step(STEP)
+        if step % 100 == 99:
+            assert replay.digest(resumed) == replay.digest(game), step
+    assert replay.digest(resumed) == replay.digest(game)
+
+
+def test_resumed_herd_run_matches_continuous_run(tmp_path):
+    game = EcoSim(headless=True, herd=True, tile_objects=False, water_chance=0.2, seed=3,
+                  cols=20, rows=20, wombats=300, snakes=60)
+    for _ in range(700):
+        game.step(STEP)
+    path = str(tmp_path / "herd.ckpt")
+    checkpoint.save(game, path)
+    resumed = checkpoint.load(path, headless=True)
+    for step in range(300):
+        game.step(STEP)
+        resumed.step(STEP)
+        assert replay.digest(resumed) == replay.digest(game), step
+
+
+def test_food_ties_do_not_depend_on_food_order():
+    rng = np.random.default_rng(0)
+    points = rng.integers(0, 30, (2000, 2)) * 96.0 + 48
+    for count in (400, 5):
+        food = np.unique(rng.integers(0, 30, (count, 2)), axis=0) * 96.0
+        shuffled = food[rng.permutation(len(food))]
+        grid = FoodGrid(96)
+        grid.rebuild(food)
+        index, distance = grid.nearest(points)
+        grid.rebuild(shuffled)
+        shuffled_index, shuffled_distance = grid.nearest(points)
+        assert (food[index] == shuffled[shuffled_index]).all()
+        assert (distance == shuffled_distance).all()
@@ -0,0 +1,20 @@
+import numpy as np
+
+from ecosim import EcoSim, Wombat, Snake
+
+
+def test_walking_herd_animals_pick_passable_targets():
+    game = EcoSim(headless=True, herd=True, seed=5, cols=20, rows=20, wombats=300,
+                  snakes=60, tile_objects=False, water_chance=0.2)
+    for _ in range(1200):
+        game.step(1 / 60)
+    herd = game.herd
+    herd.sync()
+    animals = herd.get_animals()
+    walkers = np.flatnonzero(herd.mask_of(Wombat) | herd.mask_of(Snake))
+    blocked = game.impassable_tiles()
+    for slot in walkers.tolist():
+        target = animals[slot].target
+        col = int(target.x // EcoSim.TILE_SIZE)
+        row = int(target.y // EcoSim.TILE_SIZE)
+        assert not blocked[row, col]
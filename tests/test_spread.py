@@ -0,0 +1,28 @@
+import replay
+from ecosim import EcoSim, Grass
+
+
+STEP = 1 / 60
+
+
+def run(**options):
+    game = EcoSim(headless=True, seed=11, cols=20, rows=15, **options)
+    planted = game.count_population()["Grass"]
+    for _ in range(3000):
+        game.step(STEP)
+    return game, planted
+
+
+def test_grass_spreads_without_tile_objects():
+    game, planted = run(tile_objects=False, water_chance=0.1)
+    assert game.count_population()["Grass"] > planted
+    for grass in game.get_game_objs_of_type(Grass):
+        col = int(grass.get_x() // EcoSim.TILE_SIZE)
+        row = int(grass.get_y() // EcoSim.TILE_SIZE)
+        assert game.terrain_at(col, row) == 'dirt_tile'
+
+
+def test_grass_spreads_the_same_with_and_without_tile_objects():
+    with_tiles, _ = run()
+    without_tiles, _ = run(tile_objects=False)
+    assert replay.digest(without_tiles) == replay.digest(with_tiles)
@@ -0,0 +1,208 @@
+'''A cellular automaton for grass and flowers on the tile grid.
+
+VegetationGrid models vegetation as NumPy arrays over the tiles instead
+of one GameObject per tuft. Each step, every empty fertile tile may be
+colonised from its four neighbours with a single stencil pass over the
+whole grid. Sprites are only created or destroyed for the tiles whose
+state changed. NumPy is optional; it is only needed when a
+VegetationGrid is created.
+'''
+try:
+    import numpy as np
+except ImportError:
+    np = None
+from game import Vector2D
+
+
+
+EMPTY = 0
+GRASS = 1
+FLOWER = 2
+
+
+class VegetationGrid:
+    '''VegetationGrid holds the vegetation state of a grid of tiles.
+
+    fertile marks the tiles vegetation can grow on, state holds EMPTY,
+    GRASS or FLOWER for each tile, and biomass grows from 0 to 1 while a
+    tile is covered. All arrays are indexed [row, col].
+
+    A covered tile spreads to each empty fertile neighbour at the rate
+    given for its kind, in colonisations per second. The automaton runs
+    every interval simulated seconds. If a sprite factory is given and
+    the Game draws into a renderer, factory(kind, position) is called to
+    create a sprite for every newly covered tile, and the sprite's
+    destroy method is called when the tile is cleared. If a Viewport
+    calls set_view, sprites only exist for the tiles it shows.
+    '''
+
+    SPREAD_RATES = {GRASS: 1 / 50, FLOWER: 1 / 40}
+    GROWTH_RATE = 0.1
+    NEW_BIOMASS = 0.1
+
+    def __init__(self, game, cols, rows, tile_size=96, factory=None, interval=0.25,
+                 seed=None):
+        '''Creates a VegetationGrid of cols * rows tiles with nothing fertile.
+
+        Raises an ImportError if NumPy is not installed.
+        '''
+        if np is None:
+            raise ImportError("VegetationGrid requires numpy")
+        self.__game = game
+        self.cols = cols
+        self.rows = rows
+        self.tile_size = tile_size
+        self.interval = interval
+        self.__factory = factory
+        self.__rng = np.random.default_rng(seed)
+        self.__elapsed = 0.0
+        self.fertile = np.zeros((rows, cols), dtype=bool)
+        self.state = np.zeros((rows, cols), dtype=np.int8)
+        self.biomass = np.zeros((rows, cols), dtype=np.float32)
+        self.__shown = np.zeros((rows, cols), dtype=np.int8)
+        self.__sprites = {}
+        self.__view = (0, rows, 0, cols)
+
+    def get_state(self):
+        '''Returns a dictionary with the state of the automaton that is not
+        held in its arrays: the seconds since it last ran and the state of
+        its random number generator.'''
+        return {"elapsed": self.__elapsed, "rng": self.__rng.bit_generator.state}
+
+    def set_state(self, state):
+        '''Restores a dictionary returned by get_state.'''
+        self.__elapsed = state["elapsed"]
+        self.__rng.bit_generator.state = state["rng"]
+
+    def set_fertile(self, col, row, fertile=True):
+        '''Marks whether vegetation can grow on the tile at col, row.'''
+        self.fertile[row, col] = fertile
+
+    def get(self, col, row):
+        '''Returns EMPTY, GRASS or FLOWER for the tile at col, row.'''
+        return int(self.state[row, col])
+
+    def plant(self, col, row, kind=GRASS):
+        '''Covers the tile at col, row with the given kind of vegetation.'''
+        if self.state[row, col] != kind:
+            self.state[row, col] = kind
+            self.biomass[row, col] = VegetationGrid.NEW_BIOMASS
+            self.sync(np.array([row * self.cols + col]))
+
+    def clear(self, col, row):
+        '''Removes the vegetation from the tile at col, row.
+
+        Returns the biomass that was on the tile.
+        '''
+        biomass = float(self.biomass[row, col])
+        if self.state[row, col] != EMPTY:
+            self.state[row, col] = EMPTY
+            self.biomass[row, col] = 0
+            self.sync(np.array([row * self.cols + col]))
+        return biomass
+
+    def positions(self, kind):
+        '''Returns the tiles covered by kind as a (n, 2) array of (col, row),
+        and their top-left positions as a (n, 2) array of (x, y).'''
+        rows, cols = np.nonzero(self.state == kind)
+        cells = np.stack((cols, rows), axis=1)
+        return cells, cells * float(self.tile_size)
+
+    def forget(self, sprite):
+        '''Called when a sprite created by the factory is destroyed by
+        something other than this grid. Clears the sprite's tile.'''
+        col = int(sprite.get_x() // self.tile_size)
+        row = int(sprite.get_y() // self.tile_size)
+        index = row * self.cols + col
+        if self.__sprites.get(index) is sprite:
+            del self.__sprites[index]
+            self.__shown[row, col] = EMPTY
+            self.state[row, col] = EMPTY
+            self.biomass[row, col] = 0
+
+    def set_view(self, first_col, first_row, end_col, end_row):
+        '''Limits sprites to the given tiles, where end is exclusive.'''
+        self.__view = (max(0, first_row), min(self.rows, end_row),
+                       max(0, first_col), min(self.cols, end_col))
+        first_row, end_row, first_col, end_col = self.__view
+        shown = self.__shown.ravel()
+        for index in list(self.__sprites):
+            row, col = divmod(index, self.cols)
+            if not (first_row <= row < end_row and first_col <= col < end_col):
+                sprite = self.__sprites.pop(index)
+                shown[index] = EMPTY
+                sprite.destroy()
+        self.sync()
+
+    def coverage(self, kind=None):
+        '''Returns the fraction of fertile tiles covered by vegetation,
+        or only by the given kind.'''
+        fertile = int(self.fertile.sum())
+        if fertile == 0:
+            return 0.0
+        if kind == None:
+            covered = np.count_nonzero(self.state)
+        else:
+            covered = np.count_nonzero(self.state == kind)
+        return covered / fertile
+
+    def neighbours(self, kind):
+        '''Returns, for every tile, how many of its four neighbours hold kind.'''
+        source = (self.state == kind).view(np.int8)
+        count = np.zeros((self.rows, self.cols), dtype=np.int8)
+        count[1:, :] += source[:-1, :]
+        count[:-1, :] += source[1:, :]
+        count[:, 1:] += source[:, :-1]
+        count[:, :-1] += source[:, 1:]
+        return count
+
+    def update(self, seconds):
+        '''Runs the automaton once every interval simulated seconds.'''
+        self.__elapsed += seconds
+        if self.__elapsed < self.interval:
+            return
+        self.step(self.__elapsed)
+        self.__elapsed = 0.0
+
+    def step(self, seconds):
+        '''Spreads and grows vegetation as if seconds had passed.'''
+        covered = self.state != EMPTY
+        self.biomass[covered] += (VegetationGrid.GROWTH_RATE * seconds
+                                  * (1 - self.biomass[covered]))
+        empty = self.fertile & ~covered
+        for kind, rate in VegetationGrid.SPREAD_RATES.items():
+            chance = 1 - np.exp(-rate * seconds * self.neighbours(kind))
+            grown = empty & (self.__rng.random((self.rows, self.cols)) < chance)
+            if grown.any():
+                self.state[grown] = kind
+                self.biomass[grown] = VegetationGrid.NEW_BIOMASS
+                empty &= ~grown
+        self.sync()
+
+    def sync(self, cells=None):
+        '''Creates or destroys sprites for tiles whose state changed.
+
+        cells may limit the check to an array of flat tile indices.
+        '''
+        if self.__factory == None or self.__game.get_window().get_renderer() == None:
+            return
+        first_row, end_row, first_col, end_col = self.__view
+        state = self.state.ravel()
+        shown = self.__shown.ravel()
+        if cells is None:
+            rows, cols = np.nonzero(self.state[first_row:end_row, first_col:end_col]
+                                    != self.__shown[first_row:end_row, first_col:end_col])
+            cells = (rows + first_row) * self.cols + cols + first_col
+        for index in cells.tolist():
+            if state[index] == shown[index]:
+                continue
+            row, col = divmod(index, self.cols)
+            if not (first_row <= row < end_row and first_col <= col < end_col):
+                continue
+            sprite = self.__sprites.pop(index, None)
+            shown[index] = state[index]
+            if sprite != None:
+                sprite.destroy()
+            if state[index] != EMPTY:
+                position = Vector2D(col * self.tile_size, row * self.tile_size)
+                self.__sprites[index] = self.__factory(int(state[index]), position)
@@ -0,0 +1,120 @@
+'''Viewport culling for worlds larger than the window.
+
+The world is divided into square chunks. A Viewport knows which part of
+the world the canvas currently shows, and only GameObjects in chunks
+that intersect it keep a canvas item. Objects in other chunks are still
+updated, but are hidden: they have no canvas item and cost nothing to
+draw. Panning shows and hides whole chunks at a time.
+'''
+from spatial import SpatialHash
+
+
+
+class Viewport:
+    '''Viewport is the visible part of a world of world_width * world_height pixels.
+
+    GameObjects are tracked by the chunk containing their centre, and are
+    shown or hidden when they cross into or out of the visible chunks.
+    Other layers, such as a TerrainLayer or VegetationGrid, may be added
+    with add_listener; their set_view(first_col, first_row, end_col,
+    end_row) method is called with the visible tiles whenever they change.
+    '''
+
+    def __init__(self, game, world_width, world_height, chunk_size, tile_size=96):
+        '''Creates a Viewport at the top-left of the world, the size of the
+        Game window's canvas. chunk_size is given in pixels.'''
+        self.__game = game
+        self.__window = game.get_window()
+        self.world_width = world_width
+        self.world_height = world_height
+        self.chunk_size = chunk_size
+        self.tile_size = tile_size
+        self.width = min(self.__window.get_canvas_width(), world_width)
+        self.height = min(self.__window.get_canvas_height(), world_height)
+        self.x = 0
+        self.y = 0
+        self.__chunks = SpatialHash(chunk_size)
+        self.__listeners = []
+        self.__window.set_scroll_region(world_width, world_height)
+        self.__bounds = self.__chunk_bounds()
+
+    def __chunk_bounds(self):
+        first_col, first_row = self.__chunks.cell_of(self.x, self.y)
+        last_col, last_row = self.__chunks.cell_of(self.x + self.width - 1,
+                                                   self.y + self.height - 1)
+        return (first_col, first_row, last_col, last_row)
+
+    def get_bounds(self):
+        '''Returns the visible chunks as (first_col, first_row, last_col, last_row).'''
+        return self.__bounds
+
+    def get_tile_bounds(self):
+        '''Returns the tiles of the visible chunks as
+        (first_col, first_row, end_col, end_row), where end is exclusive.'''
+        tiles = self.chunk_size // self.tile_size
+        first_col, first_row, last_col, last_row = self.__bounds
+        return (first_col * tiles, first_row * tiles,
+                (last_col + 1) * tiles, (last_row + 1) * tiles)
+
+    def contains(self, obj):
+        '''Returns True if the object's centre is in a visible chunk.'''
+        col, row = self.__chunks.cell_of(obj.get_x() + obj.get_width() / 2,
+                                         obj.get_y() + obj.get_height() / 2)
+        first_col, first_row, last_col, last_row = self.__bounds
+        return first_col <= col <= last_col and first_row <= row <= last_row
+
+    def add_listener(self, layer):
+        '''Calls layer.set_view with the visible tiles now and after every change.'''
+        self.__listeners.append(layer)
+        layer.set_view(*self.get_tile_bounds())
+
+    def track(self, obj):
+        '''Starts showing and hiding the object as it enters and leaves the view.'''
+        self.__chunks.insert(obj)
+
+    def untrack(self, obj):
+        '''Stops tracking the object.'''
+        self.__chunks.remove(obj)
+
+    def moved(self, obj):
+        '''Shows or hides the object after it has moved.'''
+        self.__chunks.update(obj)
+        if self.contains(obj):
+            if obj.is_hidden():
+                obj.show()
+        elif not obj.is_hidden():
+            obj.hide()
+
+    def pan(self, dx, dy):
+        '''Moves the view by dx, dy pixels.'''
+        self.scroll_to(self.x + dx, self.y + dy)
+
+    def scroll_to(self, x, y):
+        '''Moves the top-left of the view to x, y, kept inside the world.'''
+        self.x = max(0, min(x, self.world_width - self.width))
+        self.y = max(0, min(y, self.world_height - self.height))
+        self.__window.scroll_to(self.x, self.y)
+        old = self.__bounds
+        new = self.__chunk_bounds()
+        if new == old:
+            return
+        self.__bounds = new
+        for col, row in self.__chunks_of(old):
+            if not self.__inside(col, row, new):
+                for obj in self.__chunks.at(col, row):
+                    obj.hide()
+        for col, row in self.__chunks_of(new):
+            if not self.__inside(col, row, old):
+                for obj in self.__chunks.at(col, row):
+                    obj.show()
+        for layer in self.__listeners:
+            layer.set_view(*self.get_tile_bounds())
+
+    def __chunks_of(self, bounds):
+        first_col, first_row, last_col, last_row = bounds
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                yield (col, row)
+
+    def __inside(self, col, row, bounds):
+        return bounds[0] <= col <= bounds[2] and bounds[1] <= row <= bounds[3]